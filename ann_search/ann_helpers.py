@@ -0,0 +1,32 @@
+from vector_codec import decode_vector, get_scale_field
+
+def get_vector_field(config):
+    return "embedding.{0}.{1}".format(config.embedding_type, config.embedding_field)
+
+def get_scan_query(config, extra_filters=None):
+    """Returns the query reading the id and stored vector of every embedded doc.
+    """
+    field = get_vector_field(config)
+    source_fields = [field]
+    if config.embedding_precision == "int8":
+        source_fields.append(get_scale_field(field))
+    query = {
+        "_source": source_fields,
+        "query": {
+            "bool": {
+                "filter": [{
+                    "exists": {
+                        "field": field
+                    }
+                }] + (extra_filters if extra_filters else [])
+            }
+        }
+    }
+    return query
+
+def get_hit_vector(hit, config):
+    """Decodes the stored vector of a hit returned by get_scan_query.
+    """
+    embedding = hit["embedding"][config.embedding_type]
+    scale = embedding[get_scale_field(config.embedding_field)] if config.embedding_precision == "int8" else None
+    return decode_vector(embedding[config.embedding_field], scale)
@@ -0,0 +1,402 @@
+"""
+Approximate nearest neighbor (HNSW) index over the stored tweet embeddings, so semantic
+search does not need a brute-force script_score scan over every filtered document.
+
+The labels of the index are the tweet ids. Tweet ids are snowflake ids that encode their
+creation time, so date-range filters are id-range filters and need no per-vector metadata.
+
+An index directory holds a base index (index.bin, index.json) and a deltas directory of
+vector batches appended since the base was saved (see append_delta). Readers apply the
+deltas on top of the base (see AnnIndex.apply_deltas), so appended vectors are searchable
+without rebuilding, and the ANN server periodically saves its index as the new base and
+deletes the deltas merged into it (see AnnIndex.compact). Every compaction records the last
+delta it merged in index.json, so the other readers of the directory notice the new base and
+reload it instead of missing the deleted deltas they had not applied yet.
+"""
+import calendar
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+import numpy as np
+import hnswlib
+
+#first millisecond of the snowflake ids (2010-11-04T01:42:54.657Z)
+TWITTER_EPOCH_MS = 1288834974657
+
+INDEX_FILENAME = "index.bin"
+META_FILENAME = "index.json"
+DELTA_DIRNAME = "deltas"
+
+#max number of vectors added per write lock, so queries are not blocked for a whole delta
+ADD_CHUNK_SIZE = 1000
+
+def get_min_tweet_id(date):
+    """Returns the smallest snowflake tweet id created on or after the start of a UTC day.
+    """
+    day_ms = calendar.timegm(date.timetuple()) * 1000
+    return max(day_ms - TWITTER_EPOCH_MS, 0) << 22
+
+def get_id_range(start_date=None, end_date=None):
+    """Returns the tweet id range of a UTC date range with inclusive start and end days,
+    like the created_at filter of aspects.get_query.
+
+    Returns:
+        Tuple of (min id, max id exclusive). Either bound is None if its date is None.
+    """
+    min_id = get_min_tweet_id(start_date) if start_date is not None else None
+    max_id = get_min_tweet_id(end_date + timedelta(days=1)) if end_date is not None else None
+    return min_id, max_id
+
+class ReadWriteLock(object):
+    """Lock held by any number of readers or by a single writer. Waiting writers keep new
+    readers out, so a steady stream of queries cannot starve them.
+
+    hnswlib allows concurrent queries, but not queries concurrent with adding items.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            while self.writing or self.writers_waiting > 0:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if self.readers == 0:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.condition:
+            self.writers_waiting += 1
+            while self.writing or self.readers > 0:
+                self.condition.wait()
+            self.writers_waiting -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+class AnnIndex(object):
+    """HNSW index of tweet vectors labeled by tweet id, with date-range filtered queries.
+
+    """
+    def __init__(self, dim, space="cosine", m=16, ef_construction=200, ef_search=128, max_elements=100000, field=None):
+        """Initializes an empty AnnIndex instance.
+
+        Args:
+            dim: number of vector dimensions.
+            space: hnswlib distance ("cosine", "ip" or "l2").
+            m: number of graph links per element (higher is more accurate and uses more memory).
+            ef_construction: size of the candidate list when inserting.
+            ef_search: size of the candidate list when querying (hnswlib raises it to k if smaller).
+            max_elements: initial capacity (grown as needed).
+            field: name of the Elasticsearch field the vectors come from.
+        """
+        self.meta = {
+            "dim": dim,
+            "space": space,
+            "m": m,
+            "ef_construction": ef_construction,
+            "field": field
+        }
+        self.ef_search = ef_search
+        self.lock = ReadWriteLock()
+        self.applied_deltas = set()
+        self.index = hnswlib.Index(space=space, dim=dim)
+        self.index.init_index(max_elements=max_elements, ef_construction=ef_construction, M=m)
+        self.index.set_ef(ef_search)
+
+    @staticmethod
+    def load(index_dir, ef_search=128):
+        """Loads an index saved with save.
+
+        Args:
+            index_dir: directory of the index.
+            ef_search: size of the candidate list when querying.
+        """
+        with open(os.path.join(index_dir, META_FILENAME), "r") as f:
+            meta = json.load(f)
+        ann_index = AnnIndex.__new__(AnnIndex)
+        ann_index.meta = meta
+        ann_index.ef_search = ef_search
+        ann_index.lock = ReadWriteLock()
+        ann_index.applied_deltas = set()
+        ann_index.index = hnswlib.Index(space=meta["space"], dim=meta["dim"])
+        ann_index.index.load_index(os.path.join(index_dir, INDEX_FILENAME))
+        ann_index.index.set_ef(ef_search)
+        return ann_index
+
+    def save(self, index_dir):
+        """Saves the index, replacing the files atomically so a reader never loads a
+        partially written index. Queries keep running while the index is saved.
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        index_filepath = os.path.join(index_dir, INDEX_FILENAME)
+        meta_filepath = os.path.join(index_dir, META_FILENAME)
+        with self.lock.read():
+            self.index.save_index(index_filepath + ".tmp")
+            meta = dict(self.meta, count=self.index.get_current_count())
+        with open(meta_filepath + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(index_filepath + ".tmp", index_filepath)
+        os.replace(meta_filepath + ".tmp", meta_filepath)
+
+    def apply_deltas(self, index_dir):
+        """Adds the vectors of the deltas appended since the last call. If another process
+        compacted the directory since the base was loaded, the new base is loaded with the
+        remaining deltas applied and swapped in (holding both indices in memory meanwhile).
+
+        Returns:
+            Number of deltas applied.
+        """
+        meta = read_meta(index_dir)
+        if meta is not None and meta.get("compacted_delta") != self.meta.get("compacted_delta"):
+            return self._reload(index_dir)
+
+        names = list_deltas(index_dir)
+        num_applied = 0
+        for name in names:
+            if name in self.applied_deltas:
+                continue
+            try:
+                ids, vecs = load_delta(index_dir, name)
+            except FileNotFoundError:
+                #merged into the base by a compaction in the meantime
+                continue
+            self.add(ids, vecs)
+            self.applied_deltas.add(name)
+            num_applied += 1
+        #forget the deltas merged into the base by compactions
+        self.applied_deltas.intersection_update(names)
+        return num_applied
+
+    def compact(self, index_dir, min_age_secs=60):
+        """Saves the index as the base index of a directory and deletes the applied deltas it
+        now contains. Needs no memory beyond the index itself, since the vectors are already
+        in it. Other readers of the directory reload the new base on their next apply_deltas,
+        so they do not miss the deleted deltas. Only one process should compact a directory,
+        and not concurrently with apply_deltas.
+
+        Args:
+            index_dir: directory of the index.
+            min_age_secs: only deltas older than this are deleted, so other readers usually
+                apply them before they are deleted and rarely need to reload the base.
+
+        Returns:
+            Number of deltas deleted.
+        """
+        now = time.time()
+        names = []
+        for name in sorted(self.applied_deltas):
+            try:
+                if now - os.path.getmtime(os.path.join(index_dir, DELTA_DIRNAME, "{0}.npz".format(name))) > min_age_secs:
+                    names.append(name)
+            except FileNotFoundError:
+                continue
+        if len(names) == 0:
+            return 0
+
+        start_time = time.perf_counter()
+        #the new mark tells the other readers to reload the base before the deltas are deleted
+        self.meta["compacted_delta"] = names[-1]
+        self.save(index_dir)
+        for name in names:
+            try:
+                os.remove(os.path.join(index_dir, DELTA_DIRNAME, "{0}.npz".format(name)))
+            except FileNotFoundError:
+                continue
+        logging.info("Compacted {0} deltas into the index of {1} vectors in {2:.1f} secs.".format(
+            len(names), len(self), time.perf_counter() - start_time))
+        return len(names)
+
+    def _reload(self, index_dir):
+        ann_index = AnnIndex.load(index_dir, self.ef_search)
+        #the deltas merged into the base but not deleted yet are applied again, which only
+        #replaces their vectors
+        num_applied = ann_index.apply_deltas(index_dir)
+        with self.lock.write():
+            self.index = ann_index.index
+            self.meta = ann_index.meta
+            self.applied_deltas = ann_index.applied_deltas
+        logging.info("Reloaded the base index of {0} vectors compacted up to {1}.".format(
+            len(self), self.meta.get("compacted_delta")))
+        return num_applied
+
+    def __len__(self):
+        return self.index.get_current_count()
+
+    def add(self, ids, vecs):
+        """Adds vectors to the index. The vector of an id already in the index is replaced.
+        Queries wait for at most ADD_CHUNK_SIZE vectors at a time.
+
+        Args:
+            ids: list or array of tweet ids.
+            vecs: 2-D array of vectors parallel to ids.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vecs = np.asarray(vecs, dtype=np.float32)
+        for start in range(0, len(ids), ADD_CHUNK_SIZE):
+            end = start + ADD_CHUNK_SIZE
+            with self.lock.write():
+                needed = self.index.get_current_count() + len(ids[start:end])
+                if needed > self.index.get_max_elements():
+                    self.index.resize_index(max(needed, 2 * self.index.get_max_elements()))
+                self.index.add_items(vecs[start:end], ids[start:end])
+
+    def query(self, vec, k, start_date=None, end_date=None, filter_mode="pre"):
+        """Returns the k nearest neighbors of a vector among the tweets created in a date range.
+
+        Args:
+            vec: query vector.
+            k: number of neighbors.
+            start_date: optional first UTC day (inclusive).
+            end_date: optional last UTC day (inclusive).
+            filter_mode: "pre" skips tweets outside the date range while searching the graph,
+                "post" searches for more neighbors than needed and drops the ones outside the
+                range afterwards, searching wider until k are found (faster for wide ranges).
+
+        Returns:
+            Tuple of (array of tweet ids, array of similarity scores), most similar first.
+        """
+        min_id, max_id = get_id_range(start_date, end_date)
+        in_range = None
+        if min_id is not None or max_id is not None:
+            min_id = min_id if min_id is not None else 0
+            max_id = max_id if max_id is not None else np.iinfo(np.int64).max
+            in_range = lambda label: min_id <= label < max_id
+        vec = np.asarray(vec, dtype=np.float32).reshape(1, -1)
+
+        with self.lock.read():
+            count = self.index.get_current_count()
+            k = min(k, count)
+            if k == 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            if in_range is None:
+                labels, distances = self._knn_query(vec, k)
+            elif filter_mode == "pre":
+                labels, distances = self._knn_query(vec, k, in_range)
+            elif filter_mode == "post":
+                #over-fetch until k neighbors fall in the range or the whole index was searched
+                fetch = k
+                while True:
+                    fetch = min(fetch * 4, count)
+                    labels, distances = self._knn_query(vec, fetch)
+                    mask = (labels >= min_id) & (labels < max_id)
+                    if mask.sum() >= k or fetch == count:
+                        break
+                labels, distances = labels[mask][:k], distances[mask][:k]
+            else:
+                raise ValueError("Unknown filter mode '{0}'. Valid modes: ['pre', 'post']".format(filter_mode))
+
+        #hnswlib returns distances: 1 - similarity for "cosine" and "ip"
+        scores = -distances if self.meta["space"] == "l2" else 1.0 - distances
+        return labels.astype(np.int64), scores.astype(np.float32)
+
+    def _knn_query(self, vec, k, filter=None):
+        #hnswlib fails when fewer than k elements pass the filter, so search for the largest
+        #k that succeeds (lo is known to succeed, hi to fail)
+        labels, distances = np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.float32)
+        lo, hi = 0, k + 1
+        try_k = k
+        while lo + 1 < hi:
+            try:
+                result = self.index.knn_query(vec, k=try_k, filter=filter)
+                labels, distances = result[0][0], result[1][0]
+                lo = try_k
+            except RuntimeError:
+                hi = try_k
+            try_k = (lo + hi) // 2
+        return labels, distances
+
+def open_index(index_dir, ef_search=128, space="cosine", m=16, ef_construction=200, field=None):
+    """Loads the base index of an index directory and applies its deltas. Without a base
+    index (vectors were appended before build_ann_index.py first ran), starts from an empty
+    index with the dimensions of the first delta.
+
+    Args:
+        index_dir: directory of the index.
+        ef_search: size of the candidate list when querying.
+        space, m, ef_construction, field: settings of a new index (see AnnIndex).
+
+    Returns:
+        Tuple of (AnnIndex, number of deltas applied).
+
+    Raises:
+        FileNotFoundError: if the directory has neither a base index nor deltas.
+    """
+    if os.path.exists(os.path.join(index_dir, META_FILENAME)):
+        ann_index = AnnIndex.load(index_dir, ef_search)
+    else:
+        ann_index = None
+        for name in list_deltas(index_dir):
+            try:
+                ids, vecs = load_delta(index_dir, name)
+            except FileNotFoundError:
+                continue
+            if len(ids) > 0:
+                ann_index = AnnIndex(vecs.shape[1], space, m, ef_construction, ef_search, field=field)
+                break
+        if ann_index is None:
+            raise FileNotFoundError("No ANN index or appended vectors found in '{0}'. "
+                                    "Run build_ann_index.py to build the index.".format(index_dir))
+    return ann_index, ann_index.apply_deltas(index_dir)
+
+def read_meta(index_dir):
+    """Returns the metadata of the base index of an index directory, or None if there is none.
+    """
+    try:
+        with open(os.path.join(index_dir, META_FILENAME), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def append_delta(index_dir, ids, vecs, writer_id=None):
+    """Appends a batch of vectors to the deltas of an index directory.
+
+    Args:
+        index_dir: directory of the index.
+        ids: list of tweet ids.
+        vecs: 2-D array of vectors parallel to ids.
+        writer_id: unique name of the writer (defaults to host-pid), so several writers can
+            append to the same directory.
+    """
+    delta_dir = os.path.join(index_dir, DELTA_DIRNAME)
+    os.makedirs(delta_dir, exist_ok=True)
+    if writer_id is None:
+        writer_id = "{0}-{1}".format(socket.gethostname(), os.getpid())
+    name = "delta-{0:020d}-{1}".format(time.time_ns(), writer_id)
+    tmp_filepath = os.path.join(delta_dir, "{0}.tmp".format(name))
+    with open(tmp_filepath, "wb") as f:
+        np.savez(f, ids=np.asarray(ids, dtype=np.int64), vecs=np.asarray(vecs, dtype=np.float32))
+    os.replace(tmp_filepath, os.path.join(delta_dir, "{0}.npz".format(name)))
+    return name
+
+def list_deltas(index_dir):
+    """Returns the names of the deltas of an index directory, oldest first.
+    """
+    filepaths = glob.glob(os.path.join(index_dir, DELTA_DIRNAME, "delta-*.npz"))
+    return sorted(os.path.basename(filepath)[:-len(".npz")] for filepath in filepaths)
+
+def load_delta(index_dir, name):
+    """Returns the (ids, vecs) arrays of a delta.
+    """
+    with np.load(os.path.join(index_dir, DELTA_DIRNAME, "{0}.npz".format(name))) as delta:
+        return delta["ids"], delta["vecs"]
@@ -0,0 +1,131 @@
+"""
+Local query API of the ANN index: top-k tweet ids for a query vector, optionally
+restricted to a date range.
+
+Example:
+    python ann_server.py -c config.json -p 8081
+
+    POST /query {"vector": [...], "k": 1000, "start_date": "2020-03-01", "end_date": "2020-03-31"}
+    -> {"ids": ["1234...", ...], "scores": [0.83, ...]}
+"""
+from flask import Flask, Response, request
+from flask_restful import Resource, Api
+from datetime import datetime
+from ann_index import open_index
+from config import Config
+import argparse
+import ann_helpers
+import logging
+import threading
+import time
+import metrics
+
+requests_total = metrics.REGISTRY.counter("ann_server_requests_total", "Number of ANN queries.")
+query_seconds = metrics.REGISTRY.histogram("ann_server_query_seconds", "Duration of an ANN query.")
+index_size = metrics.REGISTRY.gauge("ann_server_index_size", "Number of vectors in the ANN index.")
+deltas_applied = metrics.REGISTRY.counter("ann_server_deltas_applied_total", "Number of appended vector batches applied to the ANN index.")
+compact_seconds = metrics.REGISTRY.histogram("ann_server_compact_seconds", "Duration of an ANN index compaction.")
+
+def parse_date(date_str):
+    return datetime.strptime(date_str, "%Y-%m-%d").date() if date_str else None
+
+def refresh_loop(ann_index, index_dir, refresh_secs, compact_secs, compact_min_age_secs):
+    #compactions run on this thread, so they never overlap with applying deltas
+    last_compact = time.monotonic()
+    while True:
+        time.sleep(refresh_secs)
+        try:
+            deltas_applied.inc(ann_index.apply_deltas(index_dir))
+            index_size.set(len(ann_index))
+        except Exception as ex:
+            logging.exception("Exception occurred while applying the appended vectors.")
+        if compact_secs > 0 and time.monotonic() - last_compact >= compact_secs:
+            last_compact = time.monotonic()
+            try:
+                with compact_seconds.time():
+                    ann_index.compact(index_dir, compact_min_age_secs)
+            except Exception as ex:
+                logging.exception("Exception occurred while compacting the ANN index.")
+
+def start():
+    parser = argparse.ArgumentParser("Run the ANN search service")
+    parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
+    parser.add_argument("--port", "-p", default="8081", required=False, type=int, help="Port to run server on.")
+    args = parser.parse_args()
+
+    print()
+    print("Running with arguments:")
+    print(args)
+    print()
+
+    config = Config.load(args.configfile)
+
+    ann_index, num_applied = open_index(config.ann_index_dir, config.ann_ef_search, config.ann_space, config.ann_m,
+                                        config.ann_ef_construction, ann_helpers.get_vector_field(config))
+    deltas_applied.inc(num_applied)
+    index_size.set(len(ann_index))
+    if config.ann_refresh_secs > 0:
+        #make the vectors appended by the embedder searchable within seconds
+        threading.Thread(target=refresh_loop, args=(ann_index, config.ann_index_dir, config.ann_refresh_secs,
+                                                    config.ann_compact_secs, config.ann_compact_min_age_secs),
+                         name="AnnRefresh", daemon=True).start()
+    print("Loaded the index of {0} vectors of '{1}'.".format(len(ann_index), ann_index.meta["field"]))
+    print()
+
+    app = Flask(__name__)
+    api = Api(app)
+
+    class Query(Resource):
+        def post(self):
+            body = request.get_json(force=True, silent=True)
+            if not isinstance(body, dict) or not isinstance(body.get("vector"), list):
+                return {
+                    "error": "expected a json body with a 'vector' list"
+                }, 400
+            if len(body["vector"]) != ann_index.meta["dim"]:
+                return {
+                    "error": "expected a vector of {0} dimensions".format(ann_index.meta["dim"])
+                }, 400
+            try:
+                start_date = parse_date(body.get("start_date"))
+                end_date = parse_date(body.get("end_date"))
+            except ValueError:
+                return {
+                    "error": "expected dates in yyyy-MM-dd format"
+                }, 400
+
+            filter_mode = body.get("filter_mode", "pre")
+            if filter_mode not in ("pre", "post"):
+                return {
+                    "error": "expected a filter_mode of 'pre' or 'post'"
+                }, 400
+
+            requests_total.inc()
+            with query_seconds.time():
+                ids, scores = ann_index.query(body["vector"], int(body.get("k", 100)), start_date, end_date, filter_mode)
+            #ids are strings like Elasticsearch doc ids (and so they survive JSON parsers using doubles)
+            return {
+                "ids": [str(tweet_id) for tweet_id in ids.tolist()],
+                "scores": scores.tolist()
+            }
+
+    class Stats(Resource):
+        def get(self):
+            return dict(ann_index.meta, count=len(ann_index))
+
+    api.add_resource(Query, "/query")
+    api.add_resource(Stats, "/stats")
+
+    def get_metrics():
+        return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+    if config.metrics_app_route:
+        app.add_url_rule("/metrics", "metrics", get_metrics)
+    if config.metrics_port > 0:
+        metrics.start_metrics_server(config.metrics_port)
+        print("Serving metrics at http://127.0.0.1:{0}/metrics".format(config.metrics_port))
+        print()
+    app.run(debug=False, port=args.port, host="0.0.0.0", threaded=True)
+
+if __name__ == "__main__":
+    start()
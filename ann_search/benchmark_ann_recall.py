@@ -0,0 +1,116 @@
+"""
+Recall and latency benchmark of the ANN index against the exact script_score results of
+Elasticsearch, using stored vectors of randomly sampled docs as queries.
+
+Example:
+    python benchmark_ann_recall.py -c config.json --queries 100 --k 100 --ef 64 128 256
+    python benchmark_ann_recall.py -c config.json --startdate 2020-03-01 --enddate 2020-03-31
+"""
+import argparse
+import time
+from datetime import datetime
+import numpy as np
+import ann_helpers
+import es_client
+from ann_index import AnnIndex
+from elasticsearch_dsl import Search
+
+from config import Config
+
+def get_date_filters(start_date, end_date):
+    if start_date is None and end_date is None:
+        return []
+    date_range = {
+        "format": "strict_date",
+        "time_zone": "+00:00"
+    }
+    if start_date is not None:
+        date_range["gte"] = start_date.strftime("%Y-%m-%d")
+    if end_date is not None:
+        date_range["lte"] = end_date.strftime("%Y-%m-%d")
+    return [{"range": {"created_at": date_range}}]
+
+def sample_query_vectors(es, config, num_queries, seed):
+    s = Search(using=es, index=config.elasticsearch_index_name)
+    s = s.params(size=num_queries)
+    query = ann_helpers.get_scan_query(config)
+    query["query"] = {
+        "function_score": {
+            "query": query["query"],
+            "random_score": {"seed": seed, "field": "_seq_no"}
+        }
+    }
+    s.update_from_dict(query)
+    return [ann_helpers.get_hit_vector(hit, config) for hit in s.execute()]
+
+def exact_query(es, config, vec, k, date_filters):
+    field = ann_helpers.get_vector_field(config)
+    s = Search(using=es, index=config.elasticsearch_index_name)
+    s = s.params(size=k)
+    s.update_from_dict({
+        "_source": False,
+        "query": {
+            "script_score": {
+                "query": {
+                    "bool": {
+                        "filter": [{"exists": {"field": field}}] + date_filters
+                    }
+                },
+                "script": {
+                    "source": "cosineSimilarity(params.query_vector, '{0}') + 1.0".format(field),
+                    "params": {"query_vector": vec.tolist()}
+                }
+            }
+        }
+    })
+    return [int(hit.meta["id"]) for hit in s.execute()]
+
+def start():
+    parser = argparse.ArgumentParser("Benchmark the recall of the ANN index against exact script_score search")
+    parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
+    parser.add_argument("--queries", type=int, default=100, required=False, help="Number of sampled query vectors.")
+    parser.add_argument("--k", type=int, default=100, required=False, help="Number of nearest neighbors.")
+    parser.add_argument("--ef", type=int, nargs="+", default=[64, 128, 256], required=False, help="Query candidate list size(s) to benchmark.")
+    parser.add_argument("--startdate", required=False, help="Optional first day yyyy-MM-dd of the date filter (inclusive).")
+    parser.add_argument("--enddate", required=False, help="Optional last day yyyy-MM-dd of the date filter (inclusive).")
+    parser.add_argument("--seed", type=int, default=42, required=False, help="Random seed for sampling the queries.")
+    args = parser.parse_args()
+
+    config = Config.load(args.configfile)
+    start_date = datetime.strptime(args.startdate, "%Y-%m-%d").date() if args.startdate else None
+    end_date = datetime.strptime(args.enddate, "%Y-%m-%d").date() if args.enddate else None
+
+    es = es_client.create_client_from_config(config)
+    ann_index = AnnIndex.load(config.ann_index_dir)
+    ann_index.apply_deltas(config.ann_index_dir)
+    print("Loaded the index of {0} vectors of '{1}'.".format(len(ann_index), ann_index.meta["field"]))
+
+    vecs = sample_query_vectors(es, config, args.queries, args.seed)
+    print("Running {0} exact queries with script_score...".format(len(vecs)))
+    date_filters = get_date_filters(start_date, end_date)
+    exact_ids = []
+    exact_secs = []
+    for vec in vecs:
+        query_start = time.perf_counter()
+        exact_ids.append(exact_query(es, config, vec, args.k, date_filters))
+        exact_secs.append(time.perf_counter() - query_start)
+    print("script_score: p50 {0:.1f} ms, p95 {1:.1f} ms".format(np.percentile(exact_secs, 50) * 1000, np.percentile(exact_secs, 95) * 1000))
+    print()
+
+    for filter_mode in ("pre", "post"):
+        for ef in args.ef:
+            ann_index.ef_search = ef
+            recalls = []
+            ann_secs = []
+            for vec, exact in zip(vecs, exact_ids):
+                query_start = time.perf_counter()
+                ids, _ = ann_index.query(vec, args.k, start_date, end_date, filter_mode)
+                ann_secs.append(time.perf_counter() - query_start)
+                if len(exact) > 0:
+                    recalls.append(len(set(exact) & set(ids.tolist())) / len(exact))
+            print("ANN {0}-filter ef={1}: recall@{2} mean {3:.4f} min {4:.4f}, p50 {5:.2f} ms, p95 {6:.2f} ms".format(
+                filter_mode, ef, args.k, np.mean(recalls), np.min(recalls),
+                np.percentile(ann_secs, 50) * 1000, np.percentile(ann_secs, 95) * 1000))
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,81 @@
+"""
+Builds the ANN index of a vector field from the embeddings stored in Elasticsearch.
+
+Example:
+    python build_ann_index.py -c config.json
+"""
+import argparse
+import logging
+import time
+import numpy as np
+import ann_helpers
+import es_client
+from ann_index import AnnIndex
+from elasticsearch_dsl import Search
+
+from config import Config
+
+def start():
+    parser = argparse.ArgumentParser("Build the ANN index from the stored embeddings")
+    parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
+    parser.add_argument("--logfile", "-l", default="annbuildlog.txt", required=False, help="Path to the log file to write to.")
+    args = parser.parse_args()
+
+    print()
+    print("Running with arguments:")
+    print(args)
+    print()
+
+    config = Config.load(args.configfile)
+
+    #Configure logging
+    logging.basicConfig(filename=args.logfile, 
+                        format="[%(asctime)s - %(levelname)s]: %(message)s", 
+                        level=logging.getLevelName(config.log_level))
+
+    es = es_client.create_client_from_config(config)
+
+    s = Search(using=es, index=config.elasticsearch_index_name)
+    s = s.params(size=config.elasticsearch_batch_size)
+    s.update_from_dict(ann_helpers.get_scan_query(config))
+    total = s.count()
+    print("Indexing {0} vectors of '{1}' from '{2}'...".format(total, ann_helpers.get_vector_field(config), config.elasticsearch_index_name))
+    print()
+
+    def add_batch(ann_index, ids, vecs):
+        if ann_index is None:
+            ann_index = AnnIndex(len(vecs[0]), config.ann_space, config.ann_m, config.ann_ef_construction,
+                                 config.ann_ef_search, max(total, 1), ann_helpers.get_vector_field(config))
+        ann_index.add(ids, np.vstack(vecs))
+        return ann_index
+
+    start_time = time.perf_counter()
+    ann_index = None
+    ids = []
+    vecs = []
+    num_added = 0
+    for hit in s.scan():
+        ids.append(int(hit.meta["id"]))
+        vecs.append(ann_helpers.get_hit_vector(hit, config))
+        if len(ids) == config.elasticsearch_batch_size:
+            ann_index = add_batch(ann_index, ids, vecs)
+            num_added += len(ids)
+            ids.clear()
+            vecs.clear()
+            elapsed = time.perf_counter() - start_time
+            print("Indexed {0}/{1} vectors, {2:.0f} vectors/sec".format(num_added, total, num_added / elapsed))
+
+    if len(ids) > 0:
+        ann_index = add_batch(ann_index, ids, vecs)
+        num_added += len(ids)
+
+    if ann_index is None:
+        print("No vectors found. Nothing to index.")
+        return
+
+    ann_index.save(config.ann_index_dir)
+    print()
+    print("Saved the index of {0} vectors to {1} in {2:.0f} secs.".format(num_added, config.ann_index_dir, time.perf_counter() - start_time))
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,66 @@
+"""
+Config class containing all the settings for running the ANN search sidecar
+"""
+
+import jsonpickle
+
+class Config(object):
+    """Container for ANN search sidecar settings.
+
+    """
+    def __init__(self):
+        """Initializes the Config instance.
+        """
+        #Elasticsearch settings
+        self.elasticsearch_host = ""
+        self.elasticsearch_verify_certs = False
+        self.elasticsearch_index_name = ""
+        self.elasticsearch_batch_size = 2000
+        self.elasticsearch_timeout_secs = 30
+        self.elasticsearch_http_compress = True
+        self.elasticsearch_max_connections = 10
+        self.elasticsearch_max_retries = 3
+        self.elasticsearch_retry_on_timeout = True
+        self.elasticsearch_retry_backoff_secs = 0.5
+        self.elasticsearch_sniff = False
+
+        #Embedding settings
+        self.embedding_type = "sbert"
+        #vector field indexed, e.g. "quoted" for the aspect modeling queries
+        self.embedding_field = "quoted"
+        #encoding of the stored vectors, the embedder's embedding_precision
+        self.embedding_precision = "float32"
+
+        #ANN index settings
+        self.ann_index_dir = ""
+        self.ann_space = "cosine"
+        self.ann_m = 16
+        self.ann_ef_construction = 200
+        self.ann_ef_search = 128
+        #interval of applying the vectors appended by the embedder (see embedder ann_* settings)
+        self.ann_refresh_secs = 5
+        #interval of saving the index with the applied vectors as the new base index and deleting
+        #them from the deltas (0 disables it; enable it on a single server per ann_index_dir).
+        #the server saves the index it already holds, so this costs no extra memory. other servers
+        #reading the directory reload the new base, holding two copies of the index meanwhile
+        self.ann_compact_secs = 0
+        self.ann_compact_min_age_secs = 60
+
+        #Metrics settings
+        #metrics are served on a separate port bound to localhost (0 disables them); the public
+        #app only serves /metrics if metrics_app_route is set
+        self.metrics_port = 0
+        self.metrics_app_route = False
+        self.log_level = "ERROR"
+
+    @staticmethod
+    def load(filepath):
+        """Loads the config from a JSON file.
+
+        Args:
+            filepath: path of the JSON file.
+        """
+        with open(filepath, "r") as file:
+            json = file.read()
+        config = jsonpickle.decode(json)
+        return config
@@ -1,3 +1,5 @@
+import json
+import urllib.request
 import numpy as np
 import umap
 import matplotlib.pyplot as plt
@@ -13,6 +15,7 @@ from gensim.utils import simple_preprocess
 from gensim.models.coherencemodel import CoherenceModel
 
 import cluster_helpers 
+from vector_codec import encode_vector, decode_vector, get_scale_field
 
 def text_wrap(text):
     return "<br>".join(wrap(text, width=80))
@@ -41,7 +44,14 @@ def get_base_filters(embedding_type):
         }
     }]
 
-def get_query(embedding_type, query_embedding, date_range):
+def get_source_fields(embedding_type, embedding_precision="float32"):
+    source_fields = ["id_str", "text", "extended_tweet.full_text", "quoted_status.text", 
+                     "quoted_status.extended_tweet.full_text", f"embedding.{embedding_type}.primary"]
+    if embedding_precision == "int8":
+        source_fields.append(get_scale_field(f"embedding.{embedding_type}.primary"))
+    return source_fields
+
+def get_query(embedding_type, query_embedding, date_range, embedding_precision="float32"):
     additional_filters = []
     if len(date_range) > 0:
         additional_filters.append({
@@ -56,9 +66,16 @@ def get_query(embedding_type, query_embedding, date_range):
         if len(date_range) > 1:
             additional_filters[-1]["range"]["created_at"]["lte"] = date_range[1].strftime("%Y-%m-%d")
 
+    similarity_function = "dotProduct"
+    query_vector = query_embedding.tolist()
+    if embedding_precision == "int8":
+        # int8 vectors carry a per-vector scale, which cosine similarity is invariant to.
+        # the query is quantized the same way so it matches the byte vector field
+        similarity_function = "cosineSimilarity"
+        query_vector = encode_vector(query_embedding, "int8")[0]
+
     query = {
-        "_source": ["id_str", "text", "extended_tweet.full_text", "quoted_status.text", 
-                    "quoted_status.extended_tweet.full_text", f"embedding.{embedding_type}.primary"],
+        "_source": get_source_fields(embedding_type, embedding_precision),
         "query": {
             "script_score": {
                 "query": {
@@ -67,15 +84,39 @@ def get_query(embedding_type, query_embedding, date_range):
                     }
                 },
                 "script": {
-                    "source": f"dotProduct(params.query_vector, 'embedding.{embedding_type}.quoted') + 1.0",
-                    "params": {"query_vector": query_embedding.tolist()}
+                    "source": f"{similarity_function}(params.query_vector, 'embedding.{embedding_type}.quoted') + 1.0",
+                    "params": {"query_vector": query_vector}
                 }
             }
         }
     }
     return query
 
-def run_query(es_uri, es_index, embedding_type, embedding_model, query, date_range, max_results=1000):
+def get_ids_query(embedding_type, ids, embedding_precision="float32"):
+    return {
+        "_source": get_source_fields(embedding_type, embedding_precision),
+        "query": {
+            "bool": {
+                "filter": get_base_filters(embedding_type) + [{"ids": {"values": ids}}]
+            }
+        }
+    }
+
+def query_ann(ann_url, query_embedding, date_range, max_results):
+    # Get the nearest neighbor ids and scores from the ANN search service (ann_search/ann_server.py)
+    body = {"vector": query_embedding.tolist(), "k": max_results}
+    if len(date_range) > 0:
+        body["start_date"] = date_range[0].strftime("%Y-%m-%d")
+        if len(date_range) > 1:
+            body["end_date"] = date_range[1].strftime("%Y-%m-%d")
+    request = urllib.request.Request(f"{ann_url.rstrip('/')}/query", data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        results = json.loads(response.read())
+    return results["ids"], results["scores"]
+
+def run_query(es_uri, es_index, embedding_type, embedding_model, query, date_range, max_results=1000,
+              embedding_precision="float32", ann_url=None):
     # Embed query
     if embedding_type == "sbert":
         query_embedding = embedding_model.encode(query, normalize_embeddings=True)
@@ -87,20 +128,32 @@ def run_query(es_uri, es_index, embedding_type, embedding_model, query, date_ran
     # Use query embeddings to get responses to similar tweets
     with Elasticsearch(hosts=[es_uri], timeout=60, verify_certs=False) as es:
         s = Search(using=es, index=es_index)
-        s = s.params(size=max_results)
-        s.update_from_dict(get_query(embedding_type, query_embedding, date_range))
+        if ann_url:
+            # Fetch only the candidates found by the ANN index instead of scoring every doc,
+            # keeping the ANN ranking
+            ann_ids, ann_scores = query_ann(ann_url, query_embedding, date_range, max_results)
+            s = s.params(size=len(ann_ids))
+            s.update_from_dict(get_ids_query(embedding_type, ann_ids, embedding_precision))
+            hits_by_id = {hit.meta.id: hit for hit in s.execute()} if len(ann_ids) > 0 else {}
+            scored_hits = [(hits_by_id[hit_id], score) for hit_id, score in zip(ann_ids, ann_scores) if hit_id in hits_by_id]
+        else:
+            s = s.params(size=max_results)
+            s.update_from_dict(get_query(embedding_type, query_embedding, date_range, embedding_precision))
+            scored_hits = [(hit, hit.meta.score-1.0) for hit in s.execute()]
 
         tweet_text = []
         tweet_text_display = []
         tweet_embeddings = []
         tweet_scores = []
-        for hit in s.execute():
-            tweet_embeddings.append(np.array(hit["embedding"][embedding_type]["primary"]))
+        for hit, score in scored_hits:
+            hit_embedding = hit["embedding"][embedding_type]
+            tweet_embeddings.append(decode_vector(hit_embedding["primary"], 
+                                                  hit_embedding[get_scale_field("primary")] if embedding_precision == "int8" else None))
             text, quoted_text = get_tweet_text(hit)
             tweet_text.append((quoted_text, text))
             tweet_text_display.append(f"Tweet:<br>----------<br>{text_wrap(quoted_text)}<br><br>"
                                       f"Response:<br>----------<br>{text_wrap(text)}")
-            tweet_scores.append(hit.meta.score-1.0)
+            tweet_scores.append(score)
             if len(tweet_embeddings) == max_results:
                 break
 
@@ -0,0 +1,50 @@
+"""
+Compact encodings of embedding vectors for storage in Elasticsearch, and the matching
+decode helpers for consumers reading them back.
+"""
+import numpy as np
+
+#"float32" stores vectors as is, "rounded" rounds each component to a fixed number of
+#decimals (much shorter JSON, within float16 precision for unit vectors), and "int8"
+#stores components as bytes in [-127, 127] with a per-vector scale factor
+PRECISIONS = ("float32", "rounded", "int8")
+
+def encode_vector(vec, precision="float32", round_digits=4):
+    """Encodes a vector for indexing.
+
+    Args:
+        vec: numpy vector.
+        precision: one of PRECISIONS.
+        round_digits: number of decimals kept by the "rounded" precision.
+
+    Returns:
+        Tuple of (list of components, scale factor). The scale factor is None unless the
+        precision is "int8".
+    """
+    if precision == "float32":
+        return np.asarray(vec, dtype=np.float32).tolist(), None
+    if precision == "rounded":
+        return np.round(np.asarray(vec, dtype=np.float32), round_digits).tolist(), None
+    if precision == "int8":
+        vec = np.asarray(vec, dtype=np.float32)
+        max_abs = float(np.abs(vec).max())
+        scale = max_abs / 127 if max_abs > 0 else 1.0
+        return np.round(vec / scale).astype(np.int8).tolist(), scale
+    raise ValueError("Unknown embedding precision '{0}'. Valid precisions: {1}".format(precision, list(PRECISIONS)))
+
+def decode_vector(values, scale=None):
+    """Decodes a vector read from Elasticsearch back to a float32 numpy vector.
+
+    Args:
+        values: list of components.
+        scale: the scale factor stored with an "int8" vector, or None.
+    """
+    vec = np.asarray(values, dtype=np.float32)
+    if scale is not None:
+        vec = vec * np.float32(scale)
+    return vec
+
+def get_scale_field(field):
+    """Returns the name of the field holding the scale factor of an "int8" vector field.
+    """
+    return "{0}_scale".format(field)
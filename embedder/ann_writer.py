@@ -0,0 +1,68 @@
+"""
+Incremental maintenance of the ANN search index (see ann_search) by the embedder: the
+vectors of every written batch are appended to the index directory, where the ANN
+server picks them up within seconds and periodically compacts them into the base index.
+"""
+import numpy as np
+import metrics
+from ann_index import append_delta
+from vector_codec import decode_vector, get_scale_field
+
+vectors_appended = metrics.REGISTRY.counter("embedder_ann_vectors_appended_total", "Number of vectors appended to the ANN index.")
+
+class AnnWriter(object):
+    """Appends the vectors of one embedding field to an ANN index directory.
+
+    """
+    def __init__(self, index_dir, embedding_type, embedding_field, precision="float32", writer_id=None):
+        """Initializes the AnnWriter instance.
+
+        Args:
+            index_dir: directory of the ANN index.
+            embedding_type: embedding type of the indexed vectors (e.g. "sbert").
+            embedding_field: indexed field of that type ("primary", "quoted" or "quoted_concat").
+            precision: vector encoding of the updates (see vector_codec.PRECISIONS). The vectors
+                are indexed as decoded from the updates, like when the index is built from
+                Elasticsearch.
+            writer_id: unique name of this writer (defaults to host-pid).
+        """
+        self.index_dir = index_dir
+        self.embedding_type = embedding_type
+        self.embedding_field = embedding_field
+        self.precision = precision
+        self.writer_id = writer_id
+
+    @staticmethod
+    def from_config(config):
+        """Returns the AnnWriter configured by the ann_* settings, or None if the
+        embedder does not maintain an ANN index.
+
+        Args:
+            config: embedder Config instance.
+        """
+        if not config.ann_index_dir:
+            return None
+        return AnnWriter(config.ann_index_dir, config.ann_embedding_type, config.ann_embedding_field,
+                         config.embedding_precision, config.worker_id if config.worker_id else None)
+
+    def append(self, type_fields):
+        """Appends the vectors of a written batch.
+
+        Args:
+            type_fields: dict of embedding type to the dict returned by
+                embedder_helpers.get_embedding_fields.
+        """
+        fields = type_fields.get(self.embedding_type)
+        if not fields:
+            return
+        ids = []
+        vecs = []
+        scale_field = get_scale_field(self.embedding_field)
+        for hit_id, hit_fields in fields.items():
+            if self.embedding_field in hit_fields:
+                ids.append(int(hit_id))
+                vecs.append(decode_vector(hit_fields[self.embedding_field], hit_fields.get(scale_field)))
+        if len(ids) == 0:
+            return
+        append_delta(self.index_dir, ids, np.vstack(vecs), self.writer_id)
+        vectors_appended.inc(len(ids))
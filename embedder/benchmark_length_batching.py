@@ -0,0 +1,104 @@
+"""
+Benchmark of length-bucketed batching against fixed-size arrival-order batching for SBERT
+embedding, run on the text length distribution of real tweets.
+
+Example:
+    python benchmark_length_batching.py -d "./data/*.jsonl" --sample 20000 --maxtokens 8192 16384
+"""
+import argparse
+import glob
+import json
+import random
+import time
+import numpy as np
+import embedder_helpers
+from sentence_transformers import SentenceTransformer
+from clean_text import clean_text
+from length_batching import get_token_lengths, get_length_batches, get_padding_stats, run_length_batched
+
+from config import Config
+
+def read_tweet_texts(filenames, sample_size, seed):
+    """Reads the cleaned text of the tweets in json (one tweet per file) or jsonl files,
+    skipping retweets like the embedder does.
+    """
+    texts = []
+    for filename in filenames:
+        with open(filename, "r", encoding="utf-8") as f:
+            lines = f if filename.endswith(".jsonl") else [f.read()]
+            for line in lines:
+                if not line.strip():
+                    continue
+                tweet = json.loads(line)
+                if "retweeted_status" in tweet:
+                    continue
+                text, quoted_text = embedder_helpers.get_tweet_text(tweet)
+                texts.append(clean_text(text))
+                if quoted_text is not None:
+                    texts.append(clean_text(quoted_text))
+    random.Random(seed).shuffle(texts)
+    return texts[:sample_size] if sample_size > 0 else texts
+
+def start():
+    parser = argparse.ArgumentParser("Benchmark length-bucketed batching for SBERT embedding")
+    parser.add_argument("--datasetglob", "-d", required=True, help="glob pattern specifying the tweet json or jsonl file(s). Ex: './data/*.jsonl'")
+    parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
+    parser.add_argument("--sample", type=int, default=10000, required=False, help="Number of texts to embed (0 for all).")
+    parser.add_argument("--maxtokens", type=int, nargs="+", default=[8192, 16384], required=False, help="Token budget(s) per batch to benchmark.")
+    parser.add_argument("--statsonly", action="store_true", required=False, help="Only report padding stats without running the model.")
+    parser.add_argument("--seed", type=int, default=42, required=False, help="Random seed for sampling the texts.")
+    args = parser.parse_args()
+
+    config = Config.load(args.configfile)
+
+    texts = read_tweet_texts(sorted(glob.glob(args.datasetglob)), args.sample, args.seed)
+    print("Benchmarking with {0} texts...".format(len(texts)))
+
+    sbert = SentenceTransformer(config.sbert_model_name)
+    sbert.max_seq_length = config.sbert_max_seq_length
+    lengths = get_token_lengths(sbert.tokenizer, texts, config.sbert_max_seq_length)
+    print("Token lengths: mean {0:.1f}, median {1}, p95 {2}, max {3}".format(
+        np.mean(lengths), int(np.median(lengths)), int(np.percentile(lengths, 95)), max(lengths)))
+    print()
+
+    #fixed-size batches in arrival order
+    batch_size = config.sbert_batch_size
+    fixed_batches = [list(range(i, min(i + batch_size, len(texts)))) for i in range(0, len(texts), batch_size)]
+    real_tokens, padded_tokens = get_padding_stats(lengths, fixed_batches)
+    print("Fixed batches of {0}: {1} batches, {2:.1%} of processed tokens are padding".format(
+        batch_size, len(fixed_batches), 1 - real_tokens / padded_tokens))
+    for max_tokens in args.maxtokens:
+        batches = get_length_batches(lengths, max_tokens, batch_size)
+        real_tokens, padded_tokens = get_padding_stats(lengths, batches)
+        print("Length-bucketed batches under {0} tokens: {1} batches, {2:.1%} of processed tokens are padding".format(
+            max_tokens, len(batches), 1 - real_tokens / padded_tokens))
+    print()
+
+    if args.statsonly:
+        return
+
+    def encode_fixed():
+        #encode each arrival-order batch on its own (sbert.encode would sort the whole input)
+        return np.concatenate([sbert.encode([texts[i] for i in batch], batch_size=len(batch), normalize_embeddings=True)
+                               for batch in fixed_batches], axis=0)
+
+    #warm up the model
+    sbert.encode(texts[:batch_size], batch_size=batch_size)
+
+    start_time = time.perf_counter()
+    fixed_vecs = encode_fixed()
+    fixed_secs = time.perf_counter() - start_time
+    print("Fixed batches: {0:.2f} secs, {1:.0f} texts/sec".format(fixed_secs, len(texts) / fixed_secs))
+
+    for max_tokens in args.maxtokens:
+        start_time = time.perf_counter()
+        vecs = np.array(run_length_batched(texts, lengths,
+                                           lambda batch: sbert.encode(batch, batch_size=len(batch), normalize_embeddings=True),
+                                           max_tokens, batch_size))
+        secs = time.perf_counter() - start_time
+        max_diff = np.abs(vecs - fixed_vecs).max()
+        print("Length-bucketed under {0} tokens: {1:.2f} secs, {2:.0f} texts/sec, {3:.2f}x speedup (max abs diff {4:.2e})".format(
+            max_tokens, secs, len(texts) / secs, fixed_secs / secs, max_diff))
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,70 @@
+"""
+Parity check and throughput benchmark of the ONNX Runtime SBERT backend (fp32 and int8
+quantized) against SentenceTransformer in PyTorch, on a sample of real tweets.
+
+Example:
+    python benchmark_onnx_encoder.py -d "./data/*.jsonl" --sample 5000
+"""
+import argparse
+import glob
+import os
+import time
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from benchmark_length_batching import read_tweet_texts
+from onnx_encoder import OnnxSentenceEncoder, get_model_dir, export_model
+
+from config import Config
+
+def time_encode(encoder, texts, batch_size):
+    #warm up
+    encoder.encode(texts[:batch_size], batch_size=batch_size, normalize_embeddings=True)
+    start_time = time.perf_counter()
+    vecs = encoder.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+    return vecs, time.perf_counter() - start_time
+
+def start():
+    parser = argparse.ArgumentParser("Check parity and benchmark the ONNX Runtime SBERT backend")
+    parser.add_argument("--datasetglob", "-d", required=True, help="glob pattern specifying the tweet json or jsonl file(s). Ex: './data/*.jsonl'")
+    parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
+    parser.add_argument("--sample", type=int, default=5000, required=False, help="Number of texts to embed (0 for all).")
+    parser.add_argument("--batchsize", type=int, default=64, required=False, help="Number of texts per inference call.")
+    parser.add_argument("--mincosine", type=float, default=0.99, required=False, help="Min cosine agreement with PyTorch for the parity check to pass.")
+    parser.add_argument("--seed", type=int, default=42, required=False, help="Random seed for sampling the texts.")
+    args = parser.parse_args()
+
+    config = Config.load(args.configfile)
+
+    texts = read_tweet_texts(sorted(glob.glob(args.datasetglob)), args.sample, args.seed)
+    print("Benchmarking with {0} texts...".format(len(texts)))
+    print()
+
+    sbert = SentenceTransformer(config.sbert_model_name, device="cpu")
+    sbert.max_seq_length = config.sbert_max_seq_length
+    torch_vecs, torch_secs = time_encode(sbert, texts, args.batchsize)
+    print("PyTorch: {0:.2f} secs, {1:.0f} texts/sec".format(torch_secs, len(texts) / torch_secs))
+
+    passed = True
+    for quantize in (False, True):
+        model_dir = get_model_dir(config.onnx_cache_dir, config.sbert_model_name, quantize)
+        if not os.path.exists(os.path.join(model_dir, "model.onnx")):
+            export_model(config.sbert_model_name, model_dir, quantize)
+        encoder = OnnxSentenceEncoder(model_dir, config.sbert_max_seq_length, config.onnx_threads)
+        vecs, secs = time_encode(encoder, texts, args.batchsize)
+
+        #both sets of vectors are normalized, so the row-wise dot product is the cosine similarity
+        cosines = np.sum(vecs * torch_vecs, axis=1)
+        name = "ONNX int8" if quantize else "ONNX fp32"
+        print("{0}: {1:.2f} secs, {2:.0f} texts/sec, {3:.2f}x speedup, cosine to PyTorch min {4:.6f} mean {5:.6f}"
+              .format(name, secs, len(texts) / secs, torch_secs / secs, cosines.min(), cosines.mean()))
+        if cosines.min() < args.mincosine:
+            print("{0} parity check FAILED: min cosine {1:.6f} < {2}".format(name, cosines.min(), args.mincosine))
+            passed = False
+
+    print()
+    print("Parity check passed." if passed else "Parity check failed.")
+    return passed
+
+if __name__ == "__main__":
+    if not start():
+        raise SystemExit(1)
@@ -0,0 +1,59 @@
+"""
+Accuracy check of the reduced-precision vector encodings against full-precision vectors:
+JSON payload size, reconstruction error and nearest neighbor recall on real tweets.
+
+Example:
+    python check_vector_precision.py -d "./data/*.jsonl" --sample 20000 --k 10
+"""
+import argparse
+import glob
+import json
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from benchmark_length_batching import read_tweet_texts
+from vector_codec import PRECISIONS, encode_vector, decode_vector
+
+from config import Config
+
+def start():
+    parser = argparse.ArgumentParser("Check the accuracy of reduced-precision embedding vectors")
+    parser.add_argument("--datasetglob", "-d", required=True, help="glob pattern specifying the tweet json or jsonl file(s). Ex: './data/*.jsonl'")
+    parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
+    parser.add_argument("--sample", type=int, default=10000, required=False, help="Number of texts to embed (0 for all).")
+    parser.add_argument("--queries", type=int, default=200, required=False, help="Number of sampled texts used as nearest neighbor queries.")
+    parser.add_argument("--k", type=int, default=10, required=False, help="Number of nearest neighbors for the recall check.")
+    parser.add_argument("--seed", type=int, default=42, required=False, help="Random seed for sampling the texts.")
+    args = parser.parse_args()
+
+    config = Config.load(args.configfile)
+
+    texts = read_tweet_texts(sorted(glob.glob(args.datasetglob)), args.sample, args.seed)
+    print("Embedding {0} texts with SBERT...".format(len(texts)))
+    sbert = SentenceTransformer(config.sbert_model_name)
+    sbert.max_seq_length = config.sbert_max_seq_length
+    vecs = sbert.encode(texts, batch_size=config.sbert_batch_size, normalize_embeddings=True).astype(np.float32)
+
+    rng = np.random.default_rng(args.seed)
+    query_idx = rng.choice(len(vecs), size=min(args.queries, len(vecs)), replace=False)
+    true_neighbors = np.argsort(-(vecs[query_idx] @ vecs.T), axis=1)[:, :args.k]
+    print()
+
+    for precision in PRECISIONS:
+        encoded = [encode_vector(vec, precision, config.embedding_round_digits) for vec in vecs]
+        decoded = np.vstack([decode_vector(values, scale) for values, scale in encoded])
+        json_bytes = np.mean([len(json.dumps(values)) for values, _ in encoded])
+
+        #cosine similarity between each vector and its decoded version
+        norms = np.linalg.norm(decoded, axis=1) * np.linalg.norm(vecs, axis=1)
+        self_similarity = np.sum(decoded * vecs, axis=1) / norms
+        max_abs_error = np.abs(decoded - vecs).max()
+
+        #recall@k of the nearest neighbors found with the decoded vectors (full-precision queries)
+        neighbors = np.argsort(-(vecs[query_idx] @ decoded.T), axis=1)[:, :args.k]
+        recall = np.mean([len(set(true_neighbors[i]) & set(neighbors[i])) / args.k for i in range(len(query_idx))])
+
+        print("{0}: {1:.0f} JSON bytes/vector, min cosine to full precision {2:.6f}, max abs error {3:.2e}, recall@{4} {5:.4f}"
+              .format(precision, json_bytes, self_similarity.min(), max_abs_error, args.k, recall))
+
+if __name__ == "__main__":
+    start()
@@ -17,20 +17,77 @@ class Config(object):
         self.elasticsearch_index_name = ""
         self.elasticsearch_batch_size = 500
         self.elasticsearch_timeout_secs = 30
+        self.elasticsearch_http_compress = True
+        self.elasticsearch_max_connections = 10
+        self.elasticsearch_max_retries = 3
+        self.elasticsearch_retry_on_timeout = True
+        self.elasticsearch_retry_backoff_secs = 0.5
+        self.elasticsearch_sniff = False
 
         #Embedding settings
         self.use_large_tfhub_url = ""
         self.use_large_batch_size = 128
         self.sbert_model_name = ""
         self.sbert_batch_size = 128
+        self.sbert_max_batch_tokens = 0
+        #"torch", or "onnx" to run SBERT with ONNX Runtime (exported to onnx_cache_dir on first use)
+        self.sbert_backend = "torch"
+        self.onnx_cache_dir = "onnx_models"
+        self.onnx_quantize = False
+        self.onnx_threads = 0
         self.bert_max_seq_length = 512
         self.embedding_type="use_large"
+        #embedding types populated in one pass (defaults to [embedding_type] if empty)
+        self.embedding_types = []
+        #vector encoding: "float32", "rounded" (embedding_round_digits decimals) or "int8" (with scale factor).
+        #"rounded" and "int8" are lossy opt-ins; readers of the vectors must use the same setting
+        self.embedding_precision = "float32"
+        self.embedding_round_digits = 4
 
         #Processing settings
         self.sleep_idle_secs = 5
-        self.sleep_not_idle_secs = 0.01
+        self.pipeline_queue_size = 2
+        self.pipeline_bulk_threads = 1
+        self.metrics_port = 0
+        self.enrichment_cache_size = 0
+        self.enrichment_cache_filepath = ""
         self.log_level = "ERROR"
 
+        #Work discovery settings
+        #"query" runs the existence query for every batch; "cursor" (opt-in) walks the index with
+        #a high-water mark cursor persisted to work_cursor_filepath, with periodic gap fills
+        self.work_discovery_mode = "query"
+        self.work_cursor_filepath = ""
+        self.work_cursor_field = "id"
+        self.work_cursor_gap_fill_secs = 3600
+        self.work_cursor_gap_fill_max_attempts = 3
+
+        #Worker sharding settings
+        self.worker_count = 1
+        self.worker_index = 0
+        self.worker_num_slices = 0
+        self.worker_lease_secs = 0
+        self.worker_lease_index = ""
+        self.worker_id = ""
+
+        #ANN index settings (see ann_search), an empty ann_index_dir disables appending
+        self.ann_index_dir = ""
+        self.ann_embedding_type = "sbert"
+        self.ann_embedding_field = "quoted"
+
+        #Embed server settings
+        #concurrent requests are coalesced into one model call of up to max_batch_size texts,
+        #waiting at most max_wait_ms after the first request
+        self.embed_server_max_batch_size = 64
+        self.embed_server_max_wait_ms = 5
+        #LRU of query vectors (0 disables it); the TTL is also the max-age sent to HTTP clients
+        self.embed_server_cache_size = 0
+        self.embed_server_cache_ttl_secs = 3600
+        #the embed server's metrics are served on a separate port bound to localhost (0 disables
+        #them); the public app only serves /metrics if embed_server_metrics_app_route is set
+        self.embed_server_metrics_port = 0
+        self.embed_server_metrics_app_route = False
+
     @staticmethod
     def load(filepath):
         """Loads the config from a JSON file.
@@ -0,0 +1,114 @@
+"""
+Offline bulk embedding of exported tweets (jsonl(.gz) dumps or Elasticsearch scan exports)
+into sharded .npy files keyed by tweet id, for re-embedding whole historical collections
+at full batch throughput without polling Elasticsearch. The shards are pushed back to
+Elasticsearch with tools/enrichment_loader.
+
+Example:
+    python embed_offline.py -d "./data/*.jsonl.gz" -o ./embeddings --processes 2
+"""
+import argparse
+import glob
+import logging
+import time
+import numpy as np
+import embedder_helpers
+from clean_text import clean_text
+from enrichment_cache import EnrichmentCache
+from enrichment_shards import enrich_files, get_tweet_id
+
+from config import Config
+
+EMBEDDING_FIELDS = ("primary", "quoted", "quoted_concat")
+
+def load_enrich_function(configfile):
+    """Loads the configured embedding models (runs once in each worker process) and returns
+    the function embedding a list of tweets into shard fields.
+    """
+    config = Config.load(configfile)
+    embedding_types = embedder_helpers.get_embedding_types(config)
+    models = embedder_helpers.load_embedders(config, embedding_types)
+    #only dedupe repeated texts in memory; the on-disk cache is not shared between processes
+    cache = EnrichmentCache(config.enrichment_cache_size) if config.enrichment_cache_size > 0 else None
+
+    def embed_tweets(tweets):
+        ids = []
+        embed_text = []
+        #(row, field index) of each text
+        embed_rows = []
+        for tweet in tweets:
+            if "retweeted_status" in tweet:
+                continue
+            row = len(ids)
+            ids.append(get_tweet_id(tweet))
+            text, quoted_text = embedder_helpers.get_tweet_text(tweet)
+            text = clean_text(text)
+            embed_text.append(text)
+            embed_rows.append((row, 0))
+            if quoted_text is not None:
+                quoted_text = clean_text(quoted_text)
+                embed_text.append(quoted_text)
+                embed_text.append("{0} {1}".format(quoted_text, text))
+                embed_rows.append((row, 1))
+                embed_rows.append((row, 2))
+
+        fields = {}
+        if len(embed_text) == 0:
+            return ids, fields
+        for embedding_type, (embed, model_id) in models.items():
+            vecs = (np.array(cache.get_or_compute(model_id, embed_text, embed)) if cache is not None
+                    else np.asarray(embed(embed_text)))
+            type_fields = [np.full((len(ids), vecs.shape[1]), np.nan, dtype=np.float32) for _ in EMBEDDING_FIELDS]
+            for (row, field_index), vec in zip(embed_rows, vecs):
+                type_fields[field_index][row] = vec
+            for field, values in zip(EMBEDDING_FIELDS, type_fields):
+                fields["embedding.{0}.{1}".format(embedding_type, field)] = values
+        return ids, fields
+
+    return embed_tweets
+
+def start():
+    parser = argparse.ArgumentParser("Embed exported tweets offline into .npy shards")
+    parser.add_argument("--datasetglob", "-d", required=True, help="glob pattern specifying the tweet json, jsonl or jsonl.gz file(s). Ex: './data/*.jsonl.gz'")
+    parser.add_argument("--outputdir", "-o", required=True, help="Directory to write the shards to.")
+    parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
+    parser.add_argument("--logfile", "-l", default="embedofflinelog.txt", required=False, help="Path to the log file to write to.")
+    parser.add_argument("--processes", "-p", type=int, default=1, required=False, help="Number of worker processes (each loads its own copy of the models).")
+    parser.add_argument("--shardsize", type=int, default=100000, required=False, help="Number of input tweets per shard.")
+    args = parser.parse_args()
+
+    print()
+    print("Running with arguments:")
+    print(args)
+    print()
+
+    config = Config.load(args.configfile)
+
+    #Configure logging
+    logging.basicConfig(filename=args.logfile,
+                        format="[%(asctime)s - %(levelname)s]: %(message)s",
+                        level=logging.getLevelName(config.log_level))
+
+    paths = sorted(glob.glob(args.datasetglob))
+    print("Embedding {0} file(s) with {1} process(es)...".format(len(paths), args.processes))
+    print()
+
+    start_time = time.perf_counter()
+    total_tweets = 0
+    failed = []
+    for path, num_tweets, error in enrich_files(paths, args.outputdir, load_enrich_function, (args.configfile,),
+                                                args.shardsize, args.processes):
+        if error is not None:
+            failed.append(path)
+            print("Failed {0}: {1!r}".format(path, error))
+            continue
+        total_tweets += num_tweets
+        elapsed = time.perf_counter() - start_time
+        print("Embedded {0} ({1} tweets). Cumulative total: {2} tweets, {3:.0f} tweets/sec".format(
+            path, num_tweets, total_tweets, total_tweets / elapsed))
+
+    print()
+    print("Done with {0} failed file(s). Rerun to retry them.".format(len(failed)))
+
+if __name__ == "__main__":
+    start()
@@ -1,11 +1,23 @@
-from flask import Flask
+from flask import Flask, Response, request
 from flask_restful import Resource, Api
 from clean_text import clean_text
+from embedder_helpers import get_embedding_types, get_model_id, load_sbert
+from micro_batcher import MicroBatcher
+from query_cache import QueryCache
+from enrichment_cache import get_key
 from config import Config
-from sentence_transformers import SentenceTransformer
 import tensorflow_hub as hub
 import numpy as np
 import argparse
+import hashlib
+import metrics
+
+requests_total = metrics.REGISTRY.counter("embed_server_requests_total", "Number of embedding requests.")
+texts_total = metrics.REGISTRY.counter("embed_server_texts_total", "Number of texts embedded.")
+model_seconds = metrics.REGISTRY.histogram("embed_server_model_seconds", "Duration of embedding the texts of a request (including batching wait).")
+cache_hits = metrics.REGISTRY.counter("embed_server_cache_hits_total", "Number of texts found in the query cache.")
+cache_misses = metrics.REGISTRY.counter("embed_server_cache_misses_total", "Number of texts not found in the query cache.")
+not_modified_total = metrics.REGISTRY.counter("embed_server_not_modified_total", "Number of conditional requests answered with 304 Not Modified.")
 
 def start():
     parser = argparse.ArgumentParser("Run the embedder service")
@@ -20,36 +32,106 @@ def start():
 
     config = Config.load(args.configfile)
 
-    if config.embedding_type == "use_large":
+    embedding_types = get_embedding_types(config)
+    if "use_large" in embedding_types:
         use_large = hub.load(config.use_large_tfhub_url)
-    else:
-        sbert = SentenceTransformer(config.sbert_model_name)
-        sbert.max_seq_length = config.sbert_max_seq_length
+    if "sbert" in embedding_types:
+        sbert = load_sbert(config)
+
+    def embed_use_large(texts):
+        return np.array(use_large(texts))
+
+    def embed_sbert(texts):
+        return sbert.encode(texts, batch_size=config.sbert_batch_size, normalize_embeddings=True)
+
+    #coalesce concurrent requests into one model call per model
+    embed_fns = {"use_large": embed_use_large, "sbert": embed_sbert}
+    batchers = {embedding_type: MicroBatcher(embed_fns[embedding_type], 
+                                             config.embed_server_max_batch_size, 
+                                             config.embed_server_max_wait_ms,
+                                             name="MicroBatcher-{0}".format(embedding_type))
+                for embedding_type in embedding_types}
+
+    #model ids are part of the cache keys and ETags, so they change along with the model
+    model_ids = {embedding_type: get_model_id(config, embedding_type) for embedding_type in embedding_types}
+
+    #Cache the vectors of repeated query texts
+    cache = None
+    if config.embed_server_cache_size > 0:
+        cache = QueryCache(config.embed_server_cache_size, config.embed_server_cache_ttl_secs)
+    cache_control = ("public, max-age={0}".format(config.embed_server_cache_ttl_secs) 
+                     if config.embed_server_cache_ttl_secs > 0 else "no-cache")
+
+    def get_vectors(model, texts, keys):
+        vecs = [cache.get(key) for key in keys] if cache is not None else [None] * len(texts)
+        missing = [i for i, vec in enumerate(vecs) if vec is None]
+        cache_hits.inc(len(texts) - len(missing))
+        cache_misses.inc(len(missing))
+        if len(missing) > 0:
+            with model_seconds.time():
+                computed = batchers[model].submit([texts[i] for i in missing])
+            for i, vec in zip(missing, computed):
+                vecs[i] = vec.tolist()
+                if cache is not None:
+                    cache.put(keys[i], vecs[i])
+        return vecs
+
+    def embed(model, texts, single=False):
+        model = model.lower()
+        if model not in batchers:
+            return {
+                "error": "unknown model"
+            }
+        requests_total.inc()
+        texts_total.inc(len(texts))
+        texts = [clean_text(text) for text in texts]
+        keys = [get_key(model_ids[model], text) for text in texts]
+
+        #the vectors only depend on the model and the cleaned texts, so HTTP clients can revalidate
+        #cached responses with If-None-Match without the texts being embedded again
+        etag = hashlib.sha1("\n".join(keys).encode("utf-8")).hexdigest()
+        headers = {"ETag": '"{0}"'.format(etag)}
+        if request.method == "GET":
+            headers["Cache-Control"] = cache_control
+            if request.if_none_match.contains(etag):
+                not_modified_total.inc()
+                return Response(status=304, headers=headers)
+
+        vecs = get_vectors(model, texts, keys)
+        return {
+            model: vecs[0] if single else vecs
+        }, 200, headers
 
     app = Flask(__name__)
     api = Api(app)
 
     class Embedding(Resource):
         def get(self, model, text):
-            if model.lower() == "use_large":
-                text = clean_text(text)
-                vecs = np.array(use_large([text]))
-                return {
-                    "use_large": vecs[0].tolist()
-                }
-            elif model.lower() == "sbert":
-                text = clean_text(text)
-                vec = sbert.encode(text, normalize_embeddings=True)
-                return {
-                    "sbert": vec.tolist()
-                }
-            else:
+            return embed(model, [text], single=True)
+
+    class BatchEmbedding(Resource):
+        def post(self, model):
+            body = request.get_json(force=True, silent=True)
+            texts = body.get("text") if isinstance(body, dict) else None
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
                 return {
-                    "error": "unknown model"
-                }
+                    "error": "expected a json body with a 'text' list of strings"
+                }, 400
+            return embed(model, texts)
 
     api.add_resource(Embedding, "/embed/<string:model>/<string:text>")
-    app.run(debug=False, port=args.port, host="0.0.0.0")
+    api.add_resource(BatchEmbedding, "/embed/<string:model>")
+
+    def get_metrics():
+        return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+    if config.embed_server_metrics_app_route:
+        app.add_url_rule("/metrics", "metrics", get_metrics)
+    if config.embed_server_metrics_port > 0:
+        metrics.start_metrics_server(config.embed_server_metrics_port)
+        print("Serving metrics at http://127.0.0.1:{0}/metrics".format(config.embed_server_metrics_port))
+        print()
+    app.run(debug=False, port=args.port, host="0.0.0.0", threaded=True)
 
 if __name__ == "__main__":
     start()
\ No newline at end of file
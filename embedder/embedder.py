@@ -1,15 +1,12 @@
 import argparse
-import numpy as np
 import embedder_helpers
-import tensorflow_hub as hub
-import math
-import time
 import logging
-from sentence_transformers import SentenceTransformer
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
-from elasticsearch_dsl import Search
-from clean_text import clean_text
+import es_client
+import metrics
+from work_cursor import create_cursor_from_config
+from worker_sharding import create_shards_from_config
+from embedder_pipeline import EmbedderPipeline
+from enrichment_cache import EnrichmentCache
 
 from config import Config
 
@@ -33,115 +30,51 @@ def start():
     print("Logging level set to {0}...".format(config.log_level))
     print()
 
-    #Load embedding model
-    if config.embedding_type == "use_large":
-        use_large = hub.load(config.use_large_tfhub_url)
-    else:
-        sbert = SentenceTransformer(config.sbert_model_name)
-        sbert.max_seq_length = config.sbert_max_seq_length
+    #Load embedding models
+    embedding_types = embedder_helpers.get_embedding_types(config)
+    models = embedder_helpers.load_embedders(config, embedding_types)
+
+    #Cache vectors of repeated texts (popular quoted tweets, copypasta)
+    cache = EnrichmentCache.from_config(config)
+
+    def get_embedder(embed, model_id):
+        if cache is None:
+            return embed
+        def embed_cached(embed_text):
+            vecs = cache.get_or_compute(model_id, embed_text, embed)
+            cache.log_stats()
+            return vecs
+        return embed_cached
+
+    embedders = {embedding_type: get_embedder(*models[embedding_type]) for embedding_type in embedding_types}
 
     #Initialize elasticsearch settings
-    es = Elasticsearch(hosts=[config.elasticsearch_host], 
-                    verify_certs=config.elasticsearch_verify_certs,
-                    timeout=config.elasticsearch_timeout_secs)
+    es = es_client.create_client_from_config(config, max_connections=config.pipeline_bulk_threads + 1)
+
+    #Walk the index with a high-water mark cursor instead of re-running the existence query
+    cursor = create_cursor_from_config(config)
+
+    #Only fetch this worker's slice of the docs when several workers share the index
+    shards = create_shards_from_config(es, config, "embedder")
+
+    #Append the new vectors to the ANN search index
+    ann_writer = None
+    if config.ann_index_dir:
+        from ann_writer import AnnWriter
+        ann_writer = AnnWriter.from_config(config)
+
+    #Serve stage metrics
+    if config.metrics_port > 0:
+        metrics.start_metrics_server(config.metrics_port)
+        print("Serving metrics at http://127.0.0.1:{0}/metrics".format(config.metrics_port))
+        print()
 
-    #Poll for docs that need embedding
+    #Poll for docs that need embedding, overlapping the fetch, embed and bulk stages
     print("Polling for unembedded docs in Elasticsearch...")
     print()
     logging.info("Starting poller...")
-    while True:
-        try:
-            s = Search(using=es, index=config.elasticsearch_index_name)
-            s = s.params(size=config.elasticsearch_batch_size)
-            s.update_from_dict(embedder_helpers.get_query(config.embedding_type))
-            
-            #Get the next batch of hits from Elasticsearch
-            hits = s.execute()
-
-            if len(hits) == 0:
-                #Sleep - idle
-                logging.info("No unembedded docs found. Going to sleep (idle)...")
-                time.sleep(config.sleep_idle_secs)
-                continue
-
-            logging.info("Found {0} unembedded docs. Preparing to embed by cleaning text...".format(len(hits)))
-            embed_ids = []
-            embed_text = []
-            for hit in hits:
-                hit_id = hit.meta["id"]
-                text, quoted_text = embedder_helpers.get_tweet_text(hit)
-
-                #clean the text
-                text = clean_text(text)
-                embed_text.append(text)
-                embed_ids.append(hit_id)
-
-                if quoted_text is not None:
-                    quoted_text = clean_text(quoted_text)
-                    quoted_concat_text = "{0} {1}".format(quoted_text, text)
-
-                    embed_text.append(quoted_text)
-                    embed_text.append(quoted_concat_text)
-                    embed_ids.append(hit_id)
-                    embed_ids.append(hit_id)
-
-            #Embed with use_large or sbert
-            if config.embedding_type == "use_large":
-                n_batches = math.ceil(len(embed_ids) / config.use_large_batch_size)
-                logging.info("Embedding {0} strings in {1} unembedded docs with Universal Sentence Encoder in {2} batches..."
-                            .format(len(embed_ids), len(hits), n_batches))
-                batches = [None] * n_batches
-                for i in range(n_batches):
-                    start = i * config.use_large_batch_size
-                    end = start + config.use_large_batch_size
-                    batch_vecs = np.array(use_large([t for t in embed_text[start:end]]))
-                    batches[i] = batch_vecs
-
-                vecs = np.concatenate(batches, axis=0)
-            else:
-                logging.info("Embedding {0} strings in {1} unembedded docs with SBERT..."
-                            .format(len(embed_ids), len(hits)))
-                vecs = sbert.encode(embed_text, batch_size=config.sbert_batch_size, normalize_embeddings=True)
-
-            #Generate Elasticsearch bulk updates
-            i = 0
-            updates = []
-            while i < len(embed_ids):
-                hit_id = embed_ids[i]
-                action = {
-                    "_op_type": "update",
-                    "_id": hit_id,
-                    "doc": {
-                        "embedding": {
-                            config.embedding_type: {
-                                "primary": vecs[i].tolist()
-                            }
-                        }
-                    }
-                }
-                i += 1
-                if i < len(embed_ids) and embed_ids[i] == hit_id:
-                    action["doc"]["embedding"][config.embedding_type]["quoted"] = vecs[i].tolist()
-                    i += 1
-                if i < len(embed_ids) and embed_ids[i] == hit_id:
-                    action["doc"]["embedding"][config.embedding_type]["quoted_concat"] = vecs[i].tolist()
-                    i += 1
-                updates.append(action)
-            
-            #Sanity check
-            if len(updates) != len(hits):
-                raise RuntimeError("Number of updates {0} is not equal to the number of hits {1}.".format(len(updates), len(hits)))
-
-            #Issue the bulk update request
-            logging.info("Making bulk request to Elasticsearch with {0} update actions...".format(len(updates)))
-            bulk(es, updates, index=config.elasticsearch_index_name, chunk_size=len(updates))
-
-            #Sleep - not idle
-            logging.info("Updates completed successfully. Going to sleep (not idle)...")
-            time.sleep(config.sleep_not_idle_secs)
-
-        except Exception as ex:
-            logging.exception("Exception occurred while polling or processing a batch.")
+    pipeline = EmbedderPipeline(es, config, embedders, cursor, shards, ann_writer)
+    pipeline.run()
 
 if __name__ == "__main__":
-    start()
\ No newline at end of file
+    start()
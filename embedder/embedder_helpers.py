@@ -1,4 +1,12 @@
-def get_query(embedding_type):
+import math
+import numpy as np
+from clean_text import clean_text
+from vector_codec import encode_vector, get_scale_field
+from length_batching import get_token_lengths, run_length_batched
+
+def get_query(embedding_types):
+    #each must_not clause is named after its embedding type, so the matched_queries of a
+    #hit list the embeddings it is missing (see get_missing_types)
     query = {
     "_source": [
         "text",
@@ -13,11 +21,20 @@ def get_query(embedding_type):
         "filter": [
             {
             "bool": {
-                "must_not": {
-                "exists": {
-                    "field": "embedding.%s.primary" % embedding_type
+                "should": [
+                  {
+                    "bool": {
+                      "_name": embedding_type,
+                      "must_not": {
+                        "exists": {
+                          "field": "embedding.%s.primary" % embedding_type
+                        }
+                      }
+                    }
                   }
-                }
+                  for embedding_type in embedding_types
+                ],
+                "minimum_should_match": 1
               }
             },
             {
@@ -35,6 +52,96 @@ def get_query(embedding_type):
     }
     return query
 
+def get_embedding_types(config):
+    """Returns the list of embedding types to populate (embedding_types, or the single
+    embedding_type of older configs).
+    """
+    embedding_types = getattr(config, "embedding_types", None)
+    return embedding_types if embedding_types else [config.embedding_type]
+
+def load_sbert(config):
+    """Loads the SBERT model with the configured backend: "torch" (SentenceTransformer) or
+    "onnx" (OnnxSentenceEncoder, exported and cached on first use).
+    """
+    if config.sbert_backend == "onnx":
+        from onnx_encoder import OnnxSentenceEncoder
+        return OnnxSentenceEncoder.from_config(config)
+    if config.sbert_backend != "torch":
+        raise ValueError("Unknown SBERT backend '{0}'. Valid backends: ['torch', 'onnx']".format(config.sbert_backend))
+    from sentence_transformers import SentenceTransformer
+    sbert = SentenceTransformer(config.sbert_model_name)
+    sbert.max_seq_length = config.sbert_max_seq_length
+    return sbert
+
+def load_embedders(config, embedding_types):
+    """Loads the models of a list of embedding types.
+
+    Returns:
+        Dict of embedding type to a tuple of (function embedding a list of cleaned texts
+        into an array of vectors, model id string for caching).
+    """
+    embedders = {}
+    for embedding_type in embedding_types:
+        if embedding_type == "use_large":
+            embedders[embedding_type] = (_load_use_large(config), get_model_id(config, embedding_type))
+        elif embedding_type == "sbert":
+            embedders[embedding_type] = (_load_sbert_embedder(config), get_model_id(config, embedding_type))
+        else:
+            raise ValueError("Unknown embedding type '{0}'. Valid types: {1}".format(embedding_type, ["use_large", "sbert"]))
+    return embedders
+
+def get_model_id(config, embedding_type):
+    """Returns the model id string of an embedding type, used in cache keys and ETags. It
+    covers every setting that changes the vectors, including the SBERT backend and whether
+    the ONNX model is quantized.
+    """
+    if embedding_type == "use_large":
+        return "use_large:{0}".format(config.use_large_tfhub_url)
+    if embedding_type == "sbert":
+        backend = config.sbert_backend
+        if backend == "onnx" and config.onnx_quantize:
+            backend = "onnx-int8"
+        return "sbert:{0}:{1}:{2}".format(config.sbert_model_name, config.sbert_max_seq_length, backend)
+    raise ValueError("Unknown embedding type '{0}'. Valid types: {1}".format(embedding_type, ["use_large", "sbert"]))
+
+def _load_use_large(config):
+    import tensorflow_hub as hub
+    use_large = hub.load(config.use_large_tfhub_url)
+
+    def embed_use_large(embed_text):
+        n_batches = math.ceil(len(embed_text) / config.use_large_batch_size)
+        batches = [None] * n_batches
+        for i in range(n_batches):
+            start = i * config.use_large_batch_size
+            end = start + config.use_large_batch_size
+            batch_vecs = np.array(use_large([t for t in embed_text[start:end]]))
+            batches[i] = batch_vecs
+
+        return np.concatenate(batches, axis=0)
+    return embed_use_large
+
+def _load_sbert_embedder(config):
+    sbert = load_sbert(config)
+
+    def embed_sbert(embed_text):
+        if config.sbert_max_batch_tokens <= 0:
+            return sbert.encode(embed_text, batch_size=config.sbert_batch_size, normalize_embeddings=True)
+        #batch texts of similar length under a token budget to minimize padding
+        lengths = get_token_lengths(sbert.tokenizer, embed_text, config.sbert_max_seq_length)
+        vecs = run_length_batched(embed_text, lengths,
+                                  lambda batch: sbert.encode(batch, batch_size=len(batch), normalize_embeddings=True),
+                                  config.sbert_max_batch_tokens, config.sbert_batch_size)
+        return np.array(vecs)
+    return embed_sbert
+
+def get_missing_types(hit, embedding_types):
+    """Returns the embedding types a hit returned by get_query is missing.
+    """
+    matched_queries = getattr(hit.meta, "matched_queries", None)
+    if matched_queries is None:
+        return list(embedding_types)
+    return [embedding_type for embedding_type in embedding_types if embedding_type in matched_queries]
+
 def get_tweet_text(hit):
     text = (hit["extended_tweet"]["full_text"] if "extended_tweet" in hit 
             else hit["full_text"] if "full_text" in hit 
@@ -47,3 +154,90 @@ def get_tweet_text(hit):
                       else quoted_status["text"])
 
     return text, quoted_text
+
+
+def get_embed_text(hits):
+    """Cleans the text of a batch of hits for embedding.
+
+    Each hit contributes its text, followed by its quoted text and the quoted text
+    concatenated with its text if it quotes another tweet.
+
+    Returns:
+        Tuple of (list of hit ids, list of texts, dict of hit id to index). The id list
+        is parallel to the text list.
+    """
+    embed_ids = []
+    embed_text = []
+    hit_indices = {}
+    for hit in hits:
+        hit_id = hit.meta["id"]
+        hit_indices[hit_id] = hit.meta["index"]
+        text, quoted_text = get_tweet_text(hit)
+
+        #clean the text
+        text = clean_text(text)
+        embed_text.append(text)
+        embed_ids.append(hit_id)
+
+        if quoted_text is not None:
+            quoted_text = clean_text(quoted_text)
+            quoted_concat_text = "{0} {1}".format(quoted_text, text)
+
+            embed_text.append(quoted_text)
+            embed_text.append(quoted_concat_text)
+            embed_ids.append(hit_id)
+            embed_ids.append(hit_id)
+
+    return embed_ids, embed_text, hit_indices
+
+def get_embedding_fields(embed_ids, vecs, precision="float32", round_digits=4):
+    """Groups the encoded vectors of a batch by hit.
+
+    Args:
+        embed_ids: list of hit ids returned by get_embed_text.
+        vecs: array of vectors parallel to embed_ids.
+        precision: vector encoding (see vector_codec.PRECISIONS).
+        round_digits: number of decimals kept by the "rounded" precision.
+
+    Returns:
+        Dict of hit id to the dict of its "primary", "quoted" and "quoted_concat" vectors
+        (and their "_scale" factors if the precision is "int8").
+    """
+    i = 0
+    fields = {}
+    while i < len(embed_ids):
+        hit_id = embed_ids[i]
+        hit_fields = {}
+        for field in ("primary", "quoted", "quoted_concat"):
+            if i >= len(embed_ids) or embed_ids[i] != hit_id:
+                break
+            hit_fields[field], scale = encode_vector(vecs[i], precision, round_digits)
+            if scale is not None:
+                hit_fields[get_scale_field(field)] = scale
+            i += 1
+        fields[hit_id] = hit_fields
+    return fields
+
+def get_updates(hits, type_fields):
+    """Builds one Elasticsearch bulk update action per hit, merging the vectors of every
+    embedding type computed for it.
+
+    Args:
+        hits: the batch of hits.
+        type_fields: dict of embedding type to the dict returned by get_embedding_fields.
+    """
+    updates = []
+    for hit in hits:
+        hit_id = hit.meta["id"]
+        embedding = {embedding_type: fields[hit_id] for embedding_type, fields in type_fields.items() if hit_id in fields}
+        if len(embedding) == 0:
+            continue
+        updates.append({
+            "_op_type": "update",
+            "_index": hit.meta["index"],
+            "_id": hit_id,
+            "doc": {
+                "embedding": embedding
+            }
+        })
+    return updates
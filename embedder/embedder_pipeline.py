@@ -0,0 +1,180 @@
+"""
+Three-stage embedder pipeline: a fetch thread prefetches batches of unembedded docs,
+the calling thread cleans and embeds them, and bulk threads write the vectors back,
+all connected by bounded queues so the model never waits on an Elasticsearch round-trip.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import embedder_helpers
+import metrics
+from elasticsearch.helpers import bulk
+from elasticsearch_dsl import Search
+
+es_fetch_seconds = metrics.REGISTRY.histogram("embedder_es_fetch_seconds", "Duration of the Elasticsearch query for unembedded docs.")
+batch_size = metrics.REGISTRY.histogram("embedder_batch_size", "Number of docs per fetched batch.", metrics.SIZE_BUCKETS)
+model_seconds = metrics.REGISTRY.histogram("embedder_model_seconds", "Duration of embedding a batch.")
+bulk_seconds = metrics.REGISTRY.histogram("embedder_bulk_seconds", "Duration of the bulk update request.")
+docs_embedded = metrics.REGISTRY.counter("embedder_docs_embedded_total", "Number of docs embedded.")
+texts_embedded = metrics.REGISTRY.counter("embedder_texts_embedded_total", "Number of texts embedded.")
+batch_failures = metrics.REGISTRY.counter("embedder_batch_failures_total", "Number of batches that failed.")
+fetch_queue_depth = metrics.REGISTRY.gauge("embedder_fetch_queue_depth", "Number of fetched batches waiting to be embedded.")
+bulk_queue_depth = metrics.REGISTRY.gauge("embedder_bulk_queue_depth", "Number of embedded batches waiting to be written.")
+
+class EmbedderPipeline(object):
+    """Overlaps fetching, embedding and bulk updating of unembedded docs.
+
+    Every batch is fetched and cleaned once for all embedding types. Each type's model
+    embeds the docs missing that type (concurrently with the other models), and each doc
+    gets a single update with all of its new vectors.
+
+    Docs stay "in flight" from the moment they are fetched until their bulk update
+    completes or fails, and are excluded from further fetches in the meantime, since the
+    existence query would otherwise return them again before their vectors are written.
+    """
+    def __init__(self, es, config, embedders, cursor=None, shards=None, ann_writer=None):
+        """Initializes the EmbedderPipeline instance.
+
+        Args:
+            es: Elasticsearch client.
+            config: embedder Config instance.
+            embedders: dict of embedding type to a function taking a list of cleaned texts
+                and returning an array of vectors.
+            cursor: optional WorkCursor used for work discovery. It is advanced as batches
+                are fetched; batches that fail afterwards are recovered by its gap fill.
+            shards: optional WorkerShards restricting the fetches to this worker's slices.
+            ann_writer: optional AnnWriter the vectors of every written batch are appended to.
+        """
+        self.es = es
+        self.config = config
+        self.embedders = embedders
+        self.embedding_types = list(embedders)
+        self.executor = ThreadPoolExecutor(len(embedders), thread_name_prefix="EmbedderModel")
+        self.cursor = cursor
+        self.shards = shards
+        self.ann_writer = ann_writer
+        self.fetch_queue = queue.Queue(maxsize=config.pipeline_queue_size)
+        self.bulk_queue = queue.Queue(maxsize=config.pipeline_queue_size)
+        self.in_flight = set()
+        self.lock = threading.Lock()
+
+    def run(self):
+        """Starts the fetch and bulk threads and embeds batches on the calling thread forever.
+        """
+        threading.Thread(target=self._fetch_loop, name="EmbedderFetch", daemon=True).start()
+        for i in range(self.config.pipeline_bulk_threads):
+            threading.Thread(target=self._bulk_loop, name="EmbedderBulk-{0}".format(i), daemon=True).start()
+
+        while True:
+            hits = self.fetch_queue.get()
+            fetch_queue_depth.set(self.fetch_queue.qsize())
+            try:
+                #Clean the text of each hit once for all embedding types
+                hit_text = {hit.meta["id"]: embedder_helpers.get_embed_text([hit]) for hit in hits}
+                with model_seconds.time():
+                    futures = {}
+                    for embedding_type in self.embedding_types:
+                        type_hits = [hit for hit in hits if embedding_type in embedder_helpers.get_missing_types(hit, self.embedding_types)]
+                        if len(type_hits) > 0:
+                            futures[embedding_type] = self.executor.submit(self._embed, embedding_type, type_hits, hit_text)
+                    results = {embedding_type: future.result() for embedding_type, future in futures.items()}
+                type_fields = {embedding_type: fields for embedding_type, (fields, _) in results.items()}
+                num_texts = sum(num_texts for _, num_texts in results.values())
+                updates = embedder_helpers.get_updates(hits, type_fields)
+
+                #Sanity check
+                if len(updates) != len(hits):
+                    raise RuntimeError("Number of updates {0} is not equal to the number of hits {1}.".format(len(updates), len(hits)))
+            except Exception as ex:
+                batch_failures.inc()
+                logging.exception("Exception occurred while embedding a batch.")
+                self._release(hits)
+                continue
+            self.bulk_queue.put((hits, updates, type_fields, num_texts))
+            bulk_queue_depth.set(self.bulk_queue.qsize())
+
+    def _embed(self, embedding_type, hits, hit_text):
+        embed_ids = []
+        embed_text = []
+        for hit in hits:
+            ids, text, _ = hit_text[hit.meta["id"]]
+            embed_ids.extend(ids)
+            embed_text.extend(text)
+        logging.info("Embedding {0} strings in {1} unembedded docs with {2}..."
+                    .format(len(embed_ids), len(hits), embedding_type))
+        vecs = self.embedders[embedding_type](embed_text)
+        fields = embedder_helpers.get_embedding_fields(embed_ids, vecs, self.config.embedding_precision,
+                                                       self.config.embedding_round_digits)
+        return fields, len(embed_ids)
+
+    def _fetch_loop(self):
+        while True:
+            try:
+                hits = self._fetch()
+            except Exception as ex:
+                batch_failures.inc()
+                logging.exception("Exception occurred while polling for a batch.")
+                time.sleep(self.config.sleep_idle_secs)
+                continue
+
+            if len(hits) == 0:
+                #Sleep - idle
+                logging.info("No unembedded docs found. Going to sleep (idle)...")
+                time.sleep(self.config.sleep_idle_secs)
+                continue
+
+            logging.info("Found {0} unembedded docs.".format(len(hits)))
+            with self.lock:
+                self.in_flight.update(hit.meta["id"] for hit in hits)
+            self.fetch_queue.put(hits)
+            fetch_queue_depth.set(self.fetch_queue.qsize())
+
+    def _fetch(self):
+        query = embedder_helpers.get_query(self.embedding_types)
+        if self.cursor is not None:
+            query = self.cursor.get_query(query)
+        if self.shards is not None:
+            query["query"]["bool"]["filter"].append(self.shards.get_filter())
+        with self.lock:
+            in_flight = list(self.in_flight)
+        if len(in_flight) > 0:
+            query["query"]["bool"]["must_not"] = [{"ids": {"values": in_flight}}]
+
+        s = Search(using=self.es, index=self.config.elasticsearch_index_name)
+        s = s.params(size=self.config.elasticsearch_batch_size)
+        s.update_from_dict(query)
+        with es_fetch_seconds.time():
+            hits = s.execute()
+        batch_size.observe(len(hits))
+        if self.cursor is not None:
+            self.cursor.record_attempts(hits)
+            self.cursor.advance(hits, self.config.elasticsearch_batch_size)
+        return hits
+
+    def _bulk_loop(self):
+        while True:
+            hits, updates, type_fields, num_texts = self.bulk_queue.get()
+            bulk_queue_depth.set(self.bulk_queue.qsize())
+            try:
+                logging.info("Making bulk request to Elasticsearch with {0} update actions...".format(len(updates)))
+                #wait for a refresh so the docs no longer match the existence query once released
+                with bulk_seconds.time():
+                    bulk(self.es, updates, index=self.config.elasticsearch_index_name, chunk_size=len(updates),
+                         refresh="wait_for")
+                docs_embedded.inc(len(hits))
+                texts_embedded.inc(num_texts)
+                logging.info("Updates completed successfully.")
+                #only index vectors that were written, failed batches are re-embedded later
+                if self.ann_writer is not None:
+                    self.ann_writer.append(type_fields)
+            except Exception as ex:
+                batch_failures.inc()
+                logging.exception("Exception occurred while writing a batch of {0} updates.".format(len(updates)))
+            finally:
+                self._release(hits)
+
+    def _release(self, hits):
+        with self.lock:
+            self.in_flight.difference_update(hit.meta["id"] for hit in hits)
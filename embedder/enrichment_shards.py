@@ -0,0 +1,232 @@
+"""
+Sharded on-disk format of offline enrichment results (embeddings, sentiment scores),
+written by the offline enrichment scripts and pushed back to Elasticsearch by the
+enrichment loader.
+
+A shard named <name> in an output directory consists of:
+    <name>.ids.npy        int64 tweet ids.
+    <name>.<field>.npy    float32 array per Elasticsearch field (e.g. embedding.sbert.primary),
+                          with rows parallel to the ids. Vectors are 2-D arrays. Rows of NaN
+                          are missing values (e.g. the quoted fields of tweets without a quote).
+    <name>.index.npy      optional int32 array parallel to the ids, pointing into the "indices"
+                          list of the manifest: the concrete index each tweet was exported from
+                          (-1 if unknown), so updates reach tweets in older rollover indices.
+    <name>.json           manifest listing the files, written last so that its existence
+                          marks a complete shard.
+
+The arrays are plain .npy files, so they can be memory-mapped with np.load(mmap_mode="r").
+"""
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+#orjson is optional but parses tweets several times faster than the json module
+try:
+    import orjson
+    loads_json = orjson.loads
+except ImportError:
+    loads_json = json.loads
+
+INPUT_EXTENSIONS = (".jsonl", ".jsonl.gz", ".json", ".json.gz")
+
+#enrichment function set by _init_worker in worker processes
+_worker_enrich = None
+
+def iter_tweets(path):
+    """Reads the tweets of a jsonl(.gz) file (one tweet per line) or json(.gz) file (one
+    tweet or a list of tweets). Hits exported from Elasticsearch with a scan (with "_id"
+    and "_source" keys) are unwrapped to their source, keeping the index they came from in
+    the "_index" key.
+    """
+    open_file = gzip.open if path.lower().endswith(".gz") else open
+    with open_file(path, "rb") as f:
+        if ".jsonl" in path.lower():
+            docs = (loads_json(line) for line in f if line.strip())
+        else:
+            docs = loads_json(f.read())
+            if isinstance(docs, dict):
+                docs = [docs]
+        for doc in docs:
+            if "_source" in doc:
+                tweet = doc["_source"]
+                if "id_str" not in tweet and "id" not in tweet:
+                    tweet["id_str"] = doc["_id"]
+                if "_index" in doc:
+                    tweet["_index"] = doc["_index"]
+                doc = tweet
+            yield doc
+
+def iter_chunks(items, chunk_size):
+    """Splits an iterable into lists of at most chunk_size items.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+def get_tweet_id(tweet):
+    return int(tweet["id_str"]) if "id_str" in tweet else int(tweet["id"])
+
+def get_source_name(path):
+    """Returns the shard name prefix of an input file: its base name without extensions,
+    followed by a hash of its path so files with the same name in different directories
+    do not collide.
+    """
+    base_name = os.path.basename(path)
+    for extension in INPUT_EXTENSIONS:
+        if base_name.lower().endswith(extension):
+            base_name = base_name[:-len(extension)]
+            break
+    path_hash = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:8]
+    return "{0}-{1}".format(base_name, path_hash)
+
+def get_shard_name(source_name, shard_num):
+    return "{0}-{1:05d}".format(source_name, shard_num)
+
+def write_shard(out_dir, name, ids, fields, source=None, index_names=None):
+    """Writes a shard.
+
+    Args:
+        out_dir: output directory.
+        name: shard name.
+        ids: list of tweet ids.
+        fields: dict of Elasticsearch field name to an array with one row per id.
+        source: optional path of the input file the shard was computed from.
+        index_names: optional list parallel to ids of the index each tweet was read from
+            (None if unknown).
+    """
+    manifest = {
+        "name": name,
+        "source": source,
+        "count": len(ids),
+        "ids": "{0}.ids.npy".format(name),
+        "fields": {field: "{0}.{1}.npy".format(name, field) for field in fields}
+    }
+    np.save(os.path.join(out_dir, manifest["ids"]), np.asarray(ids, dtype=np.int64))
+    if index_names is not None and any(index_name is not None for index_name in index_names):
+        manifest["indices"] = sorted(set(index_name for index_name in index_names if index_name is not None))
+        manifest["index_codes"] = "{0}.index.npy".format(name)
+        codes = {index_name: code for code, index_name in enumerate(manifest["indices"])}
+        np.save(os.path.join(out_dir, manifest["index_codes"]),
+                np.array([codes.get(index_name, -1) for index_name in index_names], dtype=np.int32))
+    for field, values in fields.items():
+        np.save(os.path.join(out_dir, manifest["fields"][field]), np.asarray(values, dtype=np.float32))
+    _write_json(os.path.join(out_dir, "{0}.json".format(name)), manifest)
+
+def is_shard_complete(out_dir, name):
+    return os.path.exists(os.path.join(out_dir, "{0}.json".format(name)))
+
+def mark_source_done(out_dir, source_name, shard_names):
+    """Records that all shards of an input file were written, so reruns skip it.
+    """
+    _write_json(os.path.join(out_dir, "{0}.done".format(source_name)), {"shards": shard_names})
+
+def is_source_done(out_dir, source_name):
+    return os.path.exists(os.path.join(out_dir, "{0}.done".format(source_name)))
+
+def get_shard_names(in_dir):
+    """Returns the sorted names of the complete shards in a directory.
+    """
+    return sorted(os.path.basename(path)[:-len(".json")] for path in glob.glob(os.path.join(in_dir, "*.json")))
+
+def load_shard(in_dir, name, mmap=True):
+    """Loads a shard.
+
+    Args:
+        in_dir: directory of the shard.
+        name: shard name.
+        mmap: whether to memory-map the arrays instead of reading them into memory.
+
+    Returns:
+        Tuple of (array of tweet ids, dict of field name to array).
+    """
+    with open(os.path.join(in_dir, "{0}.json".format(name)), "r") as f:
+        manifest = json.load(f)
+    mmap_mode = "r" if mmap else None
+    ids = np.load(os.path.join(in_dir, manifest["ids"]), mmap_mode=mmap_mode)
+    fields = {field: np.load(os.path.join(in_dir, filename), mmap_mode=mmap_mode)
+              for field, filename in manifest["fields"].items()}
+    return ids, fields
+
+def load_shard_indices(in_dir, name):
+    """Loads the concrete index of each tweet of a shard.
+
+    Returns:
+        Object array parallel to the shard ids of index names (None if unknown), or None
+        if the shard was not written from an Elasticsearch export.
+    """
+    with open(os.path.join(in_dir, "{0}.json".format(name)), "r") as f:
+        manifest = json.load(f)
+    if "index_codes" not in manifest:
+        return None
+    codes = np.load(os.path.join(in_dir, manifest["index_codes"]))
+    #code -1 picks the trailing None
+    return np.array(manifest["indices"] + [None], dtype=object)[codes]
+
+def enrich_files(paths, out_dir, init, initargs=(), shard_size=100000, processes=1):
+    """Enriches the tweets of a list of input files into shards, one input file per worker
+    process at a time. Shards and input files already written by a previous run are skipped.
+
+    Args:
+        paths: list of input file paths (see iter_tweets).
+        out_dir: output directory.
+        init: top-level function called with initargs once in each worker process to load
+            the models. It returns the enrichment function, which takes a list of tweets and
+            returns a tuple of (list of tweet ids, dict of field name to array), the arguments
+            of write_shard.
+        initargs: tuple of arguments of init.
+        shard_size: number of input tweets per shard.
+        processes: number of worker processes.
+
+    Returns:
+        Generator of (path, number of tweets read, exception or None) tuples in completion order.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = [path for path in paths if not is_source_done(out_dir, get_source_name(path))]
+    #spawn the workers so each one initializes its own CUDA / TensorFlow runtime
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(init, initargs)) as executor:
+        futures = {executor.submit(_enrich_file, path, out_dir, shard_size): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                yield path, future.result(), None
+            except Exception as ex:
+                logging.exception("Exception occurred while enriching {0}.".format(path))
+                yield path, 0, ex
+
+def _init_worker(init, initargs):
+    global _worker_enrich
+    _worker_enrich = init(*initargs)
+
+def _enrich_file(path, out_dir, shard_size):
+    source_name = get_source_name(path)
+    shard_names = []
+    num_tweets = 0
+    for shard_num, tweets in enumerate(iter_chunks(iter_tweets(path), shard_size)):
+        name = get_shard_name(source_name, shard_num)
+        if not is_shard_complete(out_dir, name):
+            ids, fields = _worker_enrich(tweets)
+            tweet_indices = {get_tweet_id(tweet): tweet["_index"] for tweet in tweets if "_index" in tweet}
+            index_names = [tweet_indices.get(tweet_id) for tweet_id in ids] if len(tweet_indices) > 0 else None
+            write_shard(out_dir, name, ids, fields, path, index_names)
+        shard_names.append(name)
+        num_tweets += len(tweets)
+    mark_source_done(out_dir, source_name, shard_names)
+    return num_tweets
+
+def _write_json(filepath, obj):
+    tmp_filepath = filepath + ".tmp"
+    with open(tmp_filepath, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_filepath, filepath)
@@ -0,0 +1,93 @@
+"""
+Server-side micro-batching: concurrent requests submitted within a small time window
+are coalesced into a single model call.
+"""
+import logging
+import queue
+import threading
+import time
+
+class _Request(object):
+    def __init__(self, items):
+        self.items = items
+        self.outputs = None
+        self.error = None
+        self.done = threading.Event()
+
+class MicroBatcher(object):
+    """Runs a batched function on a background thread over the items of all requests
+    that arrive while it waits, up to max_batch_size items or max_wait_ms after the first
+    request of the batch.
+
+    """
+    def __init__(self, run_batch, max_batch_size=64, max_wait_ms=5, name="MicroBatcher"):
+        """Initializes the MicroBatcher instance and starts its thread.
+
+        Args:
+            run_batch: function taking a list of items and returning a sequence of outputs,
+                one per item.
+            max_batch_size: max number of items per call (a single larger request is run
+                on its own).
+            max_wait_ms: max time to wait for more requests after the first one.
+            name: name of the batching thread.
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_secs = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, items):
+        """Blocks until the outputs of a list of items are computed and returns them.
+
+        Args:
+            items: list of items.
+
+        Returns:
+            List of outputs parallel to items.
+        """
+        request = _Request(items)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.outputs
+
+    def _run(self):
+        pending = None
+        while True:
+            requests = [pending if pending is not None else self.queue.get()]
+            pending = None
+            num_items = len(requests[0].items)
+            deadline = time.monotonic() + self.max_wait_secs
+            while num_items < self.max_batch_size:
+                timeout_secs = deadline - time.monotonic()
+                if timeout_secs <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout_secs)
+                except queue.Empty:
+                    break
+                if num_items + len(request.items) > self.max_batch_size:
+                    #run it in the next batch
+                    pending = request
+                    break
+                requests.append(request)
+                num_items += len(request.items)
+            self._run_requests(requests)
+
+    def _run_requests(self, requests):
+        items = [item for request in requests for item in request.items]
+        try:
+            outputs = self.run_batch(items) if len(items) > 0 else []
+            start = 0
+            for request in requests:
+                request.outputs = outputs[start:start+len(request.items)]
+                start += len(request.items)
+        except Exception as ex:
+            logging.exception("Exception occurred while running a batch of {0} items.".format(len(items)))
+            for request in requests:
+                request.error = ex
+        for request in requests:
+            request.done.set()
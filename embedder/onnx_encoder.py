@@ -0,0 +1,125 @@
+"""
+ONNX Runtime backend for SBERT models on CPU-only nodes. The model is exported to ONNX
+once (optionally with dynamic int8 quantization), cached on disk, and exposes the same
+encode interface as SentenceTransformer.
+"""
+import logging
+import os
+import numpy as np
+import onnxruntime
+from transformers import AutoTokenizer
+
+class OnnxSentenceEncoder(object):
+    """SentenceTransformer-compatible encoder running an exported model with ONNX Runtime.
+
+    """
+    def __init__(self, model_dir, max_seq_length=512, num_threads=0):
+        """Initializes the OnnxSentenceEncoder instance from an exported model directory
+        (see export_model).
+
+        Args:
+            model_dir: directory holding model.onnx and the tokenizer files.
+            max_seq_length: max number of tokens per text (longer texts are truncated).
+            num_threads: number of intra-op threads. 0 lets ONNX Runtime decide.
+        """
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, "model.onnx"), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = set(model_input.name for model_input in self.session.get_inputs())
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = max_seq_length
+
+    @staticmethod
+    def from_config(config):
+        """Loads the ONNX export of sbert_model_name from onnx_cache_dir, exporting it first
+        if it is not cached yet.
+
+        Args:
+            config: embedder Config instance.
+        """
+        model_dir = get_model_dir(config.onnx_cache_dir, config.sbert_model_name, config.onnx_quantize)
+        if not os.path.exists(os.path.join(model_dir, "model.onnx")):
+            export_model(config.sbert_model_name, model_dir, config.onnx_quantize)
+        return OnnxSentenceEncoder(model_dir, config.sbert_max_seq_length, config.onnx_threads)
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False):
+        """Encodes texts like SentenceTransformer.encode.
+
+        Args:
+            sentences: a text or a list of texts.
+            batch_size: number of texts per inference call.
+            normalize_embeddings: whether to scale the embeddings to unit length.
+
+        Returns:
+            float32 array of embeddings (a single vector if a single text was passed).
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(sentences[start:start+batch_size], padding=True, truncation=True,
+                                    max_length=self.max_seq_length, return_tensors="np")
+            feed = {name: inputs[name].astype(np.int64) for name in inputs if name in self.input_names}
+            batches.append(self.session.run(None, feed)[0])
+        vecs = np.concatenate(batches, axis=0) if len(batches) > 0 else np.zeros((0, 0), dtype=np.float32)
+        if normalize_embeddings:
+            vecs = vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+        return vecs[0] if single else vecs
+
+def get_model_dir(cache_dir, model_name, quantize):
+    """Returns the cache directory of the ONNX export of a model.
+    """
+    return os.path.join(cache_dir, "{0}{1}".format(model_name.replace("/", "_"), "-int8" if quantize else ""))
+
+def export_model(model_name, model_dir, quantize=False):
+    """Exports a SentenceTransformer model (transformer and pooling) to model_dir/model.onnx,
+    along with its tokenizer.
+
+    Args:
+        model_name: SentenceTransformer model name or path.
+        model_dir: output directory.
+        quantize: whether to apply dynamic int8 quantization to the weights.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    logging.info("Exporting {0} to ONNX in {1}...".format(model_name, model_dir))
+    os.makedirs(model_dir, exist_ok=True)
+    sbert = SentenceTransformer(model_name, device="cpu")
+    sbert.eval()
+
+    class PooledModel(torch.nn.Module):
+        def __init__(self, sbert):
+            super(PooledModel, self).__init__()
+            self.sbert = sbert
+
+        def forward(self, input_ids, attention_mask):
+            return self.sbert({"input_ids": input_ids, "attention_mask": attention_mask})["sentence_embedding"]
+
+    dummy = sbert.tokenizer(["an example tweet"], return_tensors="pt")
+    onnx_filepath = os.path.join(model_dir, "model.onnx")
+    #model.onnx is written last, so its existence means the export is complete
+    export_filepath = onnx_filepath + ".fp32"
+    with torch.no_grad():
+        torch.onnx.export(PooledModel(sbert),
+                          (dummy["input_ids"], dummy["attention_mask"]),
+                          export_filepath,
+                          input_names=["input_ids", "attention_mask"],
+                          output_names=["sentence_embedding"],
+                          dynamic_axes={
+                              "input_ids": {0: "batch", 1: "sequence"},
+                              "attention_mask": {0: "batch", 1: "sequence"},
+                              "sentence_embedding": {0: "batch"}
+                          },
+                          opset_version=14)
+    sbert.tokenizer.save_pretrained(model_dir)
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(export_filepath, onnx_filepath + ".tmp", weight_type=QuantType.QInt8)
+        os.remove(export_filepath)
+        export_filepath = onnx_filepath + ".tmp"
+    os.replace(export_filepath, onnx_filepath)
@@ -0,0 +1,50 @@
+"""
+Size- and TTL-bounded in-memory LRU cache for the embed server, so repeated query texts
+are answered without running a model.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+class QueryCache(object):
+    """Thread-safe LRU of at most max_items values, each expiring ttl_secs after it was stored.
+
+    """
+    def __init__(self, max_items, ttl_secs=0):
+        """Initializes the QueryCache instance.
+
+        Args:
+            max_items: max number of values kept.
+            ttl_secs: lifetime of a value in seconds. 0 or less keeps values until evicted.
+        """
+        self.max_items = max_items
+        self.ttl_secs = ttl_secs
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value stored for a key, or None if it is missing or expired.
+        """
+        with self.lock:
+            item = self.lru.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self.lru[key]
+                return None
+            self.lru.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Stores a value, evicting the least recently used values beyond max_items.
+        """
+        expires_at = time.monotonic() + self.ttl_secs if self.ttl_secs > 0 else None
+        with self.lock:
+            self.lru[key] = (expires_at, value)
+            self.lru.move_to_end(key)
+            while len(self.lru) > self.max_items:
+                self.lru.popitem(last=False)
+
+    def __len__(self):
+        return len(self.lru)
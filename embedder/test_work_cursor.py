@@ -0,0 +1,74 @@
+"""
+Tests of the WorkCursor gap fill. Run with: python -m unittest test_work_cursor
+"""
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from work_cursor import WorkCursor
+
+BATCH_SIZE = 2
+
+def make_hits(values):
+    return [SimpleNamespace(meta=SimpleNamespace(sort=[value])) for value in values]
+
+def get_query():
+    return {"query": {"bool": {"filter": [], "must_not": [{"exists": {"field": "embedding"}}]}}}
+
+def get_skipped_filter(query):
+    for clause in query["query"]["bool"]["filter"]:
+        if "bool" in clause:
+            return clause["bool"]["must_not"]["terms"]["id"]
+    return []
+
+class TestWorkCursorGapFill(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, "cursor.json")
+        self.cursor = WorkCursor(self.filepath, gap_fill_interval_secs=1, gap_fill_max_attempts=3)
+        self.cursor.high_water_mark = 100
+        #make a gap fill due
+        self.cursor.last_gap_fill = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def fetch(self, returned_values):
+        """Runs one poll that returns the given cursor values and fails to process them."""
+        query = self.cursor.get_query(get_query())
+        hits = make_hits(returned_values)
+        self.cursor.record_attempts(hits)
+        self.cursor.advance(hits, BATCH_SIZE)
+        return query
+
+    def test_failing_docs_are_skipped_after_max_attempts(self):
+        for _ in range(3):
+            query = self.fetch([5, 7])
+            self.assertEqual(get_skipped_filter(query), [])
+            self.assertTrue(self.cursor.gap_filling)
+
+        query = self.cursor.get_query(get_query())
+        self.assertEqual(sorted(get_skipped_filter(query)), [5, 7])
+
+    def test_gap_fill_completes_past_failing_docs(self):
+        for _ in range(3):
+            self.fetch([5, 7])
+        #the failing docs are left out, so the next batch comes back short
+        self.fetch([9])
+        self.assertFalse(self.cursor.gap_filling)
+        self.assertEqual(self.cursor.get_skipped(), [])
+
+    def test_attempts_are_only_counted_during_gap_fills(self):
+        self.cursor.last_gap_fill = float("inf")
+        self.cursor.high_water_mark = None
+        self.fetch([101, 102])
+        self.assertEqual(self.cursor.gap_attempts, {})
+        self.assertEqual(self.cursor.high_water_mark, 102)
+
+    def test_attempts_are_persisted(self):
+        self.fetch([5, 7])
+        cursor = WorkCursor.load(self.filepath, gap_fill_interval_secs=1, gap_fill_max_attempts=3)
+        self.assertEqual(cursor.gap_attempts, {5: 1, 7: 1})
+
+if __name__ == "__main__":
+    unittest.main()
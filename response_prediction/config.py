@@ -18,12 +18,24 @@ class Config(object):
         self.sbert_max_seq_length = 512
         self.embedding_type = "use_large"
         self.generate_batch_size = 32
+        self.generate_max_batch_tokens = 0
         self.embed_batch_size = 32
         self.embed_enabled = True
         self.sentiment_batch_size = 32
+        self.sentiment_max_batch_tokens = 0
         self.sentiment_modelpath = ""
         self.sentiment_max_seq_length = 512
 
+        #Cache settings
+        self.enrichment_cache_size = 0
+        self.enrichment_cache_filepath = ""
+
+        #Metrics settings
+        #metrics are served on a separate port bound to localhost (0 disables them); the public
+        #app only serves /metrics if metrics_app_route is set
+        self.metrics_port = 0
+        self.metrics_app_route = False
+
     @staticmethod
     def load(filepath):
         """Loads the config from a JSON file.
@@ -0,0 +1,142 @@
+"""
+Content-addressed cache of model outputs (embeddings, sentiment scores) keyed by the
+model and the cleaned text, so repeated texts such as popular quoted tweets and
+copypasta replies are only run through a model once.
+"""
+import hashlib
+import logging
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+import metrics
+
+batch_hits = metrics.REGISTRY.counter("enrichment_cache_batch_hits_total", "Number of texts deduplicated within a batch.")
+memory_hits = metrics.REGISTRY.counter("enrichment_cache_memory_hits_total", "Number of texts found in the in-memory LRU.")
+disk_hits = metrics.REGISTRY.counter("enrichment_cache_disk_hits_total", "Number of texts found in the on-disk store.")
+misses = metrics.REGISTRY.counter("enrichment_cache_misses_total", "Number of texts run through a model.")
+
+class EnrichmentCache(object):
+    """Three-level cache of model outputs: duplicates within a batch are computed once,
+    then texts are looked up in a bounded in-memory LRU, then in an optional SQLite store.
+
+    """
+    def __init__(self, max_items, filepath=None):
+        """Initializes the EnrichmentCache instance.
+
+        Args:
+            max_items: max number of outputs kept in memory.
+            filepath: optional path of the SQLite database backing the in-memory LRU.
+        """
+        self.max_items = max_items
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        if filepath:
+            self.db = sqlite3.connect(filepath, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS outputs (key TEXT PRIMARY KEY, value BLOB)")
+            self.db.commit()
+
+    @staticmethod
+    def from_config(config):
+        """Returns the EnrichmentCache configured by the enrichment_cache_* settings,
+        or None if caching is disabled.
+
+        Args:
+            config: tool Config instance.
+        """
+        if config.enrichment_cache_size <= 0:
+            return None
+        return EnrichmentCache(config.enrichment_cache_size, config.enrichment_cache_filepath)
+
+    def get_or_compute(self, model_id, texts, compute):
+        """Returns the model outputs for a list of texts, only computing the ones not cached.
+
+        Args:
+            model_id: string identifying the model and any settings affecting its output.
+            texts: list of cleaned texts.
+            compute: function taking a list of texts and returning a sequence of outputs
+                (one per text, e.g. an array of vectors).
+
+        Returns:
+            List of outputs parallel to texts.
+        """
+        keys = [get_key(model_id, text) for text in texts]
+        outputs = {}
+        missing = OrderedDict()
+        with self.lock:
+            for key, text in zip(keys, texts):
+                if key in outputs or key in missing:
+                    batch_hits.inc()
+                elif key in self.lru:
+                    self.lru.move_to_end(key)
+                    outputs[key] = self.lru[key]
+                    memory_hits.inc()
+                else:
+                    missing[key] = text
+
+            if self.db is not None and len(missing) > 0:
+                found = self._load(list(missing))
+                for key, output in found.items():
+                    del missing[key]
+                    outputs[key] = output
+                    self._remember(key, output)
+                disk_hits.inc(len(found))
+
+        if len(missing) > 0:
+            misses.inc(len(missing))
+            computed = compute(list(missing.values()))
+            with self.lock:
+                for key, output in zip(missing, computed):
+                    outputs[key] = output
+                    self._remember(key, output)
+                if self.db is not None:
+                    self._store([(key, outputs[key]) for key in missing])
+
+        return [outputs[key] for key in keys]
+
+    def get_stats(self):
+        """Returns a dict of hit counts and the overall hit rate.
+        """
+        stats = {
+            "batch_hits": batch_hits.value,
+            "memory_hits": memory_hits.value,
+            "disk_hits": disk_hits.value,
+            "misses": misses.value
+        }
+        total = sum(stats.values())
+        stats["hit_rate"] = (total - stats["misses"]) / total if total > 0 else 0.0
+        return stats
+
+    def log_stats(self):
+        logging.info("Enrichment cache stats: {0}".format(self.get_stats()))
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+    def _remember(self, key, output):
+        self.lru[key] = output
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.max_items:
+            self.lru.popitem(last=False)
+
+    def _load(self, keys):
+        found = {}
+        #stay below SQLite's limit on the number of query parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            rows = self.db.execute("SELECT key, value FROM outputs WHERE key IN ({0})".format(",".join("?" * len(chunk))), chunk)
+            for key, value in rows:
+                found[key] = pickle.loads(value)
+        return found
+
+    def _store(self, items):
+        self.db.executemany("INSERT OR REPLACE INTO outputs (key, value) VALUES (?, ?)",
+                            [(key, pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)) for key, output in items])
+        self.db.commit()
+
+def get_key(model_id, text):
+    """Returns the cache key of a model output: the sha1 of the model id and the text.
+    """
+    return hashlib.sha1("{0}\0{1}".format(model_id, text).encode("utf-8")).hexdigest()
@@ -0,0 +1,74 @@
+"""
+Length-bucketed dynamic batching for transformer inference. Inputs are sorted by token
+length and grouped into batches under a padded token budget, so short tweets are not
+padded to the length of the longest tweet in an arrival-order batch.
+"""
+
+def get_token_lengths(tokenizer, texts, max_length=None):
+    """Returns the number of tokens of each text (including special tokens).
+
+    Args:
+        tokenizer: Hugging Face tokenizer.
+        texts: list of texts.
+        max_length: optional length the texts are truncated to by the model.
+    """
+    encodings = tokenizer(texts, add_special_tokens=True, truncation=max_length is not None, max_length=max_length)
+    return [len(input_ids) for input_ids in encodings["input_ids"]]
+
+def get_length_batches(lengths, max_tokens, max_batch_size=None):
+    """Groups inputs into batches of similar length under a token budget.
+
+    Inputs are sorted by length and batches are filled greedily while the padded size of
+    the batch (number of inputs times the longest input) stays within max_tokens. An input
+    longer than max_tokens gets a batch of its own.
+
+    Args:
+        lengths: list of input lengths in tokens.
+        max_tokens: max padded tokens per batch.
+        max_batch_size: optional max number of inputs per batch.
+
+    Returns:
+        List of batches, each a list of indices into lengths.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    batch = []
+    for i in order:
+        #lengths are ascending, so the padded size is set by the input being added
+        full = max_batch_size is not None and len(batch) >= max_batch_size
+        if len(batch) > 0 and (full or (len(batch) + 1) * lengths[i] > max_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+def run_length_batched(texts, lengths, run_batch, max_tokens, max_batch_size=None):
+    """Runs a batched model function over texts in length-bucketed batches and returns
+    its outputs in the original order.
+
+    Args:
+        texts: list of inputs.
+        lengths: list of input lengths in tokens (see get_token_lengths).
+        run_batch: function taking a list of inputs and returning a sequence of outputs,
+            one per input (e.g. an array of vectors or scores).
+        max_tokens: max padded tokens per batch.
+        max_batch_size: optional max number of inputs per batch.
+
+    Returns:
+        List of outputs parallel to texts.
+    """
+    outputs = [None] * len(texts)
+    for batch in get_length_batches(lengths, max_tokens, max_batch_size):
+        batch_outputs = run_batch([texts[i] for i in batch])
+        for i, output in zip(batch, batch_outputs):
+            outputs[i] = output
+    return outputs
+
+def get_padding_stats(lengths, batches):
+    """Returns (real tokens, padded tokens) processed for a list of batches of indices.
+    """
+    real_tokens = sum(lengths)
+    padded_tokens = sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+    return real_tokens, padded_tokens
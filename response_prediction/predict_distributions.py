@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, Response
 from flask_restful import Resource, Api, reqparse
 from config import Config
 from transformers import AutoModelForCausalLM, AutoModelForSequenceClassification, AutoTokenizer
@@ -10,6 +10,13 @@ import tensorflow_hub as hub
 import argparse
 import numpy as np
 import math
+import metrics
+from enrichment_cache import EnrichmentCache
+from length_batching import get_token_lengths, run_length_batched
+
+requests_total = metrics.REGISTRY.counter("response_prediction_requests_total", "Number of batch response sampling requests.")
+prompts_total = metrics.REGISTRY.counter("response_prediction_prompts_total", "Number of prompts sampled.")
+model_seconds = metrics.REGISTRY.histogram("response_prediction_model_seconds", "Duration of sampling the responses of a request.")
 
 def start():
     parser = argparse.ArgumentParser("Run the response prediction service")
@@ -43,34 +50,71 @@ def start():
         else:
             sbert = SentenceTransformer(config.sbert_model_name)
             sbert.max_seq_length = config.sbert_max_seq_length
+
+    #cache embeddings and sentiment scores of repeated responses
+    cache = EnrichmentCache.from_config(config)
+    if config.embedding_type == "use_large":
+        embedding_model_id = "use_large:{0}".format(config.use_large_tfhub_url)
+    else:
+        embedding_model_id = "sbert:{0}:{1}".format(config.sbert_model_name, config.sbert_max_seq_length)
+    sentiment_model_id = "roberta:{0}:{1}".format(config.sentiment_modelpath, config.sentiment_max_seq_length)
+
+    def get_cached(model_id, texts, compute):
+        if cache is None:
+            return compute(texts)
+        return np.array(cache.get_or_compute(model_id, texts, compute))
+
+    def embed(texts, config):
+        if config.embedding_type == "use_large":
+            n_batches = math.ceil(len(texts) / config.embed_batch_size)
+            batches = [None] * n_batches
+            for i in range(n_batches):
+                start = i * config.embed_batch_size
+                end = start + config.embed_batch_size
+                batch_vecs = np.array(use_large([t for t in texts[start:end]]))
+                batches[i] = batch_vecs
+            
+            return np.concatenate(batches, axis=0)
+        else:
+            return sbert.encode(texts, batch_size=config.embed_batch_size, normalize_embeddings=True)
     
     def get_sentiment(responses, config):
+        if config.sentiment_max_batch_tokens > 0:
+            #batch responses of similar length under a token budget to minimize padding
+            lengths = get_token_lengths(sentiment_tokenizer, responses, config.sentiment_max_seq_length)
+            scores = run_length_batched(responses, lengths, lambda batch: get_batch_sentiment(batch, config),
+                                        config.sentiment_max_batch_tokens, config.sentiment_batch_size)
+            return np.array(scores)
+
         n_batches = math.ceil(len(responses) / config.sentiment_batch_size)
         batches = [None] * n_batches
         for i in range(n_batches):
             start = i * config.sentiment_batch_size
             end = start + config.sentiment_batch_size   
-            batch_inputs = sentiment_tokenizer(responses[start:end], 
-                                                padding=True, 
-                                                truncation=True, 
-                                                return_tensors="pt", 
-                                                max_length=config.sentiment_max_seq_length)
-            batch_inputs = batch_inputs.to(device)
-            
-            class_weights = torch.tensor([-1., 0., 1.]).to(device)
-            
-            with torch.no_grad():
-                logits = sentiment_model(**batch_inputs).logits
-                probs = torch.nn.functional.softmax(logits, dim=-1)
-                #Convert polarity classes (negative, positive) to score in (-1, 1)
-                polarity_scores = torch.matmul(probs, class_weights)
-                
-            batches[i] = polarity_scores.to("cpu").numpy()
+            batches[i] = get_batch_sentiment(responses[start:end], config)
         
         scores = np.concatenate(batches, axis=0)
             
         return scores
 
+    def get_batch_sentiment(batch_responses, config):
+        batch_inputs = sentiment_tokenizer(batch_responses, 
+                                            padding=True, 
+                                            truncation=True, 
+                                            return_tensors="pt", 
+                                            max_length=config.sentiment_max_seq_length)
+        batch_inputs = batch_inputs.to(device)
+            
+        class_weights = torch.tensor([-1., 0., 1.]).to(device)
+            
+        with torch.no_grad():
+            logits = sentiment_model(**batch_inputs).logits
+            probs = torch.nn.functional.softmax(logits, dim=-1)
+            #Convert polarity classes (negative, positive) to score in (-1, 1)
+            polarity_scores = torch.matmul(probs, class_weights)
+                
+        return polarity_scores.to("cpu").numpy()
+
     def sample_responses(prompts, sample_size, num_beams, temperature, random_state, config):
         if random_state:
             set_seed(random_state)
@@ -79,34 +123,43 @@ def start():
         prompts = [f"{message_token}{p['message']}{author_token}{p['author']}{response_token}" 
                    for p in prompts]
         
+        def generate_batch(batch_text):
+            inputs = tokenizer(batch_text, return_tensors='pt', padding=True)
+            inputs = inputs.to(device)
+                
+            response_ids = model.generate(inputs.input_ids, 
+                                            attention_mask=inputs.attention_mask,
+                                            max_length=tokenizer.model_max_length,
+                                            pad_token_id=tokenizer.pad_token_id,
+                                            #no_repeat_ngram_size=3,
+                                            #length_penalty=0.8,
+                                            top_k=50,
+                                            top_p=0.95,
+                                            do_sample=True,
+                                            temperature=temperature,
+                                            num_beams=num_beams,
+                                            early_stopping=True,
+                                            num_return_sequences=1)
+               
+            return [tokenizer.decode(g[inputs.input_ids.shape[-1]:], skip_special_tokens=True) for g in response_ids]
+
+        if config.generate_max_batch_tokens > 0:
+            #batch prompts of similar length under a token budget to minimize padding
+            prompt_lengths = get_token_lengths(tokenizer, prompts)
+
         #Generate sample_size response samples for each prompt in the set
         results = []
         n_batches = math.ceil(len(prompts) / config.generate_batch_size)
         for s in range(sample_size):
+            if config.generate_max_batch_tokens > 0:
+                results.extend(run_length_batched(prompts, prompt_lengths, generate_batch,
+                                                  config.generate_max_batch_tokens, config.generate_batch_size))
+                continue
             batches = [None] * n_batches
             for i in range(n_batches):
                 start = i * config.generate_batch_size
                 end = start + config.generate_batch_size
-            
-                batch_text = prompts[start:end]
-                inputs = tokenizer(batch_text, return_tensors='pt', padding=True)
-                inputs = inputs.to(device)
-                
-                response_ids = model.generate(inputs.input_ids, 
-                                                attention_mask=inputs.attention_mask,
-                                                max_length=tokenizer.model_max_length,
-                                                pad_token_id=tokenizer.pad_token_id,
-                                                #no_repeat_ngram_size=3,
-                                                #length_penalty=0.8,
-                                                top_k=50,
-                                                top_p=0.95,
-                                                do_sample=True,
-                                                temperature=temperature,
-                                                num_beams=num_beams,
-                                                early_stopping=True,
-                                                num_return_sequences=1)
-               
-                batches[i] = [tokenizer.decode(g[inputs.input_ids.shape[-1]:], skip_special_tokens=True) for g in response_ids]
+                batches[i] = generate_batch(prompts[start:end])
                 
             sample_results = [response for batch in batches for response in batch]
             results.extend(sample_results)
@@ -114,21 +167,12 @@ def start():
         
         if config.embed_enabled:
             cleaned_results_for_embedding = [clean_text(r) for r in results]
-            if config.embedding_type == "use_large":
-                n_batches = math.ceil(len(results) / config.embed_batch_size)
-                batches = [None] * n_batches
-                for i in range(n_batches):
-                    start = i * config.embed_batch_size
-                    end = start + config.embed_batch_size
-                    batch_vecs = np.array(use_large([t for t in cleaned_results_for_embedding[start:end]]))
-                    batches[i] = batch_vecs
-                
-                vecs = np.concatenate(batches, axis=0)
-            else:
-                vecs = sbert.encode(cleaned_results_for_embedding, batch_size=config.embed_batch_size, normalize_embeddings=True)
+            vecs = get_cached(embedding_model_id, cleaned_results_for_embedding, lambda texts: embed(texts, config))
         
         cleaned_results_for_sentiment = [clean_text(r, blacklist_regex=None) for r in results]
-        sentiments = get_sentiment(cleaned_results_for_sentiment, config)
+        sentiments = get_cached(sentiment_model_id, cleaned_results_for_sentiment, lambda texts: get_sentiment(texts, config))
+        if cache is not None:
+            cache.log_stats()
 
         results_rollup = []
         n_prompts = len(prompts)
@@ -161,10 +205,23 @@ def start():
             num_beams = reqargs["num_beams"]
             temperature = reqargs["temperature"]
             random_state = reqargs["random_state"]
-            results = sample_responses(prompts, sample_size, num_beams, temperature, random_state, config)
+            requests_total.inc()
+            prompts_total.inc(len(prompts))
+            with model_seconds.time():
+                results = sample_responses(prompts, sample_size, num_beams, temperature, random_state, config)
             return results
         
     api.add_resource(BatchResponseSampler, "/batchsampleresponses")
+
+    def get_metrics():
+        return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+    
+    if config.metrics_app_route:
+        app.add_url_rule("/metrics", "metrics", get_metrics)
+    if config.metrics_port > 0:
+        metrics.start_metrics_server(config.metrics_port)
+        print("Serving metrics at http://127.0.0.1:{0}/metrics".format(config.metrics_port))
+        print()
     app.run(debug=False, port=args.port, host="0.0.0.0", threaded=False)
     
 if __name__ == "__main__":
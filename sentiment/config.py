@@ -17,14 +17,43 @@ class Config(object):
         self.elasticsearch_index_name = ""
         self.elasticsearch_batch_size = 500
         self.elasticsearch_timeout_secs = 30
+        self.elasticsearch_http_compress = True
+        self.elasticsearch_max_connections = 10
+        self.elasticsearch_max_retries = 3
+        self.elasticsearch_retry_on_timeout = True
+        self.elasticsearch_retry_backoff_secs = 0.5
+        self.elasticsearch_sniff = False
 
         #Processing settings
         self.sentiment_modelpath = ""
         self.sentiment_max_seq_length = 512
+        self.sentiment_batch_size = 32
+        #token budget per batch of texts of similar length (0 batches texts in arrival order)
+        self.sentiment_max_batch_tokens = 0
         self.sleep_idle_secs = 5
         self.sleep_not_idle_secs = 0.01
+        self.metrics_port = 0
+        self.enrichment_cache_size = 0
+        self.enrichment_cache_filepath = ""
         self.log_level = "ERROR"
 
+        #Work discovery settings
+        #"query" runs the existence query for every batch; "cursor" (opt-in) walks the index with
+        #a high-water mark cursor persisted to work_cursor_filepath, with periodic gap fills
+        self.work_discovery_mode = "query"
+        self.work_cursor_filepath = ""
+        self.work_cursor_field = "id"
+        self.work_cursor_gap_fill_secs = 3600
+        self.work_cursor_gap_fill_max_attempts = 3
+
+        #Worker sharding settings
+        self.worker_count = 1
+        self.worker_index = 0
+        self.worker_num_slices = 0
+        self.worker_lease_secs = 0
+        self.worker_lease_index = ""
+        self.worker_id = ""
+
     @staticmethod
     def load(filepath):
         """Loads the config from a JSON file.
@@ -5,12 +5,23 @@ import logging
 import torch
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from elasticsearch import Elasticsearch
+import es_client
+import metrics
+from work_cursor import create_cursor_from_config
+from worker_sharding import create_shards_from_config
+from enrichment_cache import EnrichmentCache
 from elasticsearch.helpers import bulk
 from elasticsearch_dsl import Search
 
 from config import Config
 
+es_fetch_seconds = metrics.REGISTRY.histogram("sentiment_es_fetch_seconds", "Duration of the Elasticsearch query for unscored docs.")
+batch_size = metrics.REGISTRY.histogram("sentiment_batch_size", "Number of docs per fetched batch.", metrics.SIZE_BUCKETS)
+model_seconds = metrics.REGISTRY.histogram("sentiment_model_seconds", "Duration of scoring a batch with Vader and RoBERTa.")
+bulk_seconds = metrics.REGISTRY.histogram("sentiment_bulk_seconds", "Duration of the bulk update request.")
+docs_scored = metrics.REGISTRY.counter("sentiment_docs_scored_total", "Number of docs scored.")
+batch_failures = metrics.REGISTRY.counter("sentiment_batch_failures_total", "Number of batches that failed.")
+
 parser = argparse.ArgumentParser("Run the sentiment scoring service")
 parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
 parser.add_argument("--logfile", "-l", default="sentimentlog.txt", required=False, help="Path to the log file to write to.")
@@ -40,10 +51,36 @@ sentiment_tokenizer = AutoTokenizer.from_pretrained(config.sentiment_modelpath)
 sentiment_model = AutoModelForSequenceClassification.from_pretrained(config.sentiment_modelpath)
 sentiment_model.to(device)
 
+#Cache RoBERTa scores of repeated texts (popular quoted tweets, copypasta)
+cache = EnrichmentCache.from_config(config)
+roberta_model_id = "roberta:{0}:{1}".format(config.sentiment_modelpath, config.sentiment_max_seq_length)
+
+def score_roberta(texts):
+    #score in mini-batches of texts of similar length instead of one forward pass per text
+    return sentiment_helpers.get_sentiment(texts, config.sentiment_batch_size, 
+                config.sentiment_max_seq_length, 
+                sentiment_model, sentiment_tokenizer, device,
+                max_tokens=config.sentiment_max_batch_tokens).tolist()
+
+def get_roberta_scores(texts):
+    if cache is None:
+        return score_roberta(texts)
+    return cache.get_or_compute(roberta_model_id, texts, score_roberta)
+
 #Initialize elasticsearch settings
-es = Elasticsearch(hosts=[config.elasticsearch_host], 
-                   verify_certs=config.elasticsearch_verify_certs,
-                   timeout=config.elasticsearch_timeout_secs)
+es = es_client.create_client_from_config(config)
+
+#Walk the index with a high-water mark cursor instead of re-running the existence query
+cursor = create_cursor_from_config(config)
+
+#Only fetch this worker's slice of the docs when several workers share the index
+shards = create_shards_from_config(es, config, "sentiment")
+
+#Serve stage metrics
+if config.metrics_port > 0:
+    metrics.start_metrics_server(config.metrics_port)
+    print("Serving metrics at http://127.0.0.1:{0}/metrics".format(config.metrics_port))
+    print()
 
 #Poll for docs that need sentiment
 print("Polling for unscored docs in Elasticsearch...")
@@ -53,12 +90,23 @@ while True:
     try:
         s = Search(using=es, index=config.elasticsearch_index_name)
         s = s.params(size=config.elasticsearch_batch_size)
-        s.update_from_dict(sentiment_helpers.get_query())
+        query = sentiment_helpers.get_query()
+        if cursor is not None:
+            query = cursor.get_query(query)
+        if shards is not None:
+            query["query"]["bool"]["filter"].append(shards.get_filter())
+        s.update_from_dict(query)
         
         #Get the next batch of hits from Elasticsearch
-        hits = s.execute()
+        with es_fetch_seconds.time():
+            hits = s.execute()
+        batch_size.observe(len(hits))
+        if cursor is not None:
+            cursor.record_attempts(hits)
 
         if len(hits) == 0:
+            if cursor is not None:
+                cursor.advance(hits, config.elasticsearch_batch_size)
             #Sleep - idle
             logging.info("No unscored docs found. Going to sleep (idle)...")
             time.sleep(config.sleep_idle_secs)
@@ -66,12 +114,28 @@ while True:
 
         #Run sentiment analysis on the batch
         logging.info("Found {0} unscored docs. Calculating sentiment scores with Vader...".format(len(hits)))
-        updates = []
+        model_start = time.perf_counter()
+        hit_texts = []
+        roberta_text = []
         for hit in hits:
             text, quoted_text = sentiment_helpers.get_tweet_text(hit)
             text = sentiment_helpers.clean_text_for_vader(text)
+            roberta_text.append(text)
+            if quoted_text is not None:
+                quoted_text = sentiment_helpers.clean_text_for_vader(quoted_text)
+                quoted_concat_text = "{0} {1}".format(quoted_text, text)
+                roberta_text.append(quoted_text)
+                roberta_text.append(quoted_concat_text)
+            hit_texts.append((text, quoted_text))
+
+        #Score all texts of the batch with RoBERTa at once so repeats are only scored once
+        roberta_scores = iter(get_roberta_scores(roberta_text))
+
+        updates = []
+        for hit, (text, quoted_text) in zip(hits, hit_texts):
             action = {
                 "_op_type": "update",
+                "_index": hit.meta["index"],
                 "_id": hit.meta["id"],
                 "doc": {
                     "sentiment": {
@@ -79,35 +143,36 @@ while True:
                             "primary": vader.polarity_scores(text)["compound"]
                         },
                         "roberta": {
-                            "primary": sentiment_helpers.get_sentiment([text], 1, 
-                                            config.sentiment_max_seq_length, 
-                                            sentiment_model, sentiment_tokenizer, device).item()
+                            "primary": next(roberta_scores)
                         }
                     }
                 }
             }
             if quoted_text is not None:
-                quoted_text = sentiment_helpers.clean_text_for_vader(quoted_text)
                 quoted_concat_text = "{0} {1}".format(quoted_text, text)
                 action["doc"]["sentiment"]["vader"]["quoted"] = vader.polarity_scores(quoted_text)["compound"]
                 action["doc"]["sentiment"]["vader"]["quoted_concat"] = vader.polarity_scores(quoted_concat_text)["compound"]
 
-                action["doc"]["sentiment"]["roberta"]["quoted"] = sentiment_helpers.get_sentiment([quoted_text], 1, 
-                                                                        config.sentiment_max_seq_length,
-                                                                        sentiment_model, sentiment_tokenizer, device).item()
-                action["doc"]["sentiment"]["roberta"]["quoted_concat"] = sentiment_helpers.get_sentiment([quoted_concat_text], 1, 
-                                                                            config.sentiment_max_seq_length,
-                                                                            sentiment_model, sentiment_tokenizer, device).item()
+                action["doc"]["sentiment"]["roberta"]["quoted"] = next(roberta_scores)
+                action["doc"]["sentiment"]["roberta"]["quoted_concat"] = next(roberta_scores)
 
             updates.append(action)
+        model_seconds.observe(time.perf_counter() - model_start)
 
         #Issue the bulk update request
         logging.info("Making bulk request to Elasticsearch with {0} update actions...".format(len(updates)))
-        bulk(es, updates, index=config.elasticsearch_index_name, chunk_size=len(updates))
+        with bulk_seconds.time():
+            bulk(es, updates, index=config.elasticsearch_index_name, chunk_size=len(updates))
+        docs_scored.inc(len(hits))
+        if cache is not None:
+            cache.log_stats()
+        if cursor is not None:
+            cursor.advance(hits, config.elasticsearch_batch_size)
 
         #Sleep - not idle
         logging.info("Updates completed successfully. Going to sleep (not idle)...")
         time.sleep(config.sleep_not_idle_secs)
 
     except Exception as ex:
+        batch_failures.inc()
         logging.exception("Exception occurred while polling or processing a batch.")
\ No newline at end of file
@@ -3,6 +3,7 @@ import math
 import numpy as np
 import torch
 import html
+from length_batching import get_token_lengths, run_length_batched
 
 def get_query():
     query = {
@@ -78,7 +79,15 @@ def clean_text_for_vader(text):
     text = text.strip()
     return text
 
-def get_sentiment(responses, batch_size, max_length, sentiment_model, sentiment_tokenizer, device):
+def get_sentiment(responses, batch_size, max_length, sentiment_model, sentiment_tokenizer, device, max_tokens=None):
+    if max_tokens:
+        #batch texts of similar length under a token budget to minimize padding
+        lengths = get_token_lengths(sentiment_tokenizer, responses, max_length)
+        scores = run_length_batched(responses, lengths,
+                                    lambda batch: get_sentiment(batch, len(batch), max_length, sentiment_model, sentiment_tokenizer, device),
+                                    max_tokens, batch_size)
+        return np.array(scores)
+
     n_batches = math.ceil(len(responses) / batch_size)
     batches = [None] * n_batches
     for i in range(n_batches):
@@ -0,0 +1,133 @@
+"""
+Offline bulk sentiment scoring of exported tweets (jsonl(.gz) dumps or Elasticsearch scan
+exports) into sharded .npy files keyed by tweet id, for re-scoring whole historical
+collections at full batch throughput without polling Elasticsearch. The shards are pushed
+back to Elasticsearch with tools/enrichment_loader.
+
+Example:
+    python sentiment_offline.py -d "./data/*.jsonl.gz" -o ./sentiment --processes 2
+"""
+import argparse
+import glob
+import logging
+import time
+import numpy as np
+import sentiment_helpers
+from enrichment_cache import EnrichmentCache
+from enrichment_shards import enrich_files, get_tweet_id
+
+from config import Config
+
+SENTIMENT_FIELDS = ("primary", "quoted", "quoted_concat")
+
+def load_enrich_function(configfile, batch_size, max_tokens):
+    """Loads Vader and the RoBERTa model (runs once in each worker process) and returns the
+    function scoring a list of tweets into shard fields.
+    """
+    import torch
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    config = Config.load(configfile)
+    vader = SentimentIntensityAnalyzer()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    sentiment_tokenizer = AutoTokenizer.from_pretrained(config.sentiment_modelpath)
+    sentiment_model = AutoModelForSequenceClassification.from_pretrained(config.sentiment_modelpath)
+    sentiment_model.to(device)
+    sentiment_model.eval()
+    #only dedupe repeated texts in memory; the on-disk cache is not shared between processes
+    cache = EnrichmentCache(config.enrichment_cache_size) if config.enrichment_cache_size > 0 else None
+    roberta_model_id = "roberta:{0}:{1}".format(config.sentiment_modelpath, config.sentiment_max_seq_length)
+
+    def score_roberta(texts):
+        return sentiment_helpers.get_sentiment(texts, batch_size, config.sentiment_max_seq_length,
+                                               sentiment_model, sentiment_tokenizer, device, max_tokens)
+
+    def score_tweets(tweets):
+        ids = []
+        texts = []
+        #(row, field index) of each text
+        text_rows = []
+        for tweet in tweets:
+            if "retweeted_status" in tweet:
+                continue
+            row = len(ids)
+            ids.append(get_tweet_id(tweet))
+            text, quoted_text = sentiment_helpers.get_tweet_text(tweet)
+            text = sentiment_helpers.clean_text_for_vader(text)
+            texts.append(text)
+            text_rows.append((row, 0))
+            if quoted_text is not None:
+                quoted_text = sentiment_helpers.clean_text_for_vader(quoted_text)
+                texts.append(quoted_text)
+                texts.append("{0} {1}".format(quoted_text, text))
+                text_rows.append((row, 1))
+                text_rows.append((row, 2))
+
+        fields = {}
+        if len(texts) == 0:
+            return ids, fields
+        roberta_scores = (cache.get_or_compute(roberta_model_id, texts, score_roberta) if cache is not None
+                          else score_roberta(texts))
+        vader_fields = [np.full(len(ids), np.nan, dtype=np.float32) for _ in SENTIMENT_FIELDS]
+        roberta_fields = [np.full(len(ids), np.nan, dtype=np.float32) for _ in SENTIMENT_FIELDS]
+        for (row, field_index), text, roberta_score in zip(text_rows, texts, roberta_scores):
+            vader_fields[field_index][row] = vader.polarity_scores(text)["compound"]
+            roberta_fields[field_index][row] = roberta_score
+        for field, vader_values, roberta_values in zip(SENTIMENT_FIELDS, vader_fields, roberta_fields):
+            fields["sentiment.vader.{0}".format(field)] = vader_values
+            fields["sentiment.roberta.{0}".format(field)] = roberta_values
+        return ids, fields
+
+    return score_tweets
+
+def start():
+    parser = argparse.ArgumentParser("Score the sentiment of exported tweets offline into .npy shards")
+    parser.add_argument("--datasetglob", "-d", required=True, help="glob pattern specifying the tweet json, jsonl or jsonl.gz file(s). Ex: './data/*.jsonl.gz'")
+    parser.add_argument("--outputdir", "-o", required=True, help="Directory to write the shards to.")
+    parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
+    parser.add_argument("--logfile", "-l", default="sentimentofflinelog.txt", required=False, help="Path to the log file to write to.")
+    parser.add_argument("--processes", "-p", type=int, default=1, required=False, help="Number of worker processes (each loads its own copy of the model).")
+    parser.add_argument("--shardsize", type=int, default=100000, required=False, help="Number of input tweets per shard.")
+    parser.add_argument("--batchsize", type=int, required=False, help="Max number of texts per RoBERTa batch (defaults to sentiment_batch_size).")
+    parser.add_argument("--maxtokens", type=int, required=False, help="Token budget per RoBERTa batch for length-bucketed batching, 0 to batch in arrival order (defaults to sentiment_max_batch_tokens).")
+    args = parser.parse_args()
+
+    print()
+    print("Running with arguments:")
+    print(args)
+    print()
+
+    config = Config.load(args.configfile)
+    batch_size = args.batchsize if args.batchsize is not None else config.sentiment_batch_size
+    max_tokens = args.maxtokens if args.maxtokens is not None else config.sentiment_max_batch_tokens
+
+    #Configure logging
+    logging.basicConfig(filename=args.logfile,
+                        format="[%(asctime)s - %(levelname)s]: %(message)s",
+                        level=logging.getLevelName(config.log_level))
+
+    paths = sorted(glob.glob(args.datasetglob))
+    print("Scoring {0} file(s) with {1} process(es)...".format(len(paths), args.processes))
+    print()
+
+    start_time = time.perf_counter()
+    total_tweets = 0
+    failed = []
+    for path, num_tweets, error in enrich_files(paths, args.outputdir, load_enrich_function,
+                                                (args.configfile, batch_size, max_tokens),
+                                                args.shardsize, args.processes):
+        if error is not None:
+            failed.append(path)
+            print("Failed {0}: {1!r}".format(path, error))
+            continue
+        total_tweets += num_tweets
+        elapsed = time.perf_counter() - start_time
+        print("Scored {0} ({1} tweets). Cumulative total: {2} tweets, {3:.0f} tweets/sec".format(
+            path, num_tweets, total_tweets, total_tweets / elapsed))
+
+    print()
+    print("Done with {0} failed file(s). Rerun to retry them.".format(len(failed)))
+
+if __name__ == "__main__":
+    start()
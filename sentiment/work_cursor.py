@@ -0,0 +1,155 @@
+"""
+High-water mark cursor used by the pollers to discover unprocessed docs incrementally
+instead of re-running the "must_not exists" query over the whole index for every batch.
+"""
+import copy
+import json
+import logging
+import os
+import time
+
+class WorkCursor(object):
+    """Walks the index in ascending order of a numeric field (the tweet id by default),
+    persisting the highest value processed so far.
+
+    Every cursor batch is restricted to docs above the high-water mark and sorted on the
+    cursor field, so each poll only touches the newest part of the index. Docs the cursor
+    can miss (batches that failed, docs indexed late with a lower id, duplicate ids across
+    rollover indices) are picked up by a periodic gap fill, which runs the original existence
+    query restricted to docs at or below the high-water mark until it comes back short.
+
+    A doc that keeps failing would be returned first by every gap fill query, so the docs a
+    gap fill has returned gap_fill_max_attempts times are left out of it until the next gap fill.
+    """
+    def __init__(self, filepath, field="id", gap_fill_interval_secs=3600, gap_fill_max_attempts=3):
+        """Initializes the WorkCursor instance at the start of the index.
+
+        Args:
+            filepath: path of the file the cursor state is persisted to.
+            field: numeric field to walk the index on.
+            gap_fill_interval_secs: time between gap fills. 0 or less disables gap filling.
+            gap_fill_max_attempts: number of times a gap fill returns a doc before skipping it.
+        """
+        self.filepath = filepath
+        self.field = field
+        self.gap_fill_interval_secs = gap_fill_interval_secs
+        self.gap_fill_max_attempts = gap_fill_max_attempts
+        self.high_water_mark = None
+        self.last_gap_fill = time.time()
+        self.gap_filling = False
+        #number of times the current gap fill returned each cursor value
+        self.gap_attempts = {}
+
+    @staticmethod
+    def load(filepath, field="id", gap_fill_interval_secs=3600, gap_fill_max_attempts=3):
+        """Loads the cursor state from its file if it exists.
+
+        Args:
+            filepath: path of the cursor state file.
+            field: numeric field to walk the index on.
+            gap_fill_interval_secs: time between gap fills. 0 or less disables gap filling.
+            gap_fill_max_attempts: number of times a gap fill returns a doc before skipping it.
+        """
+        cursor = WorkCursor(filepath, field, gap_fill_interval_secs, gap_fill_max_attempts)
+        if os.path.exists(filepath):
+            with open(filepath, "r") as f:
+                state = json.load(f)
+            if state.get("field") == field:
+                cursor.high_water_mark = state["high_water_mark"]
+                cursor.last_gap_fill = state["last_gap_fill"]
+                cursor.gap_attempts = {value: attempts for value, attempts in state.get("gap_attempts", [])}
+            else:
+                logging.warning("Ignoring cursor state in {0} that was saved for field '{1}'.".format(filepath, state.get("field")))
+        return cursor
+
+    def get_query(self, query):
+        """Returns a copy of a work discovery query restricted to the next cursor batch,
+        or to the already walked part of the index when a gap fill is due.
+
+        Args:
+            query: the "must_not exists" query body used to find unprocessed docs.
+        """
+        if (not self.gap_filling and self.high_water_mark is not None and self.gap_fill_interval_secs > 0
+                and time.time() - self.last_gap_fill >= self.gap_fill_interval_secs):
+            logging.info("Starting gap fill below {0} {1}...".format(self.field, self.high_water_mark))
+            self.gap_filling = True
+
+        query = copy.deepcopy(query)
+        if self.gap_filling:
+            range_filter = {"lte": self.high_water_mark}
+            skipped = self.get_skipped()
+            if len(skipped) > 0:
+                query["query"]["bool"]["filter"].append({"bool": {"must_not": {"terms": {self.field: skipped}}}})
+        elif self.high_water_mark is not None:
+            range_filter = {"gt": self.high_water_mark}
+        else:
+            range_filter = None
+        if range_filter is not None:
+            query["query"]["bool"]["filter"].append({"range": {self.field: range_filter}})
+        query["sort"] = [{self.field: "asc"}]
+        return query
+
+    def get_skipped(self):
+        """Returns the cursor values the current gap fill has given up on.
+        """
+        return [value for value, attempts in self.gap_attempts.items() if attempts >= self.gap_fill_max_attempts]
+
+    def record_attempts(self, hits):
+        """Counts the docs returned by a gap fill query, so the ones that keep coming back
+        are skipped (see get_skipped). Does nothing outside gap fills.
+
+        Args:
+            hits: the hits returned by the query from get_query.
+        """
+        if not self.gap_filling:
+            return
+        for hit in hits:
+            value = hit.meta.sort[0]
+            self.gap_attempts[value] = self.gap_attempts.get(value, 0) + 1
+            if self.gap_attempts[value] == self.gap_fill_max_attempts:
+                logging.warning("Skipping {0} {1} for the rest of the gap fill after {2} attempts.".format(
+                    self.field, value, self.gap_fill_max_attempts))
+
+    def advance(self, hits, batch_size):
+        """Records a successfully processed batch and saves the cursor state.
+
+        Args:
+            hits: the hits returned by the query from get_query.
+            batch_size: the size the query was executed with. A gap fill ends on the first
+                batch that comes back short.
+        """
+        if self.gap_filling:
+            if len(hits) < batch_size:
+                logging.info("Gap fill completed ({0} docs skipped).".format(len(self.get_skipped())))
+                self.gap_filling = False
+                self.last_gap_fill = time.time()
+                #skipped docs are retried by the next gap fill
+                self.gap_attempts = {}
+        elif len(hits) > 0:
+            self.high_water_mark = hits[-1].meta.sort[0]
+        self.save()
+
+    def save(self):
+        tmp_filepath = self.filepath + ".tmp"
+        with open(tmp_filepath, "w") as f:
+            json.dump({"field": self.field,
+                       "high_water_mark": self.high_water_mark,
+                       "last_gap_fill": self.last_gap_fill,
+                       "gap_attempts": list(self.gap_attempts.items())}, f)
+        os.replace(tmp_filepath, self.filepath)
+
+def create_cursor_from_config(config):
+    """Returns the WorkCursor configured by the work_discovery_* settings, or None if
+    work_discovery_mode is "query" (every batch runs the existence query).
+
+    Args:
+        config: tool Config instance.
+    """
+    if config.work_discovery_mode == "query":
+        return None
+    if config.work_discovery_mode != "cursor":
+        raise ValueError("Unknown work discovery mode '{0}'. Valid modes: ['query', 'cursor']".format(config.work_discovery_mode))
+    return WorkCursor.load(config.work_cursor_filepath,
+                           config.work_cursor_field,
+                           config.work_cursor_gap_fill_secs,
+                           config.work_cursor_gap_fill_max_attempts)
@@ -0,0 +1,201 @@
+"""
+Sharding of the poll queries across several worker processes, so that each worker
+enriches a disjoint slice of the unprocessed docs.
+"""
+import logging
+import os
+import socket
+import time
+from elasticsearch.exceptions import ConflictError, NotFoundError, RequestError
+
+#murmur3 64-bit finalizer of the tweet id, so consecutive ids spread evenly over the slices
+#(the multipliers are 0xff51afd7ed558ccd and 0xc4ceb9fe1a85ec53 as signed longs)
+SLICE_SCRIPT = """
+long h = doc['id'].value;
+h ^= h >>> 33;
+h *= -49064778989728563L;
+h ^= h >>> 33;
+h *= -4265267296055464877L;
+h ^= h >>> 33;
+return params.slices.contains((int) Math.floorMod(h, (long) params.num_slices));
+"""
+
+_MASK64 = (1 << 64) - 1
+
+def get_slice(tweet_id, num_slices):
+    """Returns the slice of a tweet id, computed the same way as SLICE_SCRIPT.
+    """
+    h = tweet_id & _MASK64
+    h ^= h >> 33
+    h = (h * 0xff51afd7ed558ccd) & _MASK64
+    h ^= h >> 33
+    h = (h * 0xc4ceb9fe1a85ec53) & _MASK64
+    h ^= h >> 33
+    if h >= 1 << 63:
+        h -= 1 << 64
+    return h % num_slices
+
+class WorkerShards(object):
+    """Splits the tweet ids into num_slices hash slices and tracks which of them this
+    worker owns.
+
+    Without leases, a worker statically owns its home slices (slice % worker_count ==
+    worker_index). With leases, ownership is recorded in a lease index: each worker claims
+    and renews its home slices, and takes over slices whose lease has expired (e.g. their
+    worker crashed). Taken over slices are not renewed and are only claimed again after a
+    grace period, which gives a restarted worker the chance to reclaim its home slices.
+    All lease writes use optimistic concurrency control (if_seq_no / if_primary_term), so
+    two workers can never both claim a slice.
+    """
+    def __init__(self, es, worker_index, worker_count, num_slices=None, lease_secs=0, lease_index=None,
+                 lease_name="worker", worker_id=None):
+        """Initializes the WorkerShards instance.
+
+        Args:
+            es: Elasticsearch client.
+            worker_index: index of this worker in [0, worker_count).
+            worker_count: number of workers.
+            num_slices: number of hash slices (defaults to worker_count). More slices than
+                workers spread a crashed worker's share over the survivors.
+            lease_secs: lease duration. 0 or less disables leases (static sharding).
+            lease_index: name of the index holding the slice leases.
+            lease_name: prefix of the lease doc ids, so several tools can share an index.
+            worker_id: unique name of this worker (defaults to host:pid).
+        """
+        if worker_index < 0 or worker_index >= worker_count:
+            raise ValueError("Worker index {0} is outside [0, {1}).".format(worker_index, worker_count))
+        self.es = es
+        self.worker_index = worker_index
+        self.worker_count = worker_count
+        self.num_slices = num_slices if num_slices else worker_count
+        self.lease_secs = lease_secs
+        self.lease_index = lease_index
+        self.lease_name = lease_name
+        self.worker_id = worker_id if worker_id else "{0}:{1}".format(socket.gethostname(), os.getpid())
+        self.home_slices = set(i for i in range(self.num_slices) if i % worker_count == worker_index)
+        self.slices = set(self.home_slices) if lease_secs <= 0 else set()
+        self.last_refresh = 0
+        self.started = time.time()
+
+    def get_filter(self):
+        """Returns the query filter matching the docs of the slices this worker owns.
+        """
+        self.refresh()
+        return {
+            "script": {
+                "script": {
+                    "source": SLICE_SCRIPT,
+                    "lang": "painless",
+                    "params": {
+                        "slices": sorted(self.slices),
+                        "num_slices": self.num_slices
+                    }
+                }
+            }
+        }
+
+    def refresh(self):
+        """Claims, renews and takes over slice leases. Runs at most every third of the
+        lease duration.
+        """
+        now = time.time()
+        if self.lease_secs <= 0 or now - self.last_refresh < self.lease_secs / 3:
+            return
+        self.last_refresh = now
+
+        lease_ids = [self._get_lease_id(i) for i in range(self.num_slices)]
+        try:
+            docs = self.es.mget(index=self.lease_index, body={"ids": lease_ids})["docs"]
+        except NotFoundError:
+            docs = [{"found": False} for _ in lease_ids]
+
+        slices = set()
+        for i, doc in enumerate(docs):
+            #mget items of a missing lease index are errors without a "found" key
+            if not doc.get("found"):
+                #leave slices nobody claimed yet to their home worker for a grace period
+                claim = i in self.home_slices or now - self.started > self.lease_secs
+            else:
+                lease = doc["_source"]
+                expired_secs = now - lease["expires_at"]
+                mine = lease["owner"] == self.worker_id
+                if i in self.home_slices:
+                    claim = mine or expired_secs > 0
+                else:
+                    #slices taken over are held until their lease expires without being renewed,
+                    #and are only claimed again after a grace period, so their home worker can
+                    #reclaim them when it comes back
+                    if mine and expired_secs <= 0:
+                        slices.add(i)
+                    claim = expired_secs > self.lease_secs
+            if claim and self._claim(lease_ids[i], doc, now):
+                slices.add(i)
+
+        if slices != self.slices:
+            logging.info("Worker {0} now owns slices {1} of {2}.".format(self.worker_id, sorted(slices), self.num_slices))
+        self.slices = slices
+
+    def _claim(self, lease_id, doc, now):
+        body = {"owner": self.worker_id, "expires_at": now + self.lease_secs}
+        try:
+            if doc.get("found"):
+                self.es.index(index=self.lease_index, id=lease_id, body=body,
+                              if_seq_no=doc["_seq_no"], if_primary_term=doc["_primary_term"])
+            else:
+                self.es.create(index=self.lease_index, id=lease_id, body=body)
+            return True
+        except ConflictError:
+            #another worker claimed or renewed the slice first
+            return False
+
+    def _get_lease_id(self, slice_num):
+        return "{0}-{1}".format(self.lease_name, slice_num)
+
+def create_lease_index(es, lease_index):
+    """Creates the lease index with explicit mappings if it does not exist yet, so the
+    lease fields are not left to dynamic mapping.
+
+    Args:
+        es: Elasticsearch client.
+        lease_index: name of the index holding the slice leases.
+    """
+    if es.indices.exists(lease_index):
+        return
+    try:
+        es.indices.create(lease_index, {
+            "mappings": {
+                "properties": {
+                    "owner": {
+                        "type": "keyword"
+                    },
+                    "expires_at": {
+                        "type": "double"
+                    }
+                }
+            }
+        })
+    except RequestError as ex:
+        #another worker created it first
+        if ex.error != "resource_already_exists_exception":
+            raise
+
+def create_shards_from_config(es, config, lease_name):
+    """Returns the WorkerShards configured by the worker_* settings, or None if the
+    tool runs as a single worker.
+
+    Args:
+        es: Elasticsearch client.
+        config: tool Config instance.
+        lease_name: prefix of the tool's lease doc ids.
+    """
+    if config.worker_count <= 1 and config.worker_lease_secs <= 0:
+        return None
+    lease_index = config.worker_lease_index if config.worker_lease_index else "worker-leases-{0}".format(config.elasticsearch_index_name)
+    if config.worker_lease_secs > 0:
+        create_lease_index(es, lease_index)
+    return WorkerShards(es, config.worker_index, max(config.worker_count, 1),
+                        num_slices=config.worker_num_slices,
+                        lease_secs=config.worker_lease_secs,
+                        lease_index=lease_index,
+                        lease_name=lease_name,
+                        worker_id=config.worker_id)
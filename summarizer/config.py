@@ -14,6 +14,13 @@ class Config(object):
         #Model settings
         self.transformers_models = []
         self.batch_size = 32
+        self.max_batch_tokens = 0
+
+        #Metrics settings
+        #metrics are served on a separate port bound to localhost (0 disables them); the public
+        #app only serves /metrics if metrics_app_route is set
+        self.metrics_port = 0
+        self.metrics_app_route = False
 
     @staticmethod
     def load(filepath):
@@ -1,10 +1,16 @@
-from flask import Flask
+from flask import Flask, Response
 from flask_restful import Resource, Api, reqparse
 from config import Config
 from transformers import BartTokenizer, BartForConditionalGeneration
 import torch
 import math
 import argparse
+from length_batching import get_token_lengths, run_length_batched
+import metrics
+
+requests_total = metrics.REGISTRY.counter("summarizer_requests_total", "Number of batch summarization requests.")
+texts_total = metrics.REGISTRY.counter("summarizer_texts_total", "Number of texts summarized.")
+model_seconds = metrics.REGISTRY.histogram("summarizer_model_seconds", "Duration of summarizing the texts of a request.")
 
 def start():
     parser = argparse.ArgumentParser("Run the summarizer service")
@@ -45,15 +51,7 @@ def start():
         model = models[model_name]["model"]
         tokenizer = models[model_name]["tokenizer"]
 
-        n_batches = math.ceil(len(original_text) / batch_size)
-        batches = [None] * n_batches
-        
-        for i in range(n_batches):
-            start = i * batch_size
-            end = start + batch_size
-
-            batch_text = original_text[start:end]
-
+        def summarize_batch(batch_text):
             inputs = tokenizer.batch_encode_plus(
                 batch_text, 
                 return_tensors="pt",
@@ -65,6 +63,7 @@ def start():
             # Generate Summary
             summary_ids = model.generate(
                 inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
                 num_beams=num_beams,
                 max_length=max_len,
                 temperature=temperature,
@@ -73,14 +72,25 @@ def start():
                 top_p=0.95,
                 early_stopping=True
             )
-            out = [
+            return [
                 tokenizer.decode(
                     g, skip_special_tokens=True, clean_up_tokenization_spaces=False
                 )
                 for g in summary_ids
             ]
 
-            batches[i] = out
+        if config.max_batch_tokens > 0:
+            #batch texts of similar length under a token budget to minimize padding
+            lengths = get_token_lengths(tokenizer, original_text, tokenizer.model_max_length)
+            return run_length_batched(original_text, lengths, summarize_batch, config.max_batch_tokens, batch_size)
+
+        n_batches = math.ceil(len(original_text) / batch_size)
+        batches = [None] * n_batches
+        
+        for i in range(n_batches):
+            start = i * batch_size
+            end = start + batch_size
+            batches[i] = summarize_batch(original_text[start:end])
 
         results = [summary for batch in batches for summary in batch]
         return results
@@ -105,10 +115,23 @@ def start():
             temperature = reqargs["temperature"]
             do_sample = reqargs["do_sample"]
             model = reqargs["model"]
-            summaries = summarize(text, max_len, num_beams, temperature, do_sample, config.batch_size, model)
+            requests_total.inc()
+            texts_total.inc(len(text))
+            with model_seconds.time():
+                summaries = summarize(text, max_len, num_beams, temperature, do_sample, config.batch_size, model)
             return summaries
         
     api.add_resource(BatchSummarizer, "/batchsummarize")
+
+    def get_metrics():
+        return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+    if config.metrics_app_route:
+        app.add_url_rule("/metrics", "metrics", get_metrics)
+    if config.metrics_port > 0:
+        metrics.start_metrics_server(config.metrics_port)
+        print("Serving metrics at http://127.0.0.1:{0}/metrics".format(config.metrics_port))
+        print()
     app.run(debug=False, port=args.port, host="0.0.0.0", threaded=False)
 
 if __name__ == "__main__":
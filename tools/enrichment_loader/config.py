@@ -0,0 +1,47 @@
+"""
+Config class containing all the settings for running enrichment loader tool
+"""
+
+import jsonpickle
+
+class Config(object):
+    """Container for enrichment loader tool settings.
+
+    """
+    def __init__(self):
+        """Initializes the Config instance.
+        """
+        #Elasticsearch settings
+        self.elasticsearch_host = ""
+        self.elasticsearch_verify_certs = False
+        self.elasticsearch_index_name = ""
+        self.elasticsearch_timeout_secs = 30
+        self.elasticsearch_http_compress = True
+        self.elasticsearch_max_connections = 10
+        self.elasticsearch_max_retries = 3
+        self.elasticsearch_retry_on_timeout = True
+        self.elasticsearch_retry_backoff_secs = 0.5
+        self.elasticsearch_sniff = False
+
+        #Loading settings
+        self.bulk_chunk_size = 500
+        self.bulk_threads = 4
+        #bulk updates rejected by an overloaded cluster (429) or lost to connection errors are
+        #retried up to bulk_max_retries times, backing off exponentially from bulk_retry_backoff_secs
+        self.bulk_max_retries = 5
+        self.bulk_retry_backoff_secs = 2
+        #vector encoding: "float32", "rounded" (embedding_round_digits decimals) or "int8" (with scale factor)
+        self.embedding_precision = "float32"
+        self.embedding_round_digits = 4
+
+    @staticmethod
+    def load(filepath):
+        """Loads the config from a JSON file.
+
+        Args:
+            filepath: path of the JSON file.
+        """
+        with open(filepath, "r") as file:
+            json = file.read()
+        config = jsonpickle.decode(json)
+        return config
@@ -0,0 +1,108 @@
+"""
+Bulk loader pushing the shards written by the offline enrichment scripts
+(embedder/embed_offline.py, sentiment/sentiment_offline.py) to Elasticsearch as partial
+updates. Loaded shards are marked with a <name>.loaded file so reruns resume where the
+previous run stopped. Shards with failed updates are left unmarked (unless --allowfailed
+is given), so reruns retry them.
+
+Shards written from Elasticsearch scan exports update each tweet in the index it was
+exported from. Other shards update elasticsearch_index_name, which only reaches the write
+index when it is a rollover alias.
+
+Example:
+    python enrichment_loader.py -i ./embeddings
+"""
+import argparse
+import os
+import time
+import numpy as np
+import enrichment_loader_helpers
+from enrichment_shards import get_shard_names, load_shard, load_shard_indices
+from elasticsearch.helpers import parallel_bulk
+
+from config import Config
+import es_client
+
+def start():
+    #load the args & config
+    parser = argparse.ArgumentParser("Run the enrichment loader")
+    parser.add_argument("--inputdir", "-i", required=True, help="Directory holding the shards to load.")
+    parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
+    parser.add_argument("--fields", "-f", nargs="+", required=False, help="Only load the fields starting with these prefixes. Ex: 'embedding.sbert'")
+    parser.add_argument("--reload", action="store_true", required=False, help="Load shards that were already loaded by a previous run.")
+    parser.add_argument("--allowfailed", action="store_true", required=False, help="Mark shards with failed updates (e.g. tweets deleted from the index) as loaded, so reruns skip them.")
+    args = parser.parse_args()
+
+    print()
+    print("Running with arguments:")
+    print(args)
+    print()
+
+    config = Config.load(args.configfile)
+
+    es = es_client.create_client_from_config(config, max_connections=config.bulk_threads)
+
+    shard_names = get_shard_names(args.inputdir)
+    print("Loading {0} shard(s) into '{1}'...".format(len(shard_names), config.elasticsearch_index_name))
+    print()
+
+    start_time = time.perf_counter()
+    total_updated = 0
+    total_failed = 0
+    for name in shard_names:
+        loaded_filepath = os.path.join(args.inputdir, "{0}.loaded".format(name))
+        if not args.reload and os.path.exists(loaded_filepath):
+            continue
+
+        ids, fields = load_shard(args.inputdir, name)
+        index_names = load_shard_indices(args.inputdir, name)
+        if args.fields:
+            fields = {field: values for field, values in fields.items() if field.startswith(tuple(args.fields))}
+
+        updated = 0
+        failed = 0
+        for attempt in range(config.bulk_max_retries + 1):
+            actions = enrichment_loader_helpers.get_actions(config.elasticsearch_index_name, ids, fields,
+                                                            config.embedding_precision, config.embedding_round_digits,
+                                                            index_names)
+            retry_ids = []
+            #docs missing from the index fail individually without stopping the load
+            for ok, item in parallel_bulk(es, actions, thread_count=config.bulk_threads, chunk_size=config.bulk_chunk_size,
+                                          raise_on_error=False, raise_on_exception=False):
+                if ok:
+                    updated += 1
+                elif attempt < config.bulk_max_retries and enrichment_loader_helpers.is_transient_failure(item):
+                    retry_ids.append(enrichment_loader_helpers.get_failed_id(item))
+                else:
+                    failed += 1
+                    if failed <= 5:
+                        print("Update failed: {0}".format(item))
+            if len(retry_ids) == 0:
+                break
+
+            #back off, then retry only the rows of the transient failures
+            backoff_secs = config.bulk_retry_backoff_secs * 2 ** attempt
+            print("Retrying {0} update(s) of {1} in {2:.1f} secs...".format(len(retry_ids), name, backoff_secs))
+            time.sleep(backoff_secs)
+            mask = np.isin(ids, np.array(retry_ids, dtype=np.int64))
+            ids = ids[mask]
+            fields = {field: values[mask] for field, values in fields.items()}
+            if index_names is not None:
+                index_names = index_names[mask]
+
+        if failed == 0 or args.allowfailed:
+            with open(loaded_filepath, "w") as f:
+                f.write("{0} updated, {1} failed\n".format(updated, failed))
+        total_updated += updated
+        total_failed += failed
+        elapsed = time.perf_counter() - start_time
+        print("Loaded {0}: {1} updated, {2} failed. Cumulative total: {3} updated, {4:.0f} docs/sec".format(
+            name, updated, failed, total_updated, total_updated / elapsed))
+
+    print()
+    print("Loading complete. Updated: {0}; Failed: {1}".format(total_updated, total_failed))
+    if total_failed > 0 and not args.allowfailed:
+        print("Shards with failed updates were not marked as loaded. Rerun to retry them, or pass --allowfailed to skip them.")
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,63 @@
+import numpy as np
+from elasticsearch.exceptions import ConnectionError
+from vector_codec import encode_vector, get_scale_field
+
+#bulk item statuses worth retrying (overloaded or temporarily unavailable cluster)
+TRANSIENT_STATUSES = (429, 502, 503, 504)
+
+def set_field(doc, field, value):
+    """Sets a dotted field path (e.g. embedding.sbert.primary) in a nested doc.
+    """
+    keys = field.split(".")
+    for key in keys[:-1]:
+        doc = doc.setdefault(key, {})
+    doc[keys[-1]] = value
+
+def get_actions(index_name, ids, fields, precision="float32", round_digits=4, index_names=None):
+    """Generates the bulk partial update actions of a shard. NaN values (missing fields)
+    are left out, and docs without any value are skipped.
+
+    Args:
+        index_name: index to update when the concrete index of a tweet is unknown.
+        ids: array of tweet ids.
+        fields: dict of field name to array with one row per id (see enrichment_shards).
+        precision: vector encoding (see vector_codec.PRECISIONS).
+        round_digits: number of decimals kept by the "rounded" precision.
+        index_names: optional array parallel to ids of the concrete index of each tweet
+            (see enrichment_shards.load_shard_indices). Updates through a rollover alias
+            only reach its write index, so tweets in older backing indices need these.
+    """
+    for i, tweet_id in enumerate(ids):
+        doc = {}
+        for field, values in fields.items():
+            value = values[i]
+            if values.ndim > 1:
+                if np.isnan(value[0]):
+                    continue
+                vec, scale = encode_vector(value, precision, round_digits)
+                set_field(doc, field, vec)
+                if scale is not None:
+                    set_field(doc, get_scale_field(field), scale)
+            elif not np.isnan(value):
+                set_field(doc, field, float(value))
+        if len(doc) == 0:
+            continue
+        yield {
+            "_op_type": "update",
+            "_index": index_names[i] if index_names is not None and index_names[i] is not None else index_name,
+            "_id": str(tweet_id),
+            "doc": doc
+        }
+
+def get_failed_id(item):
+    """Returns the tweet id of a failed bulk item.
+    """
+    return int(list(item.values())[0]["_id"])
+
+def is_transient_failure(item):
+    """Returns whether a failed bulk item is worth retrying: rejected by an overloaded
+    cluster or lost to a connection error, rather than failed on the doc itself (e.g. a
+    tweet missing from the index).
+    """
+    info = list(item.values())[0]
+    return info.get("status") in TRANSIENT_STATUSES or isinstance(info.get("exception"), ConnectionError)
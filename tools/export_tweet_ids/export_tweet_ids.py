@@ -3,7 +3,7 @@ import time
 import os
 import export_tweet_ids_helpers
 from datetime import datetime, timedelta
-from elasticsearch import Elasticsearch
+import es_client
 from elasticsearch_dsl import Search
 
 from config import Config
@@ -34,9 +34,7 @@ def start():
   if startdate > enddate:
     raise ValueError("--enddate must be greater than or equal to --startdate.")
 
-  es = Elasticsearch(hosts=[config.elasticsearch_host], 
-                      verify_certs=config.elasticsearch_verify_certs,
-                      timeout=config.elasticsearch_timeout_secs)
+  es = es_client.create_client_from_config(config)
 
   total_count = 0
   current_time = startdate
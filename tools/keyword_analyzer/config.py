@@ -16,6 +16,12 @@ class Config(object):
         self.elasticsearch_verify_certs = False
         self.elasticsearch_index_name = ""
         self.elasticsearch_timeout_secs = 30
+        self.elasticsearch_http_compress = True
+        self.elasticsearch_max_connections = 10
+        self.elasticsearch_max_retries = 3
+        self.elasticsearch_retry_on_timeout = True
+        self.elasticsearch_retry_backoff_secs = 0.5
+        self.elasticsearch_sniff = False
 
         #Processing settings
         self.log_level = "ERROR"
@@ -2,7 +2,7 @@ import argparse
 import logging
 import re
 from nltk.corpus import stopwords
-from elasticsearch import Elasticsearch
+import es_client
 from elasticsearch_dsl import Search
 
 from config import Config
@@ -88,9 +88,7 @@ logging.basicConfig(filename=args.logfile,
 print("Logging level set to {0}...".format(config.log_level))
 print()
 
-es = Elasticsearch(hosts=[config.elasticsearch_host], 
-                   verify_certs=config.elasticsearch_verify_certs,
-                   timeout=config.elasticsearch_timeout_secs)
+es = es_client.create_client_from_config(config)
 
 s = Search(using=es, index=config.elasticsearch_index_name)
 s = s.params(size=10000)
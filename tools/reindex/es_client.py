@@ -0,0 +1,103 @@
+"""
+Factory for the Elasticsearch client used by the tools, with gzip compression,
+connection pooling, retries with backoff and optional node sniffing.
+"""
+import logging
+import time
+from elasticsearch import Elasticsearch, Transport
+from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, TransportError
+
+#status codes of overloaded or restarting nodes that are worth retrying
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+class BackoffTransport(Transport):
+    """Transport that retries failed requests with exponential backoff instead of
+    immediately hammering an overloaded cluster.
+
+    """
+    def __init__(self, hosts, max_retries=3, retry_on_timeout=False, retry_backoff_secs=0.5, **kwargs):
+        """Initializes the BackoffTransport instance.
+
+        Args:
+            hosts: list of hosts passed to the base Transport.
+            max_retries: number of times a failed request is retried.
+            retry_on_timeout: whether timed out requests are retried.
+            retry_backoff_secs: wait before the first retry, doubled on every further retry.
+        """
+        self.backoff_max_retries = max_retries
+        self.backoff_retry_on_timeout = retry_on_timeout
+        self.retry_backoff_secs = retry_backoff_secs
+        #retries are handled here, so the base transport only makes one attempt
+        super(BackoffTransport, self).__init__(hosts, max_retries=0, retry_on_timeout=retry_on_timeout, **kwargs)
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        attempt = 0
+        while True:
+            try:
+                return super(BackoffTransport, self).perform_request(method, url, headers=headers, params=params, body=body)
+            except TransportError as ex:
+                if isinstance(ex, ConnectionTimeout):
+                    retryable = self.backoff_retry_on_timeout
+                elif isinstance(ex, ConnectionError):
+                    retryable = True
+                else:
+                    retryable = ex.status_code in RETRY_STATUS_CODES
+                if not retryable or attempt >= self.backoff_max_retries:
+                    raise
+                wait_secs = self.retry_backoff_secs * (2 ** attempt)
+                attempt += 1
+                logging.warning("Elasticsearch request {0} {1} failed ({2}). Retrying in {3} seconds (attempt {4})..."
+                                .format(method, url, ex, wait_secs, attempt))
+                time.sleep(wait_secs)
+
+def create_client(hosts, verify_certs=False, timeout_secs=30, http_compress=True, max_connections=10,
+                  max_retries=3, retry_on_timeout=True, retry_backoff_secs=0.5, sniff=False, **kwargs):
+    """Creates an Elasticsearch client.
+
+    Args:
+        hosts: list of Elasticsearch hosts.
+        verify_certs: whether to verify SSL certificates.
+        timeout_secs: request timeout in seconds.
+        http_compress: whether to gzip request bodies and accept gzipped responses.
+        max_connections: max number of pooled connections per node. Should be at least the
+            number of threads making requests concurrently.
+        max_retries: number of times a failed request is retried.
+        retry_on_timeout: whether timed out requests are retried.
+        retry_backoff_secs: wait before the first retry, doubled on every further retry.
+        sniff: whether to discover the other cluster nodes on start and on connection failure.
+        kwargs: any other Elasticsearch client settings.
+    """
+    if sniff:
+        kwargs.setdefault("sniff_on_start", True)
+        kwargs.setdefault("sniff_on_connection_fail", True)
+        kwargs.setdefault("sniffer_timeout", 60)
+    return Elasticsearch(hosts=hosts,
+                         transport_class=BackoffTransport,
+                         verify_certs=verify_certs,
+                         timeout=timeout_secs,
+                         http_compress=http_compress,
+                         maxsize=max_connections,
+                         max_retries=max_retries,
+                         retry_on_timeout=retry_on_timeout,
+                         retry_backoff_secs=retry_backoff_secs,
+                         **kwargs)
+
+def create_client_from_config(config, max_connections=None):
+    """Creates an Elasticsearch client from the common elasticsearch_* config settings.
+
+    Args:
+        config: tool Config instance.
+        max_connections: optional number of concurrent requests the caller makes. The
+            connection pool is grown to fit it if elasticsearch_max_connections is smaller.
+    """
+    if max_connections is None or max_connections < config.elasticsearch_max_connections:
+        max_connections = config.elasticsearch_max_connections
+    return create_client([config.elasticsearch_host],
+                         verify_certs=config.elasticsearch_verify_certs,
+                         timeout_secs=config.elasticsearch_timeout_secs,
+                         http_compress=config.elasticsearch_http_compress,
+                         max_connections=max_connections,
+                         max_retries=config.elasticsearch_max_retries,
+                         retry_on_timeout=config.elasticsearch_retry_on_timeout,
+                         retry_backoff_secs=config.elasticsearch_retry_backoff_secs,
+                         sniff=config.elasticsearch_sniff)
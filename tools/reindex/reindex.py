@@ -3,7 +3,7 @@ import time
 import reindex_helpers
 
 from config import Config
-from elasticsearch import Elasticsearch
+import es_client
 from elasticsearch_dsl import Search
 
 def start():
@@ -26,9 +26,7 @@ def start():
     print("Using '{0}' as source index and '{1}' as target index.".format(args.sourceindex, config.elasticsearch_index_name))
     print()
 
-    es = Elasticsearch(hosts=[config.elasticsearch_host], 
-                        verify_certs=config.elasticsearch_verify_certs,
-                        timeout=config.elasticsearch_timeout_secs)
+    es = es_client.create_client_from_config(config)
 
     if args.verify:
         #verifying the data
@@ -1,4 +1,4 @@
-from elasticsearch import Elasticsearch
+import es_client
 import json
 config = json.load(open("config.json"))
 
@@ -10,17 +10,18 @@ if "es_path" in es_config and es_config["es_path"] != "":
 else:
   es_url = es_config['es_host']
 config_es_index = config["config"]["es_index"]
-es = Elasticsearch(
+es = es_client.create_client(
   [es_url],
-  # turn on SSL
-  use_ssl=client_config["use_ssl"],
   # no verify SSL certificates
   verify_certs=client_config["verify_certs"],
-  # don't show warnings about ssl certs verification
-  ssl_show_warn=client_config["ssl_show_warn"],
-  timeout=client_config["timeout"],
+  timeout_secs=client_config["timeout"],
+  http_compress=client_config.get("http_compress", True),
   max_retries=client_config["max_retries"],
-  retry_on_timeout=client_config["retry_on_timeout"]
+  retry_on_timeout=client_config["retry_on_timeout"],
+  # turn on SSL
+  use_ssl=client_config["use_ssl"],
+  # don't show warnings about ssl certs verification
+  ssl_show_warn=client_config["ssl_show_warn"]
 )
  
 # create a Python dictionary for the search query:
@@ -22,13 +22,48 @@ class Config(object):
         self.elasticsearch_verify_certs = False
         self.elasticsearch_index_name = ""
         self.elasticsearch_compat_mode = False
+        #dense_vector element type: "float", or "byte" (ES 8.6+) for embeddings stored with int8 precision
+        self.elasticsearch_embedding_element_type = "float"
         self.elasticsearch_batch_size = 500
         self.elasticsearch_timeout_secs = 30
+        self.elasticsearch_http_compress = True
+        self.elasticsearch_max_connections = 10
+        self.elasticsearch_max_retries = 3
+        self.elasticsearch_retry_on_timeout = True
+        self.elasticsearch_retry_backoff_secs = 0.5
+        self.elasticsearch_sniff = False
+        self.elasticsearch_index_mode = "single"
+        self.elasticsearch_rollover_max_age = "1d"
+        self.elasticsearch_rollover_max_size = ""
+        self.elasticsearch_async_flush = False
+        self.elasticsearch_flush_threads = 2
+        self.elasticsearch_flush_queue_size = 4
+        self.elasticsearch_flush_queue_timeout_secs = -1
+        self.elasticsearch_max_flush_latency_ms = 0
+
+        #document slimming settings
+        self.source_profile = "full"
+        self.source_include_fields = []
+        self.source_exclude_fields = []
+
+        #spool settings
+        self.spool_filepath = ""
+
+        #retweeted original dedup settings (opt-in: a dedup_cache_size of 0 disables the cache)
+        self.dedup_cache_size = 0
+        self.dedup_cache_ttl_secs = 3600
+        self.dedup_bloom_capacity = 10000000
+        self.dedup_bloom_error_rate = 0.01
+        self.dedup_cache_filepath = ""
 
         #logging and error handling settings
         self.log_level = "ERROR"
         self.restart_attempts = 5
         self.restart_wait_secs = 60
+        self.metrics_port = 0
+
+        #stream settings
+        self.raw_json_fast_path = True
 
         #filter settings
         self.filter_languages = []
@@ -1,5 +1,5 @@
 import argparse
-from elasticsearch import Elasticsearch
+import es_client
 from setup_index import verify_or_setup_index
 from config import Config
 
@@ -13,9 +13,7 @@ config = Config.load(args.configfile)
 config.elasticsearch_index_name = args.indexname
 
 #Verify or setup the elasticsearch index
-es = Elasticsearch(hosts=[config.elasticsearch_host], 
-                   verify_certs=config.elasticsearch_verify_certs,
-                   timeout=config.elasticsearch_timeout_secs)
+es = es_client.create_client_from_config(config)
 
 index_result = verify_or_setup_index(es, config)
 print(index_result)
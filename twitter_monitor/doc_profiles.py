@@ -0,0 +1,148 @@
+"""
+Source projection profiles used to slim tweet documents before they are indexed.
+"""
+
+#fields read by the embedder, sentiment poller, exporters, aspect modeling and the R queries
+LITE_PROFILE_FIELDS = [
+    "created_at",
+    "id",
+    "id_str",
+    "text",
+    "full_text",
+    "truncated",
+    "lang",
+    "source",
+    "timestamp_ms",
+    "retweeted",
+    "favorited",
+    "retweet_count",
+    "favorite_count",
+    "quote_count",
+    "reply_count",
+    "is_quote_status",
+    "quoted_status_id",
+    "quoted_status_id_str",
+    "in_reply_to_status_id",
+    "in_reply_to_status_id_str",
+    "in_reply_to_user_id_str",
+    "in_reply_to_screen_name",
+    "entities.hashtags",
+    "entities.urls",
+    "extended_tweet.full_text",
+    "extended_tweet.entities.hashtags",
+    "extended_tweet.entities.urls",
+    "user.id",
+    "user.id_str",
+    "user.name",
+    "user.screen_name",
+    "user.verified",
+    "user.location",
+    "user.followers_count",
+    "user.created_at",
+    "coordinates",
+    "place",
+    "retweeted_status.id",
+    "retweeted_status.id_str",
+    "quoted_status.created_at",
+    "quoted_status.id",
+    "quoted_status.id_str",
+    "quoted_status.text",
+    "quoted_status.full_text",
+    "quoted_status.extended_tweet.full_text",
+    "quoted_status.user.id_str",
+    "quoted_status.user.screen_name",
+    "dataset_entry",
+    "dataset_file",
+    "embedding",
+    "sentiment"
+]
+
+PROFILES = {
+    "full": None,
+    "lite": LITE_PROFILE_FIELDS
+}
+
+def build_field_tree(fields):
+    """Builds a nested dict from dotted field paths. A leaf (True) keeps the whole value.
+
+    Args:
+        fields: list of dotted field paths.
+    """
+    tree = {}
+    for field in fields:
+        node = tree
+        parts = field.split(".")
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:
+                break
+            if child is None:
+                child = node[part] = {}
+            node = child
+        else:
+            node[parts[-1]] = True
+    return tree
+
+class DocumentProjector(object):
+    """Whitelists and/or blacklists fields of tweet documents.
+
+    """
+    def __init__(self, include_fields=None, exclude_fields=None):
+        """Initializes the DocumentProjector instance.
+
+        Args:
+            include_fields: dotted paths of the fields to keep, or None to keep all fields.
+            exclude_fields: dotted paths of the fields to drop (applied after include_fields).
+        """
+        self.include_tree = build_field_tree(include_fields) if include_fields is not None else None
+        self.exclude_tree = build_field_tree(exclude_fields) if exclude_fields else None
+
+    def project(self, doc):
+        """Returns a slimmed copy of a tweet document.
+
+        Args:
+            doc: the tweet json dict.
+        """
+        if self.include_tree is not None:
+            doc = _include(doc, self.include_tree)
+        if self.exclude_tree is not None:
+            doc = _exclude(doc, self.exclude_tree)
+        return doc
+
+def get_projector(config):
+    """Returns the DocumentProjector configured by source_profile, source_include_fields and
+    source_exclude_fields, or None if documents are stored as is.
+
+    Args:
+        config: twitter monitor Config instance.
+    """
+    if config.source_profile not in PROFILES:
+        raise ValueError("Unknown source profile '{0}'. Valid profiles: {1}".format(config.source_profile, list(PROFILES)))
+    include_fields = PROFILES[config.source_profile]
+    if config.source_include_fields:
+        include_fields = (include_fields or []) + config.source_include_fields
+    if include_fields is None and not config.source_exclude_fields:
+        return None
+    return DocumentProjector(include_fields, config.source_exclude_fields)
+
+def _include(value, tree):
+    if tree is True:
+        return value
+    if isinstance(value, list):
+        return [_include(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {key: _include(value[key], subtree) for key, subtree in tree.items() if key in value}
+
+def _exclude(value, tree):
+    if isinstance(value, list):
+        return [_exclude(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {}
+    for key, item in value.items():
+        subtree = tree.get(key)
+        if subtree is True:
+            continue
+        result[key] = _exclude(item, subtree) if subtree is not None else item
+    return result
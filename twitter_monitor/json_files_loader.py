@@ -1,67 +1,153 @@
 """
 Script for populating an Elasticsearch index with tweets from JSON files.
+
+Inputs can be individual json files (one tweet per file), jsonl(.gz/.zst) files or
+.tar/.tar.gz/.zip archives of either, which are read without being extracted.
+Parsing runs in a process pool and the parsed tweets are indexed by a pool of
+bulk threads.
 """
 import argparse
 import logging
 import glob
-import json
 import os
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import es_client
+from tm_bulk_flusher import index_batch
 from setup_index import verify_or_setup_index
+from loader_helpers import (LoadUnit, BulkIndexer, CheckpointManifest, is_archive, is_jsonl, iter_archive_records,
+                            init_parse_worker, parse_work_item, bounded_map)
+from doc_profiles import get_projector
 from config import Config
 
-#load the args & config
-parser = argparse.ArgumentParser("Run the json file dataset loader")
-parser.add_argument("--datasetglob", "-d", required=True, help="glob pattern specifying the jsonl file(s). Ex: './data/*.jsonl'")
-parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
-parser.add_argument("--logfile", "-l", default="jdllog.txt", required=False, help="Path to the log file to write to.")
-args = parser.parse_args()
-
-config = Config.load(args.configfile)
-
-#Configure logging
-logging.basicConfig(filename=args.logfile, 
-                    format="[%(asctime)s - %(levelname)s]: %(message)s", 
-                    level=logging.getLevelName(config.log_level))
-print("Logging level set to {0}...".format(config.log_level))
-print()
-
-#Verify or setup the elasticsearch index
-es = Elasticsearch(hosts=[config.elasticsearch_host], 
-                   verify_certs=config.elasticsearch_verify_certs,
-                   timeout=config.elasticsearch_timeout_secs)
-
-index_result = verify_or_setup_index(es, config)
-logging.info(index_result)
-print(index_result)
-print()
-
-#read and process the json file(s)
-total_succeeded = 0
-filenames = glob.glob(args.datasetglob)
-num_files = len(filenames)
-es_batch = []
-for i, filename in enumerate(filenames):
-    try:
-        print()
-        print("Loading {0}...".format(filename))
-        print()
-        filebasename = os.path.basename(filename)
-        with open(filename, 'r') as f:
-            json_dict = json.load(f)
-        es_batch.append({"_op_type": "index", "_id": json_dict["id_str"], "_source": json_dict})
-
-        #push to elasticsearch
-        while len(es_batch) >= config.elasticsearch_batch_size or (i == num_files-1 and len(es_batch) > 0):
-            process_batch = es_batch[:config.elasticsearch_batch_size]
-            del es_batch[:config.elasticsearch_batch_size]
-            bulk(es, process_batch, index=config.elasticsearch_index_name, chunk_size=len(process_batch))
-            total_succeeded += len(process_batch)
+def get_work_items(filenames, chunk_size, manifest, plain_source):
+    """Yields (unit key, work item) tuples for the process pool.
+
+    Plain json files are grouped into chunks of paths (read by the workers), while archive
+    and jsonl records are read here sequentially and sent to the workers in chunks.
+    Sources the manifest marks as completed are skipped, and partially loaded sources
+    resume after their last committed file or record.
+
+    Args:
+        filenames: sorted list of input file paths.
+        chunk_size: max number of files or records per work item.
+        manifest: CheckpointManifest to resume from.
+        plain_source: manifest source name of the plain json files.
+
+    Returns:
+        Generator of ((source, seq, position), work item) tuples.
+    """
+    plain_filenames = [filename for filename in filenames if not is_archive(filename) and not is_jsonl(filename)]
+    if len(plain_filenames) > 0 and not manifest.is_completed(plain_source):
+        start = (manifest.get_position(plain_source) or {"files": 0})["files"]
+        if start > 0:
+            print("Resuming {0} from file {1}...".format(plain_source, start))
+        manifest.begin_source(plain_source)
+        seq = 0
+        for i in range(start, len(plain_filenames), chunk_size):
+            chunk = plain_filenames[i:i+chunk_size]
+            yield (plain_source, seq, {"files": i + len(chunk)}), ("paths", chunk)
+            seq += 1
+        manifest.finish_source(plain_source, seq)
+
+    for filename in filenames:
+        if not is_archive(filename) and not is_jsonl(filename):
+            continue
+        if manifest.is_completed(filename):
+            print("Skipping {0} (already loaded).".format(filename))
+            continue
+        start = (manifest.get_position(filename) or {"records": 0})["records"]
+        print("Loading {0}{1}...".format(filename, " from record {0}".format(start) if start > 0 else ""))
+        manifest.begin_source(filename)
+        seq = 0
+        num_records = 0
+        read_failed = False
+        records = []
+        try:
+            for record in iter_archive_records(filename):
+                num_records += 1
+                if num_records <= start:
+                    continue
+                records.append(record)
+                if len(records) == chunk_size:
+                    yield (filename, seq, {"records": num_records}), ("records", records)
+                    seq += 1
+                    records = []
+        except Exception as ex:
+            logging.exception("Exception occurred while attempting to read {0}.".format(filename))
+            print("Exception occurred while attempting to read {0}. See log for details.".format(filename))
+            read_failed = True
+        if len(records) > 0:
+            yield (filename, seq, {"records": num_records}), ("records", records)
+            seq += 1
+        #a source that failed to read is never marked as completed
+        if not read_failed:
+            manifest.finish_source(filename, seq)
+
+def start():
+    #load the args & config
+    parser = argparse.ArgumentParser("Run the json file dataset loader")
+    parser.add_argument("--datasetglob", "-d", required=True, help="glob pattern specifying the json, jsonl or archive file(s). Ex: './data/*.json'")
+    parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
+    parser.add_argument("--logfile", "-l", default="jdllog.txt", required=False, help="Path to the log file to write to.")
+    parser.add_argument("--processes", "-p", type=int, default=os.cpu_count(), required=False, help="Number of json parsing processes.")
+    parser.add_argument("--bulkthreads", type=int, default=2, required=False, help="Number of Elasticsearch bulk requests in flight.")
+    parser.add_argument("--chunksize", type=int, default=500, required=False, help="Number of files or records per parsing task.")
+    parser.add_argument("--checkpointfile", default="jflcheckpoint.json", required=False, help="Path to the checkpoint manifest to write progress to.")
+    parser.add_argument("--resume", action="store_true", required=False, help="Resume from the checkpoint manifest, skipping work already loaded.")
+    args = parser.parse_args()
+
+    config = Config.load(args.configfile)
+
+    #Configure logging
+    logging.basicConfig(filename=args.logfile,
+                        format="[%(asctime)s - %(levelname)s]: %(message)s",
+                        level=logging.getLevelName(config.log_level))
+    print("Logging level set to {0}...".format(config.log_level))
+    print()
+
+    #Verify or setup the elasticsearch index
+    es = es_client.create_client_from_config(config, max_connections=args.bulkthreads + 1)
+
+    index_result = verify_or_setup_index(es, config)
+    logging.info(index_result)
+    print(index_result)
+    print()
+
+    #index_batch sends tweets that already exist behind a rollover alias to their backing index
+    def index_actions(actions):
+        index_batch(es, actions, config)
+
+    total_succeeded = 0
+    lock = threading.Lock()
+    def on_committed(units):
+        nonlocal total_succeeded
+        manifest.commit(units)
+        with lock:
+            total_succeeded += sum(len(unit.actions) for unit in units)
             print("Succeeded (total): {0}".format(total_succeeded))
-    except Exception as ex:
-        logging.exception("Exception occurred while attempting to load {0}.".format(filename))
-        print("Exception occurred while attempting to load {0}. See log for details.".format(filename))
 
-print()
-print ("Done!")
\ No newline at end of file
+    #start a fresh checkpoint manifest unless resuming
+    manifest = CheckpointManifest.load(args.checkpointfile) if args.resume else CheckpointManifest(args.checkpointfile)
+
+    #read, parse and index the json file(s)
+    filenames = sorted(glob.glob(args.datasetglob))
+    indexer = BulkIndexer(index_actions, config.elasticsearch_batch_size, args.bulkthreads, on_committed=on_committed)
+    total_failed = 0
+    with ProcessPoolExecutor(args.processes, initializer=init_parse_worker, initargs=(get_projector(config),)) as executor:
+        work_items = get_work_items(filenames, args.chunksize, manifest, args.datasetglob)
+        for (source, seq, position), (actions, errors) in bounded_map(executor, parse_work_item, work_items, args.processes * 2):
+            for name, error in errors:
+                logging.error("Exception occurred while attempting to load {0}: {1}".format(name, error))
+            total_failed += len(errors)
+            indexer.put(LoadUnit(source, actions, len(actions) + len(errors), seq, position))
+    indexer.close()
+
+    if total_failed > 0 or indexer.failed > 0:
+        print("{0} records failed to parse and {1} failed to index. See log for details.".format(total_failed, indexer.failed))
+
+    print()
+    print ("Done!")
+
+if __name__ == "__main__":
+    start()
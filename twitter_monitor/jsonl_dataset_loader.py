@@ -8,11 +8,178 @@ import logging
 import glob
 import json
 import os
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import es_client
+from tm_bulk_flusher import index_batch
 from setup_index import verify_or_setup_index
+from doc_profiles import get_projector
+from loader_helpers import TokenBucket, LoadUnit, BulkIndexer, CheckpointManifest
 from config import Config
 
+#max number of ids per statuses/lookup request
+LOOKUP_BATCH_SIZE = 100
+
+class JsonlDatasetLoader(object):
+    """Single-pass streaming loader that pipelines id batching, hydration and bulk indexing.
+
+    Files are read concurrently, each batch of ids is hydrated on a pool of lookup threads
+    (throttled by an optional rate limiter), and the hydrated tweets are indexed by a pool
+    of bulk worker threads. The lookup and indexing functions are injected so the pipeline
+    can run against a stub of the lookup API. If a CheckpointManifest is given, progress is
+    committed to it after every bulk request and already loaded lines are skipped.
+    """
+    def __init__(self, lookup_statuses, index_actions, tweetidfieldname, batch_size,
+                 file_threads=2, lookup_threads=4, bulk_threads=2, rate_limiter=None, manifest=None,
+                 projector=None):
+        """Initializes the JsonlDatasetLoader instance.
+
+        Args:
+            lookup_statuses: function taking a list of tweet ids and returning the tweet json
+                dicts of the ids that could be hydrated.
+            index_actions: function taking a list of bulk actions and indexing them.
+            tweetidfieldname: name of json field containing the tweet id.
+            batch_size: number of actions per bulk request.
+            file_threads: number of files read concurrently.
+            lookup_threads: number of lookup requests in flight.
+            bulk_threads: number of bulk requests in flight.
+            rate_limiter: optional TokenBucket acquired before each lookup request.
+            manifest: optional CheckpointManifest to resume from and commit progress to.
+            projector: optional DocumentProjector used to slim the hydrated tweets.
+        """
+        self.lookup_statuses = lookup_statuses
+        self.index_actions = index_actions
+        self.tweetidfieldname = tweetidfieldname
+        self.batch_size = batch_size
+        self.file_threads = file_threads
+        self.lookup_threads = lookup_threads
+        self.bulk_threads = bulk_threads
+        self.rate_limiter = rate_limiter
+        self.manifest = manifest
+        self.projector = projector
+
+        self.lock = threading.Lock()
+        self.total_attempted = 0
+        self.total_succeeded = 0
+        self.file_attempted = {}
+        self.file_succeeded = {}
+
+    def load(self, filenames):
+        """Loads the jsonl file(s) into Elasticsearch.
+
+        Args:
+            filenames: list of jsonl file paths.
+        """
+        self.indexer = BulkIndexer(self.index_actions, self.batch_size, self.bulk_threads,
+                                   on_committed=self._on_committed)
+        #bound the number of hydrated-but-unindexed batches held in memory
+        self.lookup_slots = threading.BoundedSemaphore(self.lookup_threads * 2)
+        with ThreadPoolExecutor(self.lookup_threads) as self.lookup_pool, \
+             ThreadPoolExecutor(self.file_threads) as file_pool:
+            futures = {file_pool.submit(self._load_file, filename): filename for filename in filenames}
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    future.result()
+                    print("Finished reading {0}.".format(filename))
+                except Exception as ex:
+                    logging.exception("Exception occurred while attempting to load {0}.".format(filename))
+                    print("Exception occurred while attempting to load {0}. See log for details.".format(filename))
+        self.indexer.close()
+
+        if self.indexer.failed > 0:
+            print("{0} actions failed to index. See log for details.".format(self.indexer.failed))
+
+    def _load_file(self, filename):
+        if self.manifest is not None and self.manifest.is_completed(filename):
+            print("Skipping {0} (already loaded).".format(filename))
+            return
+        print()
+        print("Loading {0}...".format(filename))
+        print()
+        with self.lock:
+            self.file_attempted[filename] = 0
+            self.file_succeeded[filename] = 0
+
+        #resume from the last committed line
+        position = {"line": 0, "byte": 0}
+        if self.manifest is not None:
+            position = self.manifest.get_position(filename) or position
+            self.manifest.begin_source(filename)
+            if position["line"] > 0:
+                print("Resuming {0} from line {1}...".format(filename, position["line"]))
+
+        line_num = position["line"]
+        byte_offset = position["byte"]
+        lookups = []
+        tw_batch = {}
+        with open(filename, 'rb') as f:
+            f.seek(byte_offset)
+            for raw_line in f:
+                line_num += 1
+                byte_offset += len(raw_line)
+                line = raw_line.decode("utf-8").strip()
+                #read the line and queue the tweet for lookup from twitter
+                if line != "":
+                    if ":" not in line:
+                        line = '{{ "{0}": "{1}" }}'.format(self.tweetidfieldname, line)
+                    line_obj = json.loads(line)
+                    tw_batch[str(line_obj[self.tweetidfieldname])] = line_obj
+
+                if len(tw_batch) == LOOKUP_BATCH_SIZE:
+                    lookups.append(self._submit_lookup(filename, tw_batch, len(lookups), {"line": line_num, "byte": byte_offset}))
+                    tw_batch = {}
+        if len(tw_batch) > 0:
+            lookups.append(self._submit_lookup(filename, tw_batch, len(lookups), {"line": line_num, "byte": byte_offset}))
+        if self.manifest is not None:
+            self.manifest.finish_source(filename, len(lookups))
+
+        #surface any lookup failure as a failure of the file
+        for lookup in lookups:
+            lookup.result()
+
+    def _submit_lookup(self, filename, tw_batch, seq, position):
+        self.lookup_slots.acquire()
+        try:
+            return self.lookup_pool.submit(self._hydrate, filename, tw_batch, seq, position)
+        except Exception:
+            self.lookup_slots.release()
+            raise
+
+    def _hydrate(self, filename, tw_batch, seq, position):
+        try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            statuses = self.lookup_statuses(list(tw_batch.keys()))
+
+            filebasename = os.path.basename(filename)
+            actions = []
+            for json_dict in statuses:
+                if self.projector is not None:
+                    json_dict = self.projector.project(json_dict)
+                json_dict["dataset_entry"] = tw_batch[json_dict["id_str"]]
+                json_dict["dataset_file"] = filebasename
+                actions.append({"_op_type": "index", "_id": json_dict["id_str"], "_source": json_dict})
+
+            with self.lock:
+                self.file_attempted[filename] += len(tw_batch)
+                self.total_attempted += len(tw_batch)
+            self.indexer.put(LoadUnit(filename, actions, len(tw_batch), seq, position))
+        finally:
+            self.lookup_slots.release()
+
+    def _on_committed(self, units):
+        if self.manifest is not None:
+            self.manifest.commit(units)
+        with self.lock:
+            for unit in units:
+                self.file_succeeded[unit.source] += len(unit.actions)
+                self.total_succeeded += len(unit.actions)
+            for filename in set(unit.source for unit in units):
+                print("{0}: Attempted (file): {1}; Succeeded (file): {2}; Attempted (total): {3}; Succeeded (total): {4}"
+                    .format(os.path.basename(filename), self.file_attempted[filename], self.file_succeeded[filename],
+                            self.total_attempted, self.total_succeeded))
+
 def start():
     #load the args & config
     parser = argparse.ArgumentParser("Run the jsonl dataset loader")
@@ -20,21 +187,26 @@ def start():
     parser.add_argument("--tweetidfieldname", "-t", default="id", required=False, help="Name of json field containing the tweet id.")
     parser.add_argument("--configfile", "-c", default="config.json", required=False, help="Path to the config file to use.")
     parser.add_argument("--logfile", "-l", default="jdllog.txt", required=False, help="Path to the log file to write to.")
+    parser.add_argument("--filethreads", type=int, default=2, required=False, help="Number of files to read concurrently.")
+    parser.add_argument("--lookupthreads", type=int, default=4, required=False, help="Number of tweet lookup requests in flight.")
+    parser.add_argument("--bulkthreads", type=int, default=2, required=False, help="Number of Elasticsearch bulk requests in flight.")
+    parser.add_argument("--lookupsperwindow", type=int, default=900, required=False, help="Tweet lookup requests allowed per rate limit window.")
+    parser.add_argument("--lookupwindowsecs", type=int, default=900, required=False, help="Length of the tweet lookup rate limit window in seconds.")
+    parser.add_argument("--checkpointfile", default="jdlcheckpoint.json", required=False, help="Path to the checkpoint manifest to write progress to.")
+    parser.add_argument("--resume", action="store_true", required=False, help="Resume from the checkpoint manifest, skipping work already loaded.")
     args = parser.parse_args()
 
     config = Config.load(args.configfile)
 
     #Configure logging
-    logging.basicConfig(filename=args.logfile, 
-                        format="[%(asctime)s - %(levelname)s]: %(message)s", 
+    logging.basicConfig(filename=args.logfile,
+                        format="[%(asctime)s - %(levelname)s]: %(message)s",
                         level=logging.getLevelName(config.log_level))
     print("Logging level set to {0}...".format(config.log_level))
     print()
 
     #Verify or setup the elasticsearch index
-    es = Elasticsearch(hosts=[config.elasticsearch_host], 
-                    verify_certs=config.elasticsearch_verify_certs,
-                    timeout=config.elasticsearch_timeout_secs)
+    es = es_client.create_client_from_config(config, max_connections=args.bulkthreads + 1)
 
     index_result = verify_or_setup_index(es, config)
     logging.info(index_result)
@@ -46,60 +218,28 @@ def start():
     auth.set_access_token(config.access_token, config.access_token_secret)
     api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
 
+    def lookup_statuses(tweet_ids):
+        return [status._json for status in api.statuses_lookup(tweet_ids, tweet_mode="extended")]
+
+    #index_batch sends tweets that already exist behind a rollover alias to their backing index
+    def index_actions(actions):
+        index_batch(es, actions, config)
+
+    #start a fresh checkpoint manifest unless resuming
+    manifest = CheckpointManifest.load(args.checkpointfile) if args.resume else CheckpointManifest(args.checkpointfile)
+
     #read and process the jsonl file(s)
-    total_attempted = 0
-    total_succeeded = 0
-    filenames = glob.glob(args.datasetglob)
-    for filename in filenames:
-        try:
-            print()
-            print("Loading {0}...".format(filename))
-            print()
-            filebasename = os.path.basename(filename)
-            file_attempted = 0
-            file_succeeded = 0
-            tw_batch = {}
-            es_batch = []
-            with open(filename, 'r') as f:
-                num_lines = sum(1 for line in f)
-                f.seek(0)
-                for i, line in enumerate(f):
-                    line = line.strip()
-                    #read the line and queue the tweet for lookup from twitter
-                    if line != "":
-                        if ":" not in line:
-                            line = '{{ "{0}": "{1}" }}'.format(args.tweetidfieldname, line)
-                        line_obj = json.loads(line)
-                        tw_batch[line_obj[args.tweetidfieldname]] = line_obj
-                    
-                    #do the lookup and queue the results for push to elasticsearch
-                    if len(tw_batch) == 100 or (i == num_lines-1 and len(tw_batch) > 0):
-                        tw_batch_ids = [k for k in tw_batch.keys()]
-                        tw_batch_statuses = api.statuses_lookup(tw_batch_ids, tweet_mode="extended")
-                        for status in tw_batch_statuses:
-                            json_dict = status._json
-                            json_dict["dataset_entry"] = tw_batch[json_dict["id_str"]]
-                            json_dict["dataset_file"] = filebasename
-                            es_batch.append({"_op_type": "index", "_id": json_dict["id_str"], "_source": json_dict})
-                        file_attempted += len(tw_batch)
-                        total_attempted += len(tw_batch)
-                        tw_batch.clear()
-
-                    #push to elasticsearch
-                    while len(es_batch) >= config.elasticsearch_batch_size or (i == num_lines-1 and len(es_batch) > 0):
-                        process_batch = es_batch[:config.elasticsearch_batch_size]
-                        del es_batch[:config.elasticsearch_batch_size]
-                        bulk(es, process_batch, index=config.elasticsearch_index_name, chunk_size=len(process_batch))
-                        file_succeeded += len(process_batch)
-                        total_succeeded += len(process_batch)
-                        print("Attempted (file): {0}; Succeeded (file): {1}; Attempted (total): {2}; Succeeded (total): {3}"
-                            .format(file_attempted, file_succeeded, total_attempted, total_succeeded))
-        except Exception as ex:
-            logging.exception("Exception occurred while attempting to load {0}.".format(filename))
-            print("Exception occurred while attempting to load {0}. See log for details.".format(filename))
+    loader = JsonlDatasetLoader(lookup_statuses, index_actions, args.tweetidfieldname, config.elasticsearch_batch_size,
+                                file_threads=args.filethreads,
+                                lookup_threads=args.lookupthreads,
+                                bulk_threads=args.bulkthreads,
+                                rate_limiter=TokenBucket(args.lookupsperwindow, args.lookupwindowsecs),
+                                manifest=manifest,
+                                projector=get_projector(config))
+    loader.load(glob.glob(args.datasetglob))
 
     print()
     print ("Done!")
 
 if __name__ == "__main__":
-    start()
\ No newline at end of file
+    start()
@@ -0,0 +1,380 @@
+"""
+Shared building blocks for the dataset loaders: rate limiting, a threaded bulk indexer,
+checkpointing, archive readers and json parsing.
+"""
+import gzip
+import io
+import json
+import logging
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from collections import deque
+
+#orjson is optional but parses tweets several times faster than the json module
+try:
+    import orjson
+    loads_json = orjson.loads
+except ImportError:
+    loads_json = json.loads
+
+#DocumentProjector applied by parse_work_item in worker processes (see init_parse_worker)
+_worker_projector = None
+
+ARCHIVE_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".zip")
+JSONL_EXTENSIONS = (".jsonl", ".jsonl.gz", ".jsonl.zst")
+
+class TokenBucket(object):
+    """Thread-safe token bucket rate limiter.
+
+    """
+    def __init__(self, requests_per_window, window_secs):
+        """Initializes the TokenBucket instance with a full bucket.
+
+        Args:
+            requests_per_window: number of requests allowed per rate limit window.
+            window_secs: length of the rate limit window in seconds.
+        """
+        self.capacity = requests_per_window
+        self.refill_per_sec = requests_per_window / window_secs
+        self.tokens = float(requests_per_window)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request token is available and takes it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_per_sec)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_secs = (1 - self.tokens) / self.refill_per_sec
+            time.sleep(wait_secs)
+
+class LoadUnit(object):
+    """A chunk of bulk actions read from one source file.
+
+    """
+    def __init__(self, source, actions, attempted, seq=None, position=None):
+        """Initializes the LoadUnit instance.
+
+        Args:
+            source: the file the actions were read from.
+            actions: list of bulk actions.
+            attempted: number of dataset entries the actions were produced from.
+            seq: sequence number of the unit within its source (for checkpointing).
+            position: dict describing where the source was read up to after this unit
+                (for checkpointing).
+        """
+        self.source = source
+        self.actions = actions
+        self.attempted = attempted
+        self.seq = seq
+        self.position = position
+
+class CheckpointManifest(object):
+    """Records the completed sources of a dataset load and how far each partially loaded
+    source has been committed, so an interrupted load can be resumed.
+
+    Units may be committed out of order by concurrent bulk workers, so a source's
+    position only advances over a contiguous run of committed units. The manifest file
+    is rewritten atomically after every commit.
+    """
+    def __init__(self, filepath):
+        """Initializes an empty CheckpointManifest instance.
+
+        Args:
+            filepath: path of the manifest file.
+        """
+        self.filepath = filepath
+        self.sources = {}
+        self.next_seq = {}
+        self.pending = {}
+        self.final_seq = {}
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def load(filepath):
+        """Loads the manifest from its file if it exists.
+
+        Args:
+            filepath: path of the manifest file.
+        """
+        manifest = CheckpointManifest(filepath)
+        if os.path.exists(filepath):
+            with open(filepath, "r") as f:
+                manifest.sources = json.load(f)["sources"]
+        return manifest
+
+    def is_completed(self, source):
+        with self.lock:
+            return source in self.sources and self.sources[source]["completed"]
+
+    def get_position(self, source):
+        """Returns the last committed position of a source, or None if nothing was committed.
+        """
+        with self.lock:
+            return self.sources[source]["position"] if source in self.sources else None
+
+    def begin_source(self, source):
+        """Starts tracking the units of a source. Units are numbered from 0 on every run.
+        """
+        with self.lock:
+            self.next_seq[source] = 0
+            self.pending[source] = {}
+            self.final_seq.pop(source, None)
+            if source not in self.sources:
+                self.sources[source] = {"completed": False, "position": None}
+
+    def finish_source(self, source, num_units):
+        """Records that all units of a source have been read.
+
+        Args:
+            source: the source file.
+            num_units: number of units read from the source in this run.
+        """
+        with self.lock:
+            self.final_seq[source] = num_units
+            self._check_completed(source)
+            self.save()
+
+    def commit(self, units):
+        """Records a successfully indexed set of units and saves the manifest.
+
+        Args:
+            units: list of LoadUnits.
+        """
+        with self.lock:
+            for unit in units:
+                source = unit.source
+                self.pending[source][unit.seq] = unit.position
+                while self.next_seq[source] in self.pending[source]:
+                    self.sources[source]["position"] = self.pending[source].pop(self.next_seq[source])
+                    self.next_seq[source] += 1
+                self._check_completed(source)
+            self.save()
+
+    def save(self):
+        with self.lock:
+            tmp_filepath = self.filepath + ".tmp"
+            with open(tmp_filepath, "w") as f:
+                json.dump({"sources": self.sources}, f)
+            os.replace(tmp_filepath, self.filepath)
+
+    def _check_completed(self, source):
+        if source in self.final_seq and self.next_seq[source] == self.final_seq[source]:
+            self.sources[source]["completed"] = True
+
+class BulkIndexer(object):
+    """Bounded queue of LoadUnits drained into bulk requests by worker threads.
+
+    """
+    def __init__(self, index_actions, batch_size, num_threads, queue_size=16, on_committed=None):
+        """Initializes the BulkIndexer instance and starts the worker threads.
+
+        Args:
+            index_actions: function taking a list of bulk actions and indexing them.
+            batch_size: minimum number of actions per bulk request (the last request of
+                each worker may be smaller).
+            num_threads: number of bulk worker threads.
+            queue_size: max number of LoadUnits waiting to be indexed.
+            on_committed: optional function called with the list of LoadUnits of each
+                successful bulk request.
+        """
+        self.index_actions = index_actions
+        self.batch_size = batch_size
+        self.on_committed = on_committed
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in range(num_threads):
+            thread = threading.Thread(target=self._run, name="BulkIndexer-{0}".format(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, unit):
+        """Queues a LoadUnit, blocking while the queue is full.
+
+        Args:
+            unit: the LoadUnit to index.
+        """
+        self.queue.put(unit)
+
+    def close(self):
+        """Indexes everything still queued and stops the worker threads.
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads.clear()
+
+    def _run(self):
+        units = []
+        num_actions = 0
+        while True:
+            unit = self.queue.get()
+            if unit is not None:
+                units.append(unit)
+                num_actions += len(unit.actions)
+            if num_actions >= self.batch_size or (unit is None and len(units) > 0):
+                self._flush(units)
+                units = []
+                num_actions = 0
+            if unit is None:
+                break
+
+    def _flush(self, units):
+        actions = [action for unit in units for action in unit.actions]
+        try:
+            if len(actions) > 0:
+                self.index_actions(actions)
+        except Exception as ex:
+            logging.exception("Exception occurred while indexing a batch of {0} actions.".format(len(actions)))
+            with self.lock:
+                self.failed += len(actions)
+            return
+        if self.on_committed is not None:
+            self.on_committed(units)
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def is_jsonl(path):
+    return path.lower().endswith(JSONL_EXTENSIONS)
+
+def decompress(name, data):
+    """Decompresses data according to the .gz/.zst extension of its name.
+
+    Args:
+        name: file or archive member name.
+        data: raw bytes.
+    """
+    lower_name = name.lower()
+    if lower_name.endswith(".gz"):
+        return gzip.decompress(data)
+    if lower_name.endswith(".zst"):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+def split_records(name, data):
+    """Splits the contents of a file or archive member into json records.
+
+    jsonl content yields one record per non-empty line, anything else is a single record.
+
+    Args:
+        name: file or archive member name.
+        data: raw (possibly compressed) bytes.
+
+    Returns:
+        List of (record name, record bytes) tuples.
+    """
+    data = decompress(name, data)
+    if not is_jsonl(name):
+        return [(name, data)]
+    return [("{0}:{1}".format(name, i+1), line) for i, line in enumerate(data.splitlines()) if line.strip()]
+
+def iter_archive_records(path):
+    """Yields (record name, record bytes) tuples for every json record in an archive or
+    jsonl(.gz/.zst) file, without extracting anything to disk.
+
+    Args:
+        path: path of the archive or jsonl file.
+    """
+    lower_path = path.lower()
+    if lower_path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    member_name = "{0}:{1}".format(path, info.filename)
+                    yield from split_records(member_name, archive.read(info))
+    elif lower_path.endswith((".tar", ".tar.gz", ".tgz")):
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    member_name = "{0}:{1}".format(path, member.name)
+                    yield from split_records(member_name, archive.extractfile(member).read())
+    else:
+        with _open_jsonl(path) as f:
+            for i, line in enumerate(f):
+                if line.strip():
+                    yield ("{0}:{1}".format(path, i+1), line)
+
+def _open_jsonl(path):
+    lower_path = path.lower()
+    if lower_path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if lower_path.endswith(".zst"):
+        import zstandard
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+    return open(path, "rb")
+
+def init_parse_worker(projector):
+    """Process pool initializer setting the DocumentProjector used by parse_work_item.
+
+    Args:
+        projector: DocumentProjector, or None to keep documents as is.
+    """
+    global _worker_projector
+    _worker_projector = projector
+
+def parse_work_item(item):
+    """Parses a chunk of tweet json into bulk index actions (runs in a worker process).
+
+    Args:
+        item: tuple of (kind, entries). If kind is "paths", entries are json file paths to
+            read; if kind is "records", entries are (record name, record bytes) tuples.
+
+    Returns:
+        Tuple of (list of bulk actions, list of (record name, error message) tuples).
+    """
+    kind, entries = item
+    actions = []
+    errors = []
+    for entry in entries:
+        try:
+            if kind == "paths":
+                name = entry
+                with open(entry, "rb") as f:
+                    data = f.read()
+            else:
+                name, data = entry
+            json_dict = loads_json(data)
+            if _worker_projector is not None:
+                json_dict = _worker_projector.project(json_dict)
+            actions.append({"_op_type": "index", "_id": json_dict["id_str"], "_source": json_dict})
+        except Exception as ex:
+            errors.append((name, repr(ex)))
+    return actions, errors
+
+def bounded_map(executor, fn, keyed_items, max_in_flight):
+    """Like executor.map, but only keeps max_in_flight items submitted at a time so that
+    large inputs are not read into memory up front. Results are yielded in order.
+
+    Args:
+        executor: concurrent.futures executor.
+        fn: function to apply.
+        keyed_items: iterable of (key, argument) tuples.
+        max_in_flight: max number of submitted but unconsumed items.
+
+    Returns:
+        Generator of (key, result) tuples.
+    """
+    in_flight = deque()
+    for key, item in keyed_items:
+        in_flight.append((key, executor.submit(fn, item)))
+        if len(in_flight) >= max_in_flight:
+            key, future = in_flight.popleft()
+            yield key, future.result()
+    while len(in_flight) > 0:
+        key, future = in_flight.popleft()
+        yield key, future.result()
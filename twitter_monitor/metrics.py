@@ -0,0 +1,163 @@
+"""
+Lightweight in-process metrics (counters, gauges and latency histograms) exposed in the
+Prometheus text format.
+"""
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class Counter(object):
+    """Monotonically increasing count.
+
+    """
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self):
+        return ["# HELP {0} {1}".format(self.name, self.description),
+                "# TYPE {0} counter".format(self.name),
+                "{0} {1}".format(self.name, self.value)]
+
+class Gauge(object):
+    """Value that can go up and down, such as a queue depth.
+
+    """
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        return ["# HELP {0} {1}".format(self.name, self.description),
+                "# TYPE {0} gauge".format(self.name),
+                "{0} {1}".format(self.name, self.value)]
+
+class Histogram(object):
+    """Distribution of observed values (latencies in seconds, batch sizes, ...) over fixed buckets.
+
+    """
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Returns a context manager that observes the duration of its block in seconds.
+        """
+        return _Timer(self)
+
+    def render(self):
+        with self.lock:
+            lines = ["# HELP {0} {1}".format(self.name, self.description),
+                     "# TYPE {0} histogram".format(self.name)]
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                lines.append('{0}_bucket{{le="{1}"}} {2}'.format(self.name, bound, cumulative))
+            lines.append('{0}_bucket{{le="+Inf"}} {1}'.format(self.name, self.count))
+            lines.append("{0}_sum {1}".format(self.name, self.sum))
+            lines.append("{0}_count {1}".format(self.name, self.count))
+        return lines
+
+class _Timer(object):
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class MetricsRegistry(object):
+    """Named collection of metrics. Asking twice for the same name returns the same metric.
+
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name, description):
+        return self._get_or_create(name, lambda: Counter(name, description))
+
+    def gauge(self, name, description):
+        return self._get_or_create(name, lambda: Gauge(name, description))
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS):
+        return self._get_or_create(name, lambda: Histogram(name, description, buckets))
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _get_or_create(self, name, create):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = create()
+            return self.metrics[name]
+
+#default registry shared by everything in the process
+REGISTRY = MetricsRegistry()
+
+#content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def start_metrics_server(port, host="127.0.0.1", registry=REGISTRY):
+    """Serves the registry's metrics at http://host:port/metrics from a background thread.
+
+    Args:
+        port: port to listen on.
+        host: interface to listen on (local only by default).
+        registry: MetricsRegistry to serve.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True)
+    thread.start()
+    return server
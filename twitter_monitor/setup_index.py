@@ -1,12 +1,81 @@
 from config import Config
 
 def verify_or_setup_index(es, config):    
+    if config.elasticsearch_index_mode == "rollover":
+        return verify_or_setup_rollover_index(es, config)
+
     index_exists = es.indices.exists(config.elasticsearch_index_name)
     #Do nothing if the index exists
     if index_exists:
         return "Index '{0}' found.".format(config.elasticsearch_index_name)
     
     #Create if the index does not exist
+    es.indices.create(config.elasticsearch_index_name, {
+        "mappings": get_mappings(config)
+    })
+
+    return "Index '{0}' created.".format(config.elasticsearch_index_name)
+
+def verify_or_setup_rollover_index(es, config):
+    """Sets up time/size partitioned backing indices behind a write alias.
+
+    The alias is named after elasticsearch_index_name, so every tool keeps reading from and
+    writing to the same name. An index template applies the mappings to each backing index
+    and an ILM policy rolls the write index over on elasticsearch_rollover_max_age (e.g. "1d"
+    for daily or "7d" for weekly indices) and/or elasticsearch_rollover_max_size.
+
+    Writes through the alias only reach the current write index, so tweets that already
+    exist in an older backing index are written back to it (see
+    tm_bulk_flusher.route_to_backing_indices) instead of being duplicated.
+    """
+    alias = config.elasticsearch_index_name
+    if es.indices.exists_alias(name=alias):
+        return "Write alias '{0}' found.".format(alias)
+    if es.indices.exists(alias):
+        raise ValueError("'{0}' already exists as an index, so it cannot be used as a rollover alias.".format(alias))
+
+    rollover_conditions = {}
+    if config.elasticsearch_rollover_max_age:
+        rollover_conditions["max_age"] = config.elasticsearch_rollover_max_age
+    if config.elasticsearch_rollover_max_size:
+        rollover_conditions["max_size"] = config.elasticsearch_rollover_max_size
+    if len(rollover_conditions) == 0:
+        raise ValueError("Rollover mode requires elasticsearch_rollover_max_age and/or elasticsearch_rollover_max_size.")
+
+    policy_name = "{0}-policy".format(alias)
+    es.ilm.put_lifecycle(policy_name, {
+        "policy": {
+            "phases": {
+                "hot": {
+                    "actions": {
+                        "rollover": rollover_conditions
+                    }
+                }
+            }
+        }
+    })
+
+    es.indices.put_template("{0}-template".format(alias), {
+        "index_patterns": ["{0}-*".format(alias)],
+        "settings": {
+            "index.lifecycle.name": policy_name,
+            "index.lifecycle.rollover_alias": alias
+        },
+        "mappings": get_mappings(config)
+    })
+
+    #date math in the name makes each backing index show the day it was created
+    es.indices.create("<{0}-{{now/d}}-000001>".format(alias), {
+        "aliases": {
+            alias: {
+                "is_write_index": True
+            }
+        }
+    })
+
+    return "Write alias '{0}' created with rollover conditions {1}.".format(alias, rollover_conditions)
+
+def get_mappings(config):
     mappings = {
         "properties": {
             "created_at": {
@@ -75,10 +144,14 @@ def verify_or_setup_index(es, config):
             "type": "dense_vector",
             "dims": 384
         }
-        
 
-    es.indices.create(config.elasticsearch_index_name, {
-        "mappings": mappings
-    })
+        if config.elasticsearch_embedding_element_type == "byte":
+            #int8 vectors are stored with a per-vector scale factor (see embedder/vector_codec.py)
+            for field in [field for field in mappings["properties"] if field.startswith("embedding.")]:
+                mappings["properties"][field]["element_type"] = "byte"
+                mappings["properties"]["{0}_scale".format(field)] = {
+                    "type": "float",
+                    "index": False
+                }
 
-    return "Index '{0}' created.".format(config.elasticsearch_index_name)
\ No newline at end of file
+    return mappings
\ No newline at end of file
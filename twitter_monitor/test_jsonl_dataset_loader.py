@@ -0,0 +1,101 @@
+"""
+Tests of the JsonlDatasetLoader pipeline against a stub of the lookup API.
+Run with: python -m unittest test_jsonl_dataset_loader
+"""
+import json
+import os
+import tempfile
+import threading
+import unittest
+from jsonl_dataset_loader import JsonlDatasetLoader
+from loader_helpers import CheckpointManifest
+
+TWEET_IDS = [str(1000 + i) for i in range(250)]
+
+class StubLookup(object):
+    """Stub of statuses/lookup returning only the tweets that were not deleted, and
+    optionally failing like a rate-limited request for the batches containing given ids.
+    """
+    def __init__(self, deleted_ids=(), rate_limited_ids=()):
+        self.deleted_ids = set(deleted_ids)
+        self.rate_limited_ids = set(rate_limited_ids)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def __call__(self, tweet_ids):
+        with self.lock:
+            self.requests.append(list(tweet_ids))
+        if self.rate_limited_ids.intersection(tweet_ids):
+            raise RuntimeError("429 Too Many Requests")
+        return [{"id_str": tweet_id, "text": "tweet {0}".format(tweet_id)}
+                for tweet_id in tweet_ids if tweet_id not in self.deleted_ids]
+
+class RecordingIndexer(object):
+    """Stub of the bulk indexing function recording the indexed actions.
+    """
+    def __init__(self):
+        self.actions = []
+        self.lock = threading.Lock()
+
+    def __call__(self, actions):
+        with self.lock:
+            self.actions.extend(actions)
+
+    def get_ids(self):
+        return [action["_id"] for action in self.actions]
+
+class TestJsonlDatasetLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, "dataset.jsonl")
+        with open(self.filename, "w") as f:
+            for tweet_id in TWEET_IDS:
+                f.write(json.dumps({"tweet_id": tweet_id, "label": "x"}) + "\n")
+        self.manifest_filepath = os.path.join(self.tmp_dir.name, "manifest.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def create_loader(self, lookup, indexer, manifest=None):
+        #one thread per stage keeps the order of the lookups and bulk requests deterministic
+        return JsonlDatasetLoader(lookup, indexer, "tweet_id", 100, file_threads=1, lookup_threads=1,
+                                  bulk_threads=1, manifest=manifest)
+
+    def test_loads_hydrated_tweets_of_partial_responses(self):
+        deleted_ids = TWEET_IDS[::7]
+        lookup = StubLookup(deleted_ids=deleted_ids)
+        indexer = RecordingIndexer()
+        self.create_loader(lookup, indexer).load([self.filename])
+
+        self.assertEqual([len(request) for request in lookup.requests], [100, 100, 50])
+        self.assertEqual(sorted(indexer.get_ids()), sorted(set(TWEET_IDS) - set(deleted_ids)))
+        action = indexer.actions[0]
+        self.assertEqual(action["_source"]["dataset_entry"], {"tweet_id": action["_id"], "label": "x"})
+        self.assertEqual(action["_source"]["dataset_file"], "dataset.jsonl")
+
+    def test_resumes_from_manifest_after_rate_limited_lookup(self):
+        #the second lookup batch (lines 101-200) fails, so only the first one is committed
+        manifest = CheckpointManifest(self.manifest_filepath)
+        indexer = RecordingIndexer()
+        with self.assertLogs(level="ERROR"):
+            self.create_loader(StubLookup(rate_limited_ids=[TWEET_IDS[150]]), indexer, manifest).load([self.filename])
+        self.assertIn(TWEET_IDS[0], indexer.get_ids())
+        self.assertNotIn(TWEET_IDS[150], indexer.get_ids())
+
+        manifest = CheckpointManifest.load(self.manifest_filepath)
+        self.assertFalse(manifest.is_completed(self.filename))
+        self.assertEqual(manifest.get_position(self.filename)["line"], 100)
+
+        lookup = StubLookup()
+        indexer = RecordingIndexer()
+        self.create_loader(lookup, indexer, manifest).load([self.filename])
+        self.assertEqual(sorted(indexer.get_ids()), TWEET_IDS[100:])
+        self.assertTrue(CheckpointManifest.load(self.manifest_filepath).is_completed(self.filename))
+
+        #a completed file is skipped without any lookups
+        lookup = StubLookup()
+        self.create_loader(lookup, RecordingIndexer(), CheckpointManifest.load(self.manifest_filepath)).load([self.filename])
+        self.assertEqual(lookup.requests, [])
+
+if __name__ == "__main__":
+    unittest.main()
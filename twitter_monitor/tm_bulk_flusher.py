@@ -0,0 +1,158 @@
+"""
+Background bulk flusher that drains queued tweet batches into Elasticsearch so that
+the stream listener never blocks on a bulk round-trip.
+"""
+import logging
+import queue
+import threading
+from elasticsearch.helpers import bulk, BulkIndexError
+from metrics import REGISTRY, SIZE_BUCKETS
+
+bulk_seconds = REGISTRY.histogram("tm_bulk_seconds", "Duration of bulk requests to Elasticsearch.")
+bulk_batch_size = REGISTRY.histogram("tm_bulk_batch_size", "Number of actions per bulk request.", SIZE_BUCKETS)
+bulk_failures = REGISTRY.counter("tm_bulk_failures_total", "Number of failed bulk requests.")
+flush_queue_depth = REGISTRY.gauge("tm_flush_queue_depth", "Number of batches waiting in the async flush queue.")
+
+def index_batch(es, batch, config, dedup_cache=None):
+    """Bulk indexes a batch of actions.
+
+    Version conflicts are expected for 'create' actions on documents that already
+    exist, so they are ignored. Any other failure raises BulkIndexError.
+
+    Args:
+        es: Elasticsearch client used for the bulk request.
+        batch: list of bulk actions.
+        config: twitter monitor Config instance.
+        dedup_cache: optional RecentIdCache the tweets are recorded in once the batch
+            is indexed, so a failed batch never suppresses re-indexing its originals.
+    """
+    bulk_batch_size.observe(len(batch))
+    try:
+        with bulk_seconds.time():
+            if config.elasticsearch_index_mode == "rollover":
+                batch = route_to_backing_indices(es, batch, config.elasticsearch_index_name)
+            _, errors = bulk(es, batch, index=config.elasticsearch_index_name, chunk_size=len(batch), raise_on_error=False)
+    except Exception:
+        bulk_failures.inc()
+        raise
+    errors = [error for error in errors if list(error.values())[0].get("status") != 409]
+    if len(errors) > 0:
+        bulk_failures.inc()
+        raise BulkIndexError("{0} document(s) failed to index.".format(len(errors)), errors)
+    if dedup_cache is not None:
+        dedup_cache.add_indexed(batch)
+
+def route_to_backing_indices(es, batch, alias):
+    """Points the actions of tweets that already exist behind a rollover alias at the
+    backing index holding them.
+
+    Writes through the alias only reach the current write index, so without this an
+    original tweet retweeted after a rollover would be indexed again in the new backing
+    index (and a 'create' would not conflict with the older copy). Tweets indexed less than
+    a refresh interval ago are not visible to the lookup yet.
+
+    Args:
+        es: Elasticsearch client.
+        batch: list of bulk actions.
+        alias: name of the rollover alias.
+
+    Returns:
+        List of bulk actions. Actions of existing tweets are copies with '_index' set.
+    """
+    ids = [action["_id"] for action in batch]
+    result = es.search(index=alias, body={
+        "query": {"ids": {"values": ids}},
+        "_source": False,
+        "size": len(ids)
+    })
+    backing_indices = {hit["_id"]: hit["_index"] for hit in result["hits"]["hits"]}
+    if len(backing_indices) == 0:
+        return batch
+    return [dict(action, _index=backing_indices[action["_id"]]) if action["_id"] in backing_indices else action
+            for action in batch]
+
+class BulkFlusher(object):
+    """Bounded queue of bulk batches drained by one or more flusher threads.
+
+    Batches that fail to index are spooled if a spool is configured. Without a spool, the
+    failure is raised to the caller by every later submit, so the listener stops like it
+    does when a synchronous flush fails instead of dropping batches silently.
+    """
+    def __init__(self, es, config, spool=None, dedup_cache=None):
+        """Initializes the BulkFlusher instance and starts the flusher threads.
+
+        Args:
+            es: Elasticsearch client used for the bulk requests.
+            config: twitter monitor Config instance.
+            spool: optional BatchSpool receiving batches that cannot be delivered.
+            dedup_cache: optional RecentIdCache recording the tweets of flushed batches.
+        """
+        self.es = es
+        self.config = config
+        self.spool = spool
+        self.dedup_cache = dedup_cache
+        #first flush failure without a spool to hand the batch to
+        self.error = None
+        self.queue = queue.Queue(maxsize=config.elasticsearch_flush_queue_size)
+        self.threads = []
+        for i in range(config.elasticsearch_flush_threads):
+            thread = threading.Thread(target=self._run, name="BulkFlusher-{0}".format(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, batch):
+        """Queues a batch of bulk actions for flushing.
+
+        Blocks while the queue is full, which applies backpressure to the caller. If a spool
+        is configured and the queue stays full for elasticsearch_flush_queue_timeout_secs,
+        the batch is spooled to disk instead.
+
+        Args:
+            batch: list of bulk actions.
+
+        Raises:
+            The exception of a batch that failed to flush without a spool.
+        """
+        if self.error is not None:
+            raise self.error
+        timeout_secs = self.config.elasticsearch_flush_queue_timeout_secs
+        try:
+            if self.spool is None or timeout_secs < 0:
+                self.queue.put(batch)
+            else:
+                self.queue.put(batch, timeout=timeout_secs)
+        except queue.Full:
+            logging.warning("Flush queue full for {0} seconds. Spooling batch...".format(timeout_secs))
+            self.spool.append(batch)
+        flush_queue_depth.set(self.queue.qsize())
+
+    def close(self):
+        """Flushes everything still queued and stops the flusher threads.
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads.clear()
+
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            flush_queue_depth.set(self.queue.qsize())
+            try:
+                if batch is None:
+                    break
+                self._flush(batch)
+            finally:
+                self.queue.task_done()
+
+    def _flush(self, batch):
+        try:
+            index_batch(self.es, batch, self.config, self.dedup_cache)
+            logging.info("Flushed batch of {0} actions ({1} batches queued).".format(len(batch), self.queue.qsize()))
+        except Exception as ex:
+            logging.exception("Exception occurred while flushing a batch of {0} actions.".format(len(batch)))
+            if self.spool is not None:
+                self.spool.append(batch)
+            elif self.error is None:
+                self.error = ex
@@ -0,0 +1,168 @@
+"""
+Bounded cache of recently indexed tweet ids, used to avoid rewriting the same
+retweeted original over and over while it is being retweeted.
+"""
+import hashlib
+import logging
+import math
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+class BloomFilter(object):
+    """Fixed-size Bloom filter over string keys.
+
+    """
+    def __init__(self, capacity, error_rate):
+        """Initializes the BloomFilter instance.
+
+        Args:
+            capacity: number of keys the filter is sized for.
+            error_rate: target false positive rate at capacity.
+        """
+        self.capacity = capacity
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+class RecentIdCache(object):
+    """Exact LRU of recently indexed ids backed by a two-generation Bloom filter.
+
+    Ids in the LRU (and younger than the ttl) are known to be indexed and can be skipped.
+    Ids that fell out of the LRU but are still in the Bloom filter were probably indexed,
+    so they are sent as 'create' actions, which Elasticsearch rejects without rewriting
+    the document if it already exists. When the current Bloom generation is full it
+    becomes the previous generation, so memory stays bounded and very old ids are forgotten.
+    """
+    def __init__(self, lru_size, ttl_secs, bloom_capacity, bloom_error_rate):
+        """Initializes the RecentIdCache instance.
+
+        Args:
+            lru_size: max number of ids held in the exact LRU.
+            ttl_secs: age after which an LRU entry no longer allows skipping (so that
+                counts on hot originals still get refreshed now and then).
+            bloom_capacity: number of ids per Bloom filter generation.
+            bloom_error_rate: target false positive rate of each Bloom filter generation.
+        """
+        self.lru_size = lru_size
+        self.ttl_secs = ttl_secs
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.lru = OrderedDict()
+        self.bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+        self.prev_bloom = None
+        #ids are looked up by the stream listener and added by the flusher threads
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_config(config):
+        """Creates the cache from the twitter monitor config, restoring it from disk if a
+        cache file exists. Returns None if the cache is disabled.
+
+        Args:
+            config: twitter monitor Config instance.
+        """
+        if config.dedup_cache_size <= 0:
+            return None
+        cache = RecentIdCache(config.dedup_cache_size, config.dedup_cache_ttl_secs,
+                              config.dedup_bloom_capacity, config.dedup_bloom_error_rate)
+        if config.dedup_cache_filepath and os.path.exists(config.dedup_cache_filepath):
+            try:
+                cache.load(config.dedup_cache_filepath)
+            except Exception as ex:
+                logging.exception("Exception occurred while loading the dedup cache. Starting empty...")
+        return cache
+
+    def get_op_type(self, tweet_id):
+        """Returns the bulk op type to use for a tweet id, or None if it can be skipped.
+
+        Args:
+            tweet_id: id_str of the tweet.
+        """
+        with self.lock:
+            indexed_at = self.lru.get(tweet_id)
+            if indexed_at is not None:
+                if time.time() - indexed_at < self.ttl_secs:
+                    self.lru.move_to_end(tweet_id)
+                    return None
+                return "index"
+            if tweet_id in self.bloom or (self.prev_bloom is not None and tweet_id in self.prev_bloom):
+                return "create"
+            return "index"
+
+    def add(self, tweet_id):
+        """Records a tweet id as indexed now.
+
+        Args:
+            tweet_id: id_str of the tweet.
+        """
+        with self.lock:
+            self.lru[tweet_id] = time.time()
+            self.lru.move_to_end(tweet_id)
+            while len(self.lru) > self.lru_size:
+                self.lru.popitem(last=False)
+
+            if tweet_id not in self.bloom:
+                if self.bloom.count >= self.bloom_capacity:
+                    self.prev_bloom = self.bloom
+                    self.bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+                self.bloom.add(tweet_id)
+
+    def add_indexed(self, batch):
+        """Records the tweets of a successfully indexed batch of bulk actions. Retweets
+        are left out, since only originals are looked up.
+
+        Args:
+            batch: list of bulk actions.
+        """
+        for action in batch:
+            if "retweeted_status" not in action["_source"]:
+                self.add(action["_id"])
+
+    def save(self, filepath):
+        """Atomically writes the cache to disk.
+
+        Args:
+            filepath: path of the cache file.
+        """
+        tmp_filepath = filepath + ".tmp"
+        with self.lock:
+            state = {
+                "lru": list(self.lru.items()),
+                "bloom": self.bloom,
+                "prev_bloom": self.prev_bloom
+            }
+            with open(tmp_filepath, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filepath, filepath)
+
+    def load(self, filepath):
+        """Restores the cache from disk.
+
+        Args:
+            filepath: path of the cache file.
+        """
+        with open(filepath, "rb") as f:
+            state = pickle.load(f)
+        self.lru = OrderedDict(state["lru"][-self.lru_size:])
+        #only reuse the saved filters if they were sized with the current settings
+        if state["bloom"].capacity == self.bloom_capacity:
+            self.bloom = state["bloom"]
+            self.prev_bloom = state["prev_bloom"]
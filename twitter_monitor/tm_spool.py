@@ -0,0 +1,90 @@
+"""
+Append-only local spool for bulk batches that could not be delivered to Elasticsearch.
+Spooled batches are replayed in bulk the next time the monitor starts.
+"""
+import json
+import logging
+import os
+import threading
+from tm_bulk_flusher import index_batch
+from metrics import REGISTRY
+
+spooled_actions = REGISTRY.counter("tm_spooled_actions_total", "Number of actions written to the spool.")
+replayed_actions = REGISTRY.counter("tm_replayed_actions_total", "Number of spooled actions replayed to Elasticsearch.")
+
+class BatchSpool(object):
+    """Append-only jsonl file of bulk actions.
+
+    """
+    def __init__(self, filepath):
+        """Initializes the BatchSpool instance.
+
+        Args:
+            filepath: path of the spool file.
+        """
+        self.filepath = filepath
+        self.replay_filepath = filepath + ".replay"
+        self.lock = threading.Lock()
+
+    def append(self, batch):
+        """Appends a batch of bulk actions to the spool file and syncs it to disk.
+
+        Args:
+            batch: list of bulk actions.
+        """
+        lines = "".join(json.dumps(action) + "\n" for action in batch)
+        with self.lock:
+            with open(self.filepath, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        spooled_actions.inc(len(batch))
+        logging.warning("Spooled batch of {0} actions to {1}.".format(len(batch), self.filepath))
+
+    def replay(self, es, config):
+        """Bulk loads all spooled actions into Elasticsearch.
+
+        The spool is moved aside before replaying so that new batches can keep being
+        appended. If the replay fails part way, the remainder is retried on the next call
+        (index actions are idempotent, so replaying a batch twice is harmless).
+
+        Args:
+            es: Elasticsearch client used for the bulk requests.
+            config: twitter monitor Config instance.
+
+        Returns:
+            The number of actions replayed.
+        """
+        with self.lock:
+            if os.path.exists(self.filepath):
+                if os.path.exists(self.replay_filepath):
+                    #a previous replay did not finish - fold the new spool into it
+                    with open(self.filepath, "r", encoding="utf-8") as src, \
+                         open(self.replay_filepath, "a", encoding="utf-8") as dst:
+                        for line in src:
+                            dst.write(line)
+                    os.remove(self.filepath)
+                else:
+                    os.replace(self.filepath, self.replay_filepath)
+
+        if not os.path.exists(self.replay_filepath):
+            return 0
+
+        total_replayed = 0
+        batch = []
+        with open(self.replay_filepath, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line != "":
+                    batch.append(json.loads(line))
+                if len(batch) >= config.elasticsearch_batch_size:
+                    index_batch(es, batch, config)
+                    total_replayed += len(batch)
+                    batch.clear()
+        if len(batch) > 0:
+            index_batch(es, batch, config)
+            total_replayed += len(batch)
+
+        os.remove(self.replay_filepath)
+        replayed_actions.inc(total_replayed)
+        return total_replayed
@@ -3,9 +3,21 @@ Tweepy StreamListener subclass responsible for forwarding incoming tweet data to
 ElasticSearch.
 """
 import tweepy
+import json
 import logging
+import threading
+import time
 from config import Config
-from elasticsearch.helpers import bulk
+from tm_bulk_flusher import BulkFlusher, index_batch
+from tm_spool import BatchSpool
+from doc_profiles import get_projector
+from loader_helpers import loads_json
+from metrics import REGISTRY
+
+tweets_received = REGISTRY.counter("tm_tweets_received_total", "Number of tweets received from the stream.")
+actions_queued = REGISTRY.counter("tm_actions_queued_total", "Number of index actions queued for Elasticsearch.")
+originals_skipped = REGISTRY.counter("tm_originals_skipped_total", "Number of retweeted originals skipped by the dedup cache.")
+batch_age_seconds = REGISTRY.histogram("tm_batch_age_seconds", "Time between the first tweet of a batch and its flush.")
 
 
 class TwitterMonitorStreamListener(tweepy.StreamListener):
@@ -14,20 +26,56 @@ class TwitterMonitorStreamListener(tweepy.StreamListener):
     https://developer.twitter.com/en/docs/tweets/data-dictionary/overview/tweet-object.html
     '''
     
-    def __init__(self, es, config):
+    def __init__(self, es, config, dedup_cache=None):
         super(TwitterMonitorStreamListener, self).__init__()
         
         self.es = es
         self.config = config
+        self.dedup_cache = dedup_cache
+        self.projector = get_projector(config)
         self.batch = []
         self.batch_ids = set()
         self.received_data = False
+        self.batch_started = None
+        self.lock = threading.RLock()
+        self.spool = BatchSpool(config.spool_filepath) if config.spool_filepath else None
+        self.flusher = BulkFlusher(es, config, self.spool, dedup_cache) if config.elasticsearch_async_flush else None
+
+        #flush partially filled batches once they are older than the max flush latency
+        self.stop_event = threading.Event()
+        self.latency_thread = None
+        if config.elasticsearch_max_flush_latency_ms > 0:
+            self.latency_thread = threading.Thread(target=self._flush_on_latency, name="LatencyFlusher", daemon=True)
+            self.latency_thread.start()
+
+    def on_data(self, raw_data):
+        '''
+        Fast path: parse raw stream messages once and process tweets as plain dicts,
+        skipping tweepy's Status model construction
+        '''
+        if not self.config.raw_json_fast_path:
+            return super(TwitterMonitorStreamListener, self).on_data(raw_data)
+
+        try:
+            data = loads_json(raw_data)
+        except ValueError:
+            #the json module is more lenient (e.g. with lone surrogate escapes)
+            data = json.loads(raw_data)
+
+        if "in_reply_to_status_id" in data:
+            return self.process_tweet(data)
+
+        #not a tweet (delete, limit, disconnect, warning, ...) - let tweepy dispatch it
+        return super(TwitterMonitorStreamListener, self).on_data(raw_data)
 
     def on_status(self, status):
+        return self.process_tweet(status._json)
+
+    def process_tweet(self, json_dict):
         '''
         Extract info from tweets
         '''
-        json_dict = status._json
+        tweets_received.inc()
         retweet_json_dict = None
 
         if "retweeted_status" in json_dict:
@@ -49,29 +97,99 @@ class TwitterMonitorStreamListener(tweepy.StreamListener):
             #pull original out into its own dict (this will be persisted to ES separately)
             json_dict = json_dict["retweeted_status"]
 
-        tweet_id = json_dict["id_str"]
-        if tweet_id not in self.batch_ids:
-            self.batch.append({"_op_type": "index", "_id": tweet_id, "_source": json_dict})
-            self.batch_ids.add(tweet_id)
-            logging.info("Queued tweet [id={0}]: \"{1}\"".format(tweet_id, json_dict["text"]))
-
-        if retweet_json_dict is not None:
-            retweet_id = retweet_json_dict["id_str"]
-            if retweet_id not in self.batch_ids:
-                self.batch.append({"_op_type": "index", "_id": retweet_id, "_source": retweet_json_dict})
-                self.batch_ids.add(retweet_id)
-                logging.info("Queued retweet [id={0}] for original tweet id: {1}".format(retweet_id, tweet_id))
-    
-        if len(self.batch) >= self.config.elasticsearch_batch_size:
-            bulk(self.es, self.batch, index=self.config.elasticsearch_index_name, chunk_size=len(self.batch))
-            self.batch.clear()
-            self.batch_ids.clear()
+        if self.projector is not None:
+            json_dict = self.projector.project(json_dict)
+            if retweet_json_dict is not None:
+                retweet_json_dict = self.projector.project(retweet_json_dict)
+
+        with self.lock:
+            if len(self.batch) == 0:
+                self.batch_started = time.monotonic()
+
+            tweet_id = json_dict["id_str"]
+            op_type = "index"
+            if self.dedup_cache is not None:
+                #retweeted originals that were indexed recently are skipped (or only created if missing).
+                #tweets are only recorded in the cache once their batch is indexed (see index_batch)
+                if retweet_json_dict is not None:
+                    op_type = self.dedup_cache.get_op_type(tweet_id)
+                if op_type is None:
+                    originals_skipped.inc()
+                    logging.info("Skipped recently indexed original tweet [id={0}]".format(tweet_id))
+            if op_type is not None and tweet_id not in self.batch_ids:
+                self.batch.append({"_op_type": op_type, "_id": tweet_id, "_source": json_dict})
+                self.batch_ids.add(tweet_id)
+                actions_queued.inc()
+                logging.info("Queued tweet [id={0}]: \"{1}\"".format(tweet_id, json_dict.get("text")))
+
+            if retweet_json_dict is not None:
+                retweet_id = retweet_json_dict["id_str"]
+                if retweet_id not in self.batch_ids:
+                    self.batch.append({"_op_type": "index", "_id": retweet_id, "_source": retweet_json_dict})
+                    self.batch_ids.add(retweet_id)
+                    actions_queued.inc()
+                    logging.info("Queued retweet [id={0}] for original tweet id: {1}".format(retweet_id, tweet_id))
+        
+            if len(self.batch) >= self.config.elasticsearch_batch_size:
+                self.flush()
 
         if not self.received_data:
             self.received_data = True
 
         return True
     
+    def flush(self):
+        '''
+        Send the current batch to Elasticsearch, or hand it to the background flusher in async mode.
+        If the bulk request fails and a spool is configured, the batch is spooled to disk instead.
+        '''
+        with self.lock:
+            if len(self.batch) == 0:
+                return
+            batch = list(self.batch)
+            self.batch.clear()
+            self.batch_ids.clear()
+            if self.batch_started is not None:
+                batch_age_seconds.observe(time.monotonic() - self.batch_started)
+            self.batch_started = None
+
+            if self.flusher is not None:
+                self.flusher.submit(batch)
+                return
+            try:
+                index_batch(self.es, batch, self.config, self.dedup_cache)
+            except Exception as ex:
+                if self.spool is None:
+                    raise
+                logging.exception("Exception occurred while flushing a batch of {0} actions.".format(len(batch)))
+                self.spool.append(batch)
+
+    def close(self):
+        '''
+        Flush any buffered tweets and stop the background flusher
+        '''
+        self.stop_event.set()
+        if self.latency_thread is not None:
+            self.latency_thread.join()
+            self.latency_thread = None
+        try:
+            self.flush()
+        finally:
+            if self.flusher is not None:
+                self.flusher.close()
+                self.flusher = None
+
     def on_error(self, status_code):
         logging.error("Received error status code {0} from Twitter.".format(status_code))
-        return True
\ No newline at end of file
+        return True
+
+    def _flush_on_latency(self):
+        max_latency_secs = self.config.elasticsearch_max_flush_latency_ms / 1000
+        while not self.stop_event.wait(max_latency_secs / 4):
+            try:
+                with self.lock:
+                    if self.batch_started is not None and time.monotonic() - self.batch_started >= max_latency_secs:
+                        logging.info("Flushing {0} actions after reaching the max flush latency...".format(len(self.batch)))
+                        self.flush()
+            except Exception as ex:
+                logging.exception("Exception occurred while flushing on max latency.")
\ No newline at end of file
@@ -5,10 +5,13 @@ import argparse
 import time
 import tweepy
 import logging
-from elasticsearch import Elasticsearch
+import es_client
+import metrics
 from setup_index import verify_or_setup_index
 from config import Config
 from tm_stream_listener import TwitterMonitorStreamListener
+from tm_spool import BatchSpool
+from tm_dedup_cache import RecentIdCache
 
 def start():
     #load the args & config
@@ -27,15 +30,19 @@ def start():
     print()
 
     #Verify or setup the elasticsearch index
-    es = Elasticsearch(hosts=[config.elasticsearch_host], 
-                    verify_certs=config.elasticsearch_verify_certs,
-                    timeout=config.elasticsearch_timeout_secs)
+    es = es_client.create_client_from_config(config, max_connections=config.elasticsearch_flush_threads + 1)
 
     index_result = verify_or_setup_index(es, config)
     logging.info(index_result)
     print(index_result)
     print()
 
+    #serve ingest metrics
+    if config.metrics_port > 0:
+        metrics.start_metrics_server(config.metrics_port)
+        print("Serving metrics at http://127.0.0.1:{0}/metrics".format(config.metrics_port))
+        print()
+
     #load the credentials and initialize tweepy
     auth  = tweepy.OAuthHandler(config.api_key, config.api_secret_key)
     auth.set_access_token(config.access_token, config.access_token_secret)
@@ -43,10 +50,21 @@ def start():
 
     #listen to the stream API
 
+    dedup_cache = RecentIdCache.from_config(config)
     restart_attempts = 0
     while True:
+        #replay anything spooled while Elasticsearch was unavailable
+        if config.spool_filepath:
+            try:
+                replayed = BatchSpool(config.spool_filepath).replay(es, config)
+                if replayed > 0:
+                    logging.warning("Replayed {0} spooled actions.".format(replayed))
+                    print("Replayed {0} spooled actions.".format(replayed))
+            except Exception as ex:
+                logging.exception("Exception occurred while replaying the spool.")
+
         try:
-            streamListener = TwitterMonitorStreamListener(es, config)
+            streamListener = TwitterMonitorStreamListener(es, config, dedup_cache)
             stream = tweepy.Stream(auth=api.auth, listener=streamListener)
             print("Listening for tweets...")
             print()
@@ -56,6 +74,17 @@ def start():
             logging.exception("Exception occurred while listening.")
             if streamListener.received_data:
                 restart_attempts = 0
+        finally:
+            #flush whatever is still buffered before the listener is replaced
+            try:
+                streamListener.close()
+            except Exception as ex:
+                logging.exception("Exception occurred while flushing the listener.")
+            if dedup_cache is not None and config.dedup_cache_filepath:
+                try:
+                    dedup_cache.save(config.dedup_cache_filepath)
+                except Exception as ex:
+                    logging.exception("Exception occurred while saving the dedup cache.")
         
         restart_attempts += 1
         if config.restart_attempts > -1 and restart_attempts > config.restart_attempts: